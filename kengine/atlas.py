@@ -0,0 +1,244 @@
+"""
+An atlas of XRates tables anchored at many operating points.
+
+A single XRates table is a linearisation, so it is only any good close to
+its reference point. The atlas holds a whole set of them and answers a
+query from the tables anchored within a fixed radius of it: each of
+those makes its own linear prediction, and the predictions are blended
+with the modified Shepard (Franke-Little) weights
+
+    w = ((radius - d) / (radius * d))**power    for d < radius
+
+which go to zero at the edge of the radius, so a table fades out
+smoothly as a query moves away from it instead of dropping out of the
+blend, and which blow up at d = 0, so a query right on an anchor gets
+that table alone. A query further than the radius from every anchor
+(well outside the atlas) is answered by the nearest table on its own.
+
+Distances are measured with each input scaled by the spread of the
+anchors, so that inputs with big numbers (flows, temperatures) don't
+swamp the small ones (pressure ratios). The radius defaults to twice the
+largest distance from any anchor to its nearest neighbour, which is
+enough to cover the gaps between anchors.
+
+Anchors are looked up through a uniform grid with cells the size of the
+radius: a query only looks at the anchors in its own cell and the ones
+next to it (3**inputs cells), so it costs about the same however many
+anchors there are, provided they're spread evenly. Working out the
+default radius compares every pair of anchors once, when the atlas is
+set up, and the nearest-table fallback is a brute-force search over all
+the anchors, for the queries that need it. Queries are done in blocks,
+to bound the memory.
+
+The tables live in three arrays, which is also how an atlas is saved:
+
+    X0  (anchors, inputs)            reference inputs
+    Y0  (anchors, outputs)           reference outputs
+    R   (anchors, outputs, inputs)   rates
+"""
+import itertools
+
+import numpy as np
+
+from xcrates import XRates
+
+
+class XRatesAtlas(object):
+    def __init__(self, tables, radius=None, power=2.0):
+        """
+        tables: a list of XRates with the same inputs and outputs.
+        radius: how far (in scaled inputs) a table reaches.
+        power: the weighting exponent.
+        """
+        first = tables[0]
+        self.inputs = list(first.xheader)
+        self.outputs = sorted(first.outputs_orig)
+        for table in tables:
+            if (set(table.xheader) != set(self.inputs) or
+                set(table.outputs_orig) != set(self.outputs)):
+                raise ValueError('Atlas tables must share inputs and outputs')
+
+        X0 = np.array([[t.inputs_orig[x] for x in self.inputs] for t in tables], dtype=float)
+        Y0 = np.array([[t.outputs_orig[y] for y in self.outputs] for t in tables], dtype=float)
+        R = np.array([[[t.xrates[y][list(t.xheader).index(x)] for x in self.inputs]
+                       for y in self.outputs] for t in tables], dtype=float)
+        self.setup(X0, Y0, R, radius, power)
+
+    def setup(self, X0, Y0, R, radius, power, block=1024):
+        self.X0, self.Y0, self.R = X0, Y0, R
+        self.power = power
+        # an input the anchors don't spread over at all counts for nothing
+        # in the distances; the rates take care of it
+        scale = X0.max(axis=0) - X0.min(axis=0)
+        self.scale = np.where(scale > 0, scale, np.inf)
+        self.points = X0 / self.scale
+        if radius is None:
+            radius = 2 * self.spacing(block)
+        self.radius = radius
+        self.grid()
+
+    def spacing(self, block):
+        """The largest distance from any anchor to its nearest neighbour."""
+        points = self.points
+        if len(points) < 2:
+            return 0.5
+        largest = 0.0
+        for start in range(0, len(points), block):
+            d2 = ((points[start:start+block, np.newaxis, :] -
+                   points[np.newaxis, :, :])**2).sum(axis=2)
+            d2[np.arange(len(d2)), np.arange(start, start+len(d2))] = np.inf
+            largest = max(largest, d2.min(axis=1).max()**0.5)
+        return largest or 0.5
+
+    def grid(self):
+        """
+        Sorts the anchors by the grid cell they're in, keyed by the cell's
+        position in a box with a spare cell all round.
+        """
+        cells = np.floor(self.points / self.radius).astype(int)
+        self.origin = cells.min(axis=0) - 1
+        self.shape = tuple(cells.max(axis=0) - self.origin + 2)
+        keys = np.ravel_multi_index((cells - self.origin).T, self.shape)
+        self.order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[self.order]
+        counts = np.unique(self.keys, return_counts=True)[1]
+        # the most anchors in any one cell
+        self.fill = counts.max()
+        self.offsets = np.array(list(itertools.product((-1, 0, 1), repeat=len(self.inputs))))
+
+    @classmethod
+    def from_engine(cls, engine, anchors, perturbations, outputs=None, **settings):
+        """
+        Builds the tables by finite differences on an engine, with every
+        anchor calculated at once: anchors is a dict of input arrays (one
+        entry per anchor) and perturbations a dict of step sizes for the
+        same inputs. That's one vectorised engine call per input, plus one.
+        """
+        names = sorted(anchors)
+        count = np.broadcast(*[np.asarray(anchors[x]) for x in names]).size
+        base_inputs = dict([(x, np.array(np.broadcast_to(anchors[x], (count,)), dtype=float))
+                            for x in names])
+        base = engine.calculate(base_inputs)
+        outputs = sorted(outputs or base)
+        base = dict([(y, np.broadcast_to(base[y], (count,))) for y in outputs])
+
+        rates = dict([(y, np.empty((count, len(names)))) for y in outputs])
+        for j, x in enumerate(names):
+            perturbed = dict(base_inputs)
+            perturbed[x] = base_inputs[x] + perturbations[x]
+            results = engine.calculate(perturbed)
+            for y in outputs:
+                rates[y][:, j] = (results[y] - base[y]) / perturbations[x]
+
+        tables = []
+        for i in range(count):
+            tables.append(XRates(dict([(x, base_inputs[x][i]) for x in names]),
+                                 dict([(y, float(base[y][i])) for y in outputs]),
+                                 names,
+                                 dict([(y, list(rates[y][i])) for y in outputs])))
+        return cls(tables, **settings)
+
+    def table(self, i):
+        """The XRates table of one anchor."""
+        return XRates(dict(zip(self.inputs, self.X0[i])),
+                      dict(zip(self.outputs, self.Y0[i])),
+                      list(self.inputs),
+                      dict([(y, list(self.R[i, k])) for k, y in enumerate(self.outputs)]))
+
+    def candidates(self, Q):
+        """
+        Indices of the anchors in and around the grid cell of each row of
+        Q, shaped (queries, candidates), padded with -1.
+        """
+        cells = np.floor(Q / self.radius).astype(int) - self.origin
+        # (queries, 3**inputs, inputs)
+        around = cells[:, np.newaxis, :] + self.offsets[np.newaxis, :, :]
+        inside = np.all((around >= 0) & (around < self.shape), axis=2)
+        keys = np.ravel_multi_index(np.moveaxis(around, 2, 0), self.shape, mode='clip')
+        first = np.searchsorted(self.keys, keys, 'left')
+        count = np.where(inside, np.searchsorted(self.keys, keys, 'right') - first, 0)
+        slots = np.arange(self.fill)
+        positions = first[:, :, np.newaxis] + slots
+        found = np.where(slots < count[:, :, np.newaxis],
+                         self.order[np.minimum(positions, len(self.order) - 1)], -1)
+        return found.reshape(len(Q), -1)
+
+    def nearest(self, Q, block=4096):
+        """The index of the nearest anchor to each row of Q."""
+        indices = np.empty(len(Q), dtype=int)
+        for start in range(0, len(Q), block):
+            d2 = ((Q[start:start+block, np.newaxis, :] -
+                   self.points[np.newaxis, :, :])**2).sum(axis=2)
+            indices[start:start+block] = d2.argmin(axis=1)
+        return indices
+
+    def blend(self, P):
+        """Blended predictions for each row of P, (queries, outputs)."""
+        Q = P / self.scale
+        indices = self.candidates(Q)
+        known = indices >= 0
+        indices = np.where(known, indices, 0)
+        distances = (((Q[:, np.newaxis, :] - self.points[indices])**2).sum(axis=2))**0.5
+        reach = known & (distances < self.radius)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = np.where(reach, (self.radius - distances) /
+                               (self.radius * distances), 0.0)**self.power
+        exact = reach & (distances == 0)
+        on_anchor = exact.any(axis=1)
+        weights[on_anchor] = exact[on_anchor]
+
+        # out of reach of every table: the nearest one alone
+        alone = ~reach.any(axis=1)
+        if alone.any():
+            indices[alone] = 0
+            indices[alone, 0] = self.nearest(Q[alone])
+            weights[alone] = 0.0
+            weights[alone, 0] = 1.0
+        weights /= weights.sum(axis=1)[:, np.newaxis]
+
+        # each table's own linear prediction, only where it has a say
+        rows, columns = np.nonzero(weights)
+        anchors = indices[rows, columns]
+        dx = P[rows] - self.X0[anchors]
+        predictions = self.Y0[anchors] + np.einsum('pod,pd->po', self.R[anchors], dx)
+        share = weights[rows, columns]
+        blended = np.empty((len(P), len(self.outputs)))
+        for k in range(len(self.outputs)):
+            blended[:, k] = np.bincount(rows, share * predictions[:, k], len(P))
+        return blended
+
+    def calculate(self, inputs, block=256):
+        """
+        Same interface as XRates.calculate: a dict with a value (or an
+        array of values) for every input, and a dict of outputs back.
+        """
+        assert set(inputs) == set(self.inputs)
+        values = [np.asarray(inputs[x], dtype=float) for x in self.inputs]
+        shape = np.broadcast(*values).shape
+        P = np.column_stack([np.broadcast_to(v, shape).ravel() for v in values])
+
+        blended = np.empty((len(P), len(self.outputs)))
+        for start in range(0, len(P), block):
+            blended[start:start+block] = self.blend(P[start:start+block])
+        outputs = {}
+        for k, y in enumerate(self.outputs):
+            value = blended[:, k].reshape(shape)
+            outputs[y] = float(value) if not shape else value
+        return outputs
+
+    def save(self, path):
+        """Saves the atlas as a compressed .npz file."""
+        np.savez_compressed(path, X0=self.X0, Y0=self.Y0, R=self.R,
+                            inputs=np.array(self.inputs), outputs=np.array(self.outputs),
+                            radius=self.radius, power=self.power)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        atlas = cls.__new__(cls)
+        atlas.inputs = [str(x) for x in data['inputs']]
+        atlas.outputs = [str(y) for y in data['outputs']]
+        atlas.setup(data['X0'], data['Y0'], data['R'],
+                    float(data['radius']), float(data['power']))
+        return atlas
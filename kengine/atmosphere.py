@@ -0,0 +1,74 @@
+"""
+The International Standard Atmosphere (ISA), up to 84km geopotential
+altitude.
+
+Each layer has a constant lapse rate, so within a layer the temperature
+is linear in altitude and the pressure follows in closed form from the
+layer base. The base temperatures and pressures are worked out once,
+when the module is imported, and each lookup is then a searchsorted to
+find the layer plus one closed-form expression. That is exact and
+cheaper than interpolating a fine table. Everything takes scalars or
+numpy arrays.
+
+Temperature deviations (deltaISA) shift the temperature at every
+altitude but leave the pressure-altitude relationship alone, which is
+the usual convention for off-standard days.
+"""
+import numpy as np
+
+G0 = 9.80665        # m/s^2
+R_AIR = 287.05287   # J/kg/K
+T_SL = 288.15       # K
+P_SL = 101325.0     # Pa
+
+# layer base altitudes [m] and lapse rates [K/m]
+LAYER_BASES = np.array([0.0, 11000.0, 20000.0, 32000.0, 47000.0, 51000.0, 71000.0])
+LAPSE_RATES = np.array([-0.0065, 0.0, 0.001, 0.0028, 0.0, -0.0028, -0.002])
+MAX_ALTITUDE = 84852.0
+
+def _layer_bases():
+    temperatures = [T_SL]
+    pressures = [P_SL]
+    for i in range(len(LAYER_BASES) - 1):
+        t, p = _in_layer(LAYER_BASES[i+1], LAYER_BASES[i], LAPSE_RATES[i],
+                         temperatures[i], pressures[i])
+        temperatures.append(t)
+        pressures.append(p)
+    return np.array(temperatures), np.array(pressures)
+
+def _in_layer(h, base, lapse, t_base, p_base):
+    dh = h - base
+    t = t_base + lapse*dh
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gradient = p_base * (t_base/t)**(G0/(lapse*R_AIR))
+    isothermal = p_base * np.exp(-G0*dh/(R_AIR*t_base))
+    return t, np.where(lapse == 0.0, isothermal, gradient)
+
+LAYER_TEMPERATURES, LAYER_PRESSURES = _layer_bases()
+
+
+def isa(altitude, delta_isa=0.0):
+    """
+    Static (temperature [K], pressure [Pa]) at a geopotential altitude [m].
+    """
+    h = np.asarray(altitude, dtype=float)
+    if np.any(h < -5000.0) or np.any(h > MAX_ALTITUDE):
+        raise ValueError('Altitude outside the standard atmosphere')
+    layer = np.clip(np.searchsorted(LAYER_BASES, h, side='right') - 1,
+                    0, len(LAYER_BASES) - 1)
+    t, p = _in_layer(h, LAYER_BASES[layer], LAPSE_RATES[layer],
+                     LAYER_TEMPERATURES[layer], LAYER_PRESSURES[layer])
+    t = t + delta_isa
+    if t.ndim == 0:
+        return float(t), float(p)
+    return t, p
+
+def temperature(altitude, delta_isa=0.0):
+    return isa(altitude, delta_isa)[0]
+
+def pressure(altitude):
+    return isa(altitude)[1]
+
+def density(altitude, delta_isa=0.0):
+    t, p = isa(altitude, delta_isa)
+    return p / (R_AIR * t)
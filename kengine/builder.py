@@ -0,0 +1,376 @@
+"""
+Builds EngineAssembly objects from declarative JSON definitions rather
+than hand-written __init__ methods. A definition for the TurboJet looks
+like this:
+
+{
+ "components": {
+   "INTAKE":    {"type": "Intake", "attributes": {"W": 1.0}, "exit": "2"},
+   "HPC":       {"type": "Compressor", "attributes": {"PR": 40.0},
+                 "inlet": "2", "exit": "3"},
+   "COMBUSTOR": {"type": "Combustor",
+                 "attributes": {"TEX": 1600.0, "FHV": 45.0e6},
+                 "inlet": "3", "exit": "4"},
+   "HPT":       {"type": "Turbine", "inlet": "4", "exit": "5"},
+   "NOZ":       {"type": "Nozzle", "inlet": "5"}
+ },
+ "stations": ["2", "3", "4", "5"],
+ "shafts": {
+   "HPSHAFT": {"name": "hp_shaft", "turbine": "HPT", "driven": ["HPC"]}
+ },
+ "inputs": {
+   "HPCPR": {"path": ["HPC", "PR"], "min": 10.0, "max": 25.0}
+ },
+ "outputs": {
+   "THRUST": ["ENGINE", "THRUST"]
+ },
+ "environment": {"p": 30000.0, "t": 300.0, "w": 1.0}
+}
+
+The Splitter uses "core" and "bypass" for its two exits, and the Mixer
+takes "inlet" and "return" for the main and recirculating flows.
+
+The builder checks the topology before wiring anything up: every
+station needs exactly one upstream and one downstream component, every
+turbine needs a shaft, and the component graph must be acyclic apart
+from loops closed through a Mixer's return port. The components are
+then built in topological order, and the order is kept on the engine as
+engine.calculation_order. Any recirculation loops are torn at build
+time (see Engine.tear_cycles), so cached engines come ready-torn.
+
+Checking and wiring is the slow part when generating lots of variants,
+so the builder can keep a cache directory. The fully wired engine is
+pickled against a hash of the definition text and of the kengine
+sources, and later loads of the same definition just unpickle a fresh
+copy. Any change to the code makes a new key, so old entries are never
+picked up by code that would build something different.
+
+Unpickling runs code, so the cache is kept private: the directory is
+created readable by its owner only, and entries are only read (or
+written) if the directory and the entry belong to the current user and
+nobody else can write to them. Otherwise the cache is left alone and the
+engine is built from the definition.
+"""
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import cPickle as pickle
+
+from engines import EngineAssembly
+import performance
+
+# bump this if the meaning of a definition changes so that stale
+# cache entries are not picked up (changes to the code are caught by
+# source_hash anyway)
+FORMAT_VERSION = 5
+
+_source_hash = None
+
+def source_hash():
+    """A hash of the kengine sources, worked out once."""
+    global _source_hash
+    if _source_hash is None:
+        h = hashlib.sha1()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(here)):
+            if name.endswith('.py'):
+                with open(os.path.join(here, name), 'rb') as f:
+                    h.update('%s\n%s' % (name, f.read()))
+        _source_hash = h.hexdigest()
+    return _source_hash
+
+def private(path):
+    """True if path belongs to the current user and nobody else can write to it."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+COMPONENT_TYPES = {
+    'Intake': performance.Intake,
+    'Compressor': performance.Compressor,
+    'Splitter': performance.Splitter,
+    'Combustor': performance.Combustor,
+    'Turbine': performance.Turbine,
+    'Nozzle': performance.Nozzle,
+    'Mixer': performance.Mixer,
+}
+
+# station connections for each component type: (upstream, downstream)
+PORTS = {
+    'Intake': ((), ('exit',)),
+    'Compressor': (('inlet',), ('exit',)),
+    'Splitter': (('inlet',), ('core','bypass')),
+    'Combustor': (('inlet',), ('exit',)),
+    'Turbine': (('inlet',), ('exit',)),
+    'Nozzle': (('inlet',), ()),
+    'Mixer': (('inlet','return'), ('exit',)),
+}
+
+# upstream ports that may close a loop (recirculating flows)
+RETURN_PORTS = ('return',)
+
+
+class DefinitionError(Exception):
+    """Raised when an engine definition is incomplete or inconsistent."""
+    pass
+
+
+class EngineBuilder(object):
+    """
+    Turns engine definitions (see the module docstring) into wired-up
+    EngineAssembly objects, optionally caching the compiled result on disk.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def load(self, path):
+        """Build (or fetch from the cache) the engine defined in a file."""
+        with open(path) as f:
+            return self.loads(f.read())
+
+    def loads(self, text):
+        """Build (or fetch from the cache) the engine defined in a string."""
+        cache_path = self.cache_path(text)
+        if cache_path is not None and private(cache_path):
+            with open(cache_path, 'rb') as f:
+                engine = pickle.load(f)
+            self.cache_hits += 1
+            return engine
+
+        self.cache_misses += 1
+        engine = self.build(json.loads(text))
+
+        if cache_path is not None:
+            # write then rename so that concurrent loaders never see a
+            # half-written cache entry; mkstemp makes it owner-only
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(engine, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, cache_path)
+        return engine
+
+    def cache_path(self, text):
+        """
+        Where the definition's cache entry goes, or None if there is no
+        cache directory or it isn't private (see the module docstring).
+        """
+        if self.cache_dir is None:
+            return None
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0700)
+        if not private(self.cache_dir):
+            return None
+        key = hashlib.sha1('%i\n%s\n%s' % (FORMAT_VERSION, source_hash(), text)).hexdigest()
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def build(self, definition):
+        """
+        Validates the definition and wires up a new EngineAssembly.
+        """
+        order = self.validate(definition)
+        components = definition['components']
+
+        engine = EngineAssembly()
+        for name in definition.get('stations', []):
+            engine.stations[name] = performance.Station(name)
+
+        for ident in order:
+            spec = components[ident]
+            cls = COMPONENT_TYPES[spec['type']]
+            engine[ident] = cls(dict(spec.get('attributes', {})),
+                                name=spec.get('name'))
+
+        stns = engine.stations
+        for ident in order:
+            spec = components[ident]
+            component = engine[ident]
+            ports = [spec[p] for p in self.ports(spec)]
+            if spec['type'] == 'Intake':
+                component.connect_downstream(stns[ports[0]])
+            elif spec['type'] == 'Nozzle':
+                component.connect_upstream(stns[ports[0]])
+            else:
+                component.connect_stations(*[stns[p] for p in ports])
+
+        for ident, spec in sorted(definition.get('shafts', {}).items()):
+            shaft = performance.Shaft(name=spec.get('name'))
+            engine[ident] = shaft
+            shaft.add_turbine(engine[spec['turbine']])
+            for driven in spec['driven']:
+                shaft.add_driven(engine[driven])
+
+        for alias, spec in sorted(definition.get('inputs', {}).items()):
+            engine.add_input_alias(alias, tuple(spec['path']),
+                                   min=spec.get('min'), max=spec.get('max'))
+        for alias, path in sorted(definition.get('outputs', {}).items()):
+            engine.add_output_alias(alias, tuple(path))
+
+        env = engine.environment
+        for k, v in definition.get('environment', {}).items():
+            if k in ('p', 't', 'w'):
+                setattr(env, k, v)
+            else:
+                env.attributes[k] = v
+
+        engine.calculation_order = order
+        engine.tear_cycles()
+        return engine
+
+    def ports(self, spec):
+        upstream, downstream = PORTS[spec['type']]
+        return upstream + downstream
+
+    def validate(self, definition):
+        """
+        Checks the definition and returns the component idents in
+        topological (calculation) order. Raises DefinitionError on the
+        first problem found.
+        """
+        components = definition.get('components', {})
+        stations = definition.get('stations', [])
+        shafts = definition.get('shafts', {})
+
+        if len(set(stations)) != len(stations):
+            raise DefinitionError('Station names must be unique')
+        for ident in shafts:
+            if ident in components:
+                raise DefinitionError('Shaft ident clashes with component: %s' % ident)
+
+        producers = {}
+        consumers = {}
+        returns = set()
+        for ident, spec in sorted(components.items()):
+            ctype = spec.get('type')
+            if ctype not in COMPONENT_TYPES:
+                raise DefinitionError('Unknown component type for %s: %s' % (ident, ctype))
+            upstream, downstream = PORTS[ctype]
+            for port in upstream + downstream:
+                if port not in spec:
+                    raise DefinitionError('%s is missing its %s station' % (ident, port))
+                if spec[port] not in stations:
+                    raise DefinitionError('%s refers to unknown station: %s' % (ident, spec[port]))
+            for port in upstream:
+                if spec[port] in consumers:
+                    raise DefinitionError('Station %s feeds both %s and %s'
+                                          % (spec[port], consumers[spec[port]], ident))
+                consumers[spec[port]] = ident
+                if port in RETURN_PORTS:
+                    returns.add(spec[port])
+            for port in downstream:
+                if spec[port] in producers:
+                    raise DefinitionError('Station %s is fed by both %s and %s'
+                                          % (spec[port], producers[spec[port]], ident))
+                producers[spec[port]] = ident
+
+        for name in stations:
+            if name not in producers:
+                raise DefinitionError('Station %s has no upstream component' % name)
+            if name not in consumers:
+                raise DefinitionError('Station %s has no downstream component' % name)
+
+        types = dict([(ident, spec['type']) for ident, spec in components.items()])
+        intakes = [i for i in types if types[i] == 'Intake']
+        if len(intakes) != 1:
+            raise DefinitionError('Need exactly one Intake, found %i' % len(intakes))
+        if not any(types[i] == 'Nozzle' for i in types):
+            raise DefinitionError('Need at least one Nozzle')
+        if types.get('COMBUSTOR') != 'Combustor':
+            raise DefinitionError('Thrust calculation needs a Combustor called COMBUSTOR')
+
+        # component graph: flows through stations plus driven -> turbine.
+        # Returning flows are left out, they are the loops we can tear.
+        edges = dict([(ident, set()) for ident in components])
+        for name in stations:
+            if name not in returns:
+                edges[producers[name]].add(consumers[name])
+
+        driving = {}
+        for ident, spec in sorted(shafts.items()):
+            turbine = spec.get('turbine')
+            if types.get(turbine) != 'Turbine':
+                raise DefinitionError('Shaft %s must be driven by a Turbine' % ident)
+            if turbine in driving:
+                raise DefinitionError('Turbine %s drives both %s and %s'
+                                      % (turbine, driving[turbine], ident))
+            driving[turbine] = ident
+            if not spec.get('driven'):
+                raise DefinitionError('Shaft %s has nothing to drive' % ident)
+            for driven in spec['driven']:
+                if types.get(driven) != 'Compressor':
+                    raise DefinitionError('Shaft %s can only drive compressors: %s'
+                                          % (ident, driven))
+                edges[driven].add(turbine)
+
+        for ident in types:
+            if types[ident] == 'Turbine' and ident not in driving:
+                raise DefinitionError('Turbine %s is not on a shaft' % ident)
+
+        order = self.topological_order(edges)
+
+        # everything must be fed (eventually) by the intake
+        reached = set(intakes)
+        for ident in order:
+            if ident in reached:
+                reached.update(edges[ident])
+        for name in returns:
+            if producers[name] not in reached:
+                raise DefinitionError('Return flow %s is not fed from the intake' % name)
+        if len(reached) != len(components):
+            raise DefinitionError('Not connected to the intake: %s'
+                                  % ', '.join(sorted(set(components) - reached)))
+
+        known = set(components) | set(shafts) | set(['ENGINE'])
+        for alias, spec in sorted(definition.get('inputs', {}).items()):
+            path = spec.get('path', [])
+            if len(path) != 2 or path[0] not in components:
+                raise DefinitionError('Bad path for input %s: %s' % (alias, path))
+            if path[1] not in components[path[0]].get('attributes', {}):
+                raise DefinitionError('Input %s: %s has no attribute %s'
+                                      % (alias, path[0], path[1]))
+            _min, _max = spec.get('min'), spec.get('max')
+            if _min is not None and _max is not None and _min > _max:
+                raise DefinitionError('Input %s has min > max' % alias)
+        for alias, path in sorted(definition.get('outputs', {}).items()):
+            if not path or path[0] not in known:
+                raise DefinitionError('Bad path for output %s: %s' % (alias, path))
+
+        return order
+
+    def topological_order(self, edges):
+        """
+        Kahn's algorithm over {ident: set(downstream idents)}. Ties are
+        broken alphabetically so that the order is repeatable.
+        """
+        indegree = dict([(n, 0) for n in edges])
+        for n in edges:
+            for m in edges[n]:
+                indegree[m] += 1
+
+        ready = sorted([n for n in edges if indegree[n] == 0])
+        order = []
+        while ready:
+            n = ready.pop(0)
+            order.append(n)
+            for m in sorted(edges[n]):
+                indegree[m] -= 1
+                if indegree[m] == 0:
+                    ready.append(m)
+            ready.sort()
+
+        if len(order) != len(edges):
+            raise DefinitionError('Component graph has a cycle through: %s'
+                                  % ', '.join(sorted(set(edges) - set(order))))
+        return order
+
+
+def load_engine(path, cache_dir=None):
+    """Convenience wrapper around EngineBuilder.load."""
+    return EngineBuilder(cache_dir).load(path)
@@ -7,3 +7,16 @@ def acrit(WRTP):
 
 def rho_RHO(Mach):
     return (1 + (gamma-1)/2 * Mach**2)**(-1/(gamma-1))
+
+def t_T(Mach):
+    return (1 + (gamma-1)/2 * Mach**2)**(-1)
+
+def p_P(Mach):
+    return (1 + (gamma-1)/2 * Mach**2)**(-gamma/(gamma-1))
+
+def q(Mach):
+    """Flow function W*sqrt(T)/(A*P), in terms of total conditions."""
+    return (gamma/R)**0.5 * Mach * (1 + (gamma-1)/2 * Mach**2)**(-(gamma+1)/(2*(gamma-1)))
+
+def q_choke():
+    return q(1.0)
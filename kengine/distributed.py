@@ -0,0 +1,330 @@
+"""
+Farming large engine sweeps out to worker processes, on this machine or
+on others.
+
+The Coordinator serves a task queue and a result queue over TCP with
+multiprocessing.managers. The inputs are cut into chunks and put on the
+task queue. Workers connect, build their engine once, then repeatedly
+pull a chunk, evaluate it and post the result. Because idle workers
+pull the next chunk themselves, fast machines naturally take more of
+the work. When the queue runs dry, chunks that have been running much
+longer than usual are put back on the queue for an idle worker to take
+over, and whichever copy finishes first wins.
+
+Chunks that raise in the worker are retried, up to max_retries times.
+While a worker evaluates a chunk it sends a heartbeat every fifth of
+lease_timeout, and each one renews its lease on the chunk, so a chunk
+can take as long as it needs. A chunk whose lease runs out (its worker
+died or hung) is lost and is put back on the queue; that is counted
+separately from failures, and the sweep gives up on a chunk that has
+been lost more than max_retries times. Once the task queue is empty, a
+chunk that nobody has reported starting (its worker died on the way)
+is leased too, so it isn't lost for good. If nothing at all is heard
+from the workers for idle_timeout, the sweep gives up with a
+SweepError. The results come back as one columnar dict of arrays in
+the original input order.
+
+Start a worker on another machine with:
+
+    python distributed.py HOST PORT AUTHKEY module:factory
+
+where module:factory names something that builds the engine, for
+example engines:TurboFan.
+"""
+import Queue
+import os
+import sys
+import threading
+import time
+import traceback
+import multiprocessing
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+
+
+class SweepError(Exception):
+    """
+    Raised when a chunk keeps failing (or keeps being lost) after all of
+    its retries, or when the workers have gone.
+    """
+    pass
+
+
+# these live in the manager's server process
+_tasks = Queue.Queue()
+_results = Queue.Queue()
+
+def _get_tasks():
+    return _tasks
+
+def _get_results():
+    return _results
+
+
+class _CoordinatorManager(BaseManager):
+    pass
+_CoordinatorManager.register('get_tasks', callable=_get_tasks)
+_CoordinatorManager.register('get_results', callable=_get_results)
+
+
+class _WorkerManager(BaseManager):
+    pass
+_WorkerManager.register('get_tasks')
+_WorkerManager.register('get_results')
+
+
+def evaluate_chunk(engine, inputs):
+    """Default chunk evaluation: one vectorised calculate call."""
+    n = len(inputs.values()[0])
+    outputs = engine.calculate(inputs)
+    return dict([(k, np.broadcast_to(v, (n,)).copy()) for k, v in outputs.items()])
+
+
+def _heartbeat(results, chunk_id, attempt, name, interval, finished):
+    """Tells the coordinator that the chunk is still going, until finished is set."""
+    while not finished.wait(interval):
+        try:
+            results.put(('heartbeat', chunk_id, attempt, name, None))
+        except (EOFError, IOError):
+            break
+
+
+def run_worker(address, authkey, factory, evaluate=evaluate_chunk, name=None):
+    """
+    Connects to a coordinator and evaluates chunks until told to stop
+    (or until the coordinator goes away).
+    """
+    if name is None:
+        name = '%s:%i' % (os.uname()[1], os.getpid())
+    manager = _WorkerManager(address=address, authkey=authkey)
+    manager.connect()
+    tasks = manager.get_tasks()
+    results = manager.get_results()
+
+    engine = factory()
+    while True:
+        try:
+            task = tasks.get()
+        except (EOFError, IOError):
+            break
+        if task is None:
+            results.put(('stopped', None, None, name, None))
+            break
+        chunk_id, attempt, interval, inputs = task
+        results.put(('started', chunk_id, attempt, name, None))
+        finished = threading.Event()
+        beat = threading.Thread(target=_heartbeat,
+                                args=(results, chunk_id, attempt, name, interval, finished))
+        beat.daemon = True
+        beat.start()
+        try:
+            outputs = evaluate(engine, inputs)
+        except Exception:
+            results.put(('failed', chunk_id, attempt, name, traceback.format_exc()))
+        else:
+            results.put(('done', chunk_id, attempt, name, outputs))
+        finally:
+            finished.set()
+            beat.join()
+
+
+class Coordinator(object):
+    def __init__(self, address=('', 0), authkey=None, lease_timeout=300.0,
+                 max_retries=3, straggler_factor=3.0, poll=0.1, idle_timeout=600.0):
+        self.authkey = authkey or os.urandom(16)
+        self.manager = _CoordinatorManager(address=address, authkey=self.authkey)
+        self.manager.start()
+        self.address = self.manager.address
+        self.tasks = self.manager.get_tasks()
+        self.results = self.manager.get_results()
+
+        self.lease_timeout = lease_timeout
+        # often enough that a couple can go astray before a lease runs out
+        self.heartbeat = lease_timeout / 5.0
+        self.max_retries = max_retries
+        self.straggler_factor = straggler_factor
+        self.poll = poll
+        self.idle_timeout = idle_timeout
+        self.retries = 0
+        self.lost = 0
+        self.reissued = 0
+        self.sweeps = 0
+
+    def split(self, inputs, chunk_size):
+        n = max([np.size(v) for v in inputs.values()])
+        columns = dict([(k, np.broadcast_to(v, (n,))) for k, v in inputs.items()])
+        chunks = []
+        for start in range(0, n, chunk_size):
+            chunks.append(dict([(k, np.array(v[start:start+chunk_size]))
+                                for k, v in columns.items()]))
+        return columns, chunks
+
+    def run(self, inputs, chunk_size=1000, alive=None):
+        """
+        Evaluates the dict of input arrays (scalars are broadcast) and
+        returns a dict holding the input and output columns.
+
+        alive, if given, is called while waiting and should return False
+        once there are no workers left to do the work (run_local watches
+        its processes like this); the sweep then stops with a SweepError.
+        """
+        columns, chunks = self.split(inputs, chunk_size)
+        # chunk ids are tagged with the sweep number so that late
+        # messages from an earlier sweep can be told apart
+        self.sweeps += 1
+        sweep = self.sweeps
+        for i, chunk in enumerate(chunks):
+            self.put(sweep, i, 0, chunk)
+
+        done = {}
+        attempts = [0] * len(chunks)
+        losses = [0] * len(chunks)
+        # when each running chunk started, and when its lease was last renewed
+        running = {}
+        leases = {}
+        reissued = set()
+        durations = []
+        heard = time.time()
+
+        while len(done) < len(chunks):
+            try:
+                kind, chunk_id, attempt, worker, data = self.results.get(timeout=self.poll)
+            except Queue.Empty:
+                kind = None
+            now = time.time()
+            if kind is not None:
+                heard = now
+            elif alive is not None and not alive():
+                raise SweepError('All the workers have exited with %i of %i chunks done'
+                                 % (len(done), len(chunks)))
+            elif self.idle_timeout is not None and now - heard > self.idle_timeout:
+                raise SweepError('Nothing heard from the workers for %.1fs with %i of %i '
+                                 'chunks done' % (self.idle_timeout, len(done), len(chunks)))
+
+            if kind is not None and chunk_id is not None and chunk_id[0] == sweep:
+                chunk_id = chunk_id[1]
+            else:
+                kind = None
+
+            if kind is not None and chunk_id not in done:
+                if kind == 'started':
+                    running.setdefault(chunk_id, now)
+                    leases[chunk_id] = now
+                elif kind == 'heartbeat':
+                    if chunk_id in running:
+                        leases[chunk_id] = now
+                elif kind == 'done':
+                    done[chunk_id] = data
+                    durations.append(now - running.pop(chunk_id, now))
+                    leases.pop(chunk_id, None)
+                elif kind == 'failed':
+                    running.pop(chunk_id, None)
+                    leases.pop(chunk_id, None)
+                    self.retry(sweep, chunk_id, chunks, attempts, data)
+
+            # everything has been handed out, so a chunk that is neither
+            # done nor running went to a worker that died before saying
+            # so; lease it from now so that it expires like any other
+            if self.tasks.empty():
+                for chunk_id in range(len(chunks)):
+                    if chunk_id not in done and chunk_id not in running:
+                        running[chunk_id] = leases[chunk_id] = now
+
+            # a lease that hasn't been renewed means the worker has died
+            # or hung (a slow chunk keeps sending heartbeats)
+            for chunk_id, renewed in leases.items():
+                if now - renewed > self.lease_timeout:
+                    del running[chunk_id], leases[chunk_id]
+                    losses[chunk_id] += 1
+                    if losses[chunk_id] > self.max_retries:
+                        raise SweepError('Chunk %i was lost %i times: nothing heard from its '
+                                         'worker for %.1fs' % (chunk_id, losses[chunk_id],
+                                                               self.lease_timeout))
+                    self.lost += 1
+                    self.put(sweep, chunk_id, attempts[chunk_id], chunks[chunk_id])
+
+            # nothing left to hand out: let idle workers take over stragglers
+            if durations and self.tasks.empty():
+                typical = np.median(durations)
+                for chunk_id, started in running.items():
+                    if chunk_id not in reissued and now - started > self.straggler_factor * typical:
+                        reissued.add(chunk_id)
+                        self.reissued += 1
+                        self.put(sweep, chunk_id, attempts[chunk_id], chunks[chunk_id])
+
+        results = dict(columns)
+        for name in done[0]:
+            results[name] = np.concatenate([done[i][name] for i in range(len(chunks))])
+        return results
+
+    def retry(self, sweep, chunk_id, chunks, attempts, reason):
+        attempts[chunk_id] += 1
+        if attempts[chunk_id] > self.max_retries:
+            raise SweepError('Chunk %i failed %i times, last error:\n%s'
+                             % (chunk_id, attempts[chunk_id], reason))
+        self.retries += 1
+        self.put(sweep, chunk_id, attempts[chunk_id], chunks[chunk_id])
+
+    def put(self, sweep, chunk_id, attempt, chunk):
+        self.tasks.put(((sweep, chunk_id), attempt, self.heartbeat, chunk))
+
+    def stop_workers(self, workers, timeout=10.0):
+        """
+        Tells the given number of workers to stop and waits for them to
+        acknowledge. Returns the number that did.
+        """
+        for _ in range(workers):
+            self.tasks.put(None)
+        stopped = 0
+        deadline = time.time() + timeout
+        while stopped < workers and time.time() < deadline:
+            try:
+                kind = self.results.get(timeout=self.poll)[0]
+            except Queue.Empty:
+                continue
+            if kind == 'stopped':
+                stopped += 1
+        return stopped
+
+    def shutdown(self, workers=0, grace=1.0):
+        """
+        Stops the given number of workers, then closes the server. The
+        grace period lets the workers drop their connections first;
+        their proxies hang about trying to reconnect otherwise.
+        """
+        if workers and self.stop_workers(workers):
+            time.sleep(grace)
+        self.manager.shutdown()
+
+
+def run_local(factory, inputs, workers=None, chunk_size=1000, evaluate=evaluate_chunk,
+              **settings):
+    """
+    Runs a sweep with a coordinator and worker processes on this machine.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    coordinator = Coordinator(address=('127.0.0.1', 0), **settings)
+    processes = [multiprocessing.Process(target=run_worker,
+                                         args=(coordinator.address, coordinator.authkey,
+                                               factory, evaluate))
+                 for _ in range(workers)]
+    for p in processes:
+        p.start()
+    alive = lambda: any([p.is_alive() for p in processes])
+    try:
+        return coordinator.run(inputs, chunk_size, alive)
+    finally:
+        # the server has to outlive the workers, see Coordinator.shutdown
+        coordinator.stop_workers(len([p for p in processes if p.is_alive()]))
+        for p in processes:
+            p.join(5.0)
+            if p.is_alive():
+                p.terminate()
+        coordinator.shutdown()
+
+
+if __name__ == '__main__':
+    host, port, authkey, target = sys.argv[1:5]
+    module, factory = target.split(':')
+    run_worker((host, int(port)), authkey, getattr(__import__(module), factory))
@@ -15,8 +15,9 @@ class EngineAssembly(Engine):
         return inputs
         
     def set_inputs(self, input_dict):
-        for k,v in input_dict.items():
-            self.set_input_alias(k,v)
+        with self.batch_update():
+            for k,v in input_dict.items():
+                self.set_input_alias(k,v)
 
     def get_inputs(self):
 
@@ -86,6 +87,25 @@ class EngineAssembly(Engine):
         self.set_inputs(input_dict)
         self.update()
         return dict(self.get_outputs())
+
+    def calculate_guarded(self, input_dict):
+        """
+        Like calculate, but with the feasibility checks of
+        update_guarded. Returns (outputs, status); outputs for infeasible
+        points are NaN.
+        """
+        self.set_inputs(input_dict)
+        status = self.update_guarded()
+        if status:
+            return dict(self.get_outputs()), status
+        if not np.any(status.feasible):
+            # the calculation stopped part way, so the components may
+            # hold anything (results from an earlier call, or nothing)
+            shape = np.shape(status.feasible)
+            return dict([(k, np.full(shape, np.nan)[()]) for k in self.output_aliases]), status
+        outputs = dict([(k, np.where(status.feasible, v, np.nan))
+                        for k, v in self.get_outputs()])
+        return outputs, status
     
 class _Solver(object):
     def __init__(self, engine, match_pairs):
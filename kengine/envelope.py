@@ -0,0 +1,58 @@
+"""
+Whole flight-envelope evaluation.
+
+Rather than looping over flight conditions, the altitude x Mach x
+throttle grid is flattened into arrays and pushed through the engine
+in a single vectorised calculation, so the engine's calculations need
+to be numpy-friendly. The calculation is guarded, so points that make
+no physical sense (eg. a nozzle pressure ratio below one at high Mach
+and low throttle) come back as NaN, flagged in 'FEASIBLE', rather than
+stopping the whole deck.
+"""
+import numpy as np
+
+
+def evaluate_envelope(engine, altitudes, machs, throttles, throttle_alias='RIT',
+                      delta_isa=0.0, inputs=None):
+    """
+    Evaluates the engine over every combination of altitude [m], flight
+    Mach number and throttle setting, where the throttle is whichever
+    input alias sets the power level (turbine entry temperature by
+    default). Any other fixed inputs go in 'inputs'.
+
+    Returns a dict of arrays shaped (len(altitudes), len(machs),
+    len(throttles)), holding the engine outputs plus the grid itself
+    under 'ALT', 'MACH' and the throttle alias. 'FEASIBLE' says which
+    points passed the feasibility checks and 'VIOLATION' names the
+    component that failed at the others.
+
+    The engine's flight condition and inputs are put back afterwards, so
+    it isn't left holding the grid.
+    """
+    alt, mach, throttle = np.meshgrid(np.asarray(altitudes, dtype=float),
+                                      np.asarray(machs, dtype=float),
+                                      np.asarray(throttles, dtype=float),
+                                      indexing='ij')
+    shape = alt.shape
+
+    values = dict(inputs or {})
+    values[throttle_alias] = throttle.ravel()
+
+    env = engine.environment
+    saved_env = env.p, env.t, dict(env.attributes)
+    saved_inputs = dict([(name, engine.get_input_alias(name)) for name in values])
+    try:
+        env.set_flight_condition(alt.ravel(), mach.ravel(), delta_isa)
+        outputs, status = engine.calculate_guarded(values)
+    finally:
+        env.p, env.t, env.attributes = saved_env
+        env.make_dirty()
+        engine.set_inputs(saved_inputs)
+
+    deck = {'ALT': alt, 'MACH': mach, throttle_alias: throttle}
+    deck['FEASIBLE'] = np.broadcast_to(status.feasible, (alt.size,)).reshape(shape)
+    deck['VIOLATION'] = np.broadcast_to(np.asarray(status.component, dtype=object),
+                                        (alt.size,)).reshape(shape)
+    for name, value in outputs.items():
+        deck[name] = np.broadcast_to(value, (alt.size,)).reshape(shape)
+    return deck
@@ -0,0 +1,196 @@
+"""
+Gas property models used by the components.
+
+Both models share one interface, and every function takes scalars or
+numpy arrays:
+
+    cp(t, far)          specific heat at constant pressure [J/kg/K]
+    R(far)              gas constant [J/kg/K]
+    gamma(t, far)       ratio of specific heats
+    h(t, far)           enthalpy [J/kg], from an arbitrary datum
+    phi(t, far)         entropy function, the integral of cp/T dT [J/kg/K]
+    t_from_h(h, far)    inverse of h
+    t_from_phi(phi, far) inverse of phi
+    combustion_far(t0, t1, fhv, far0)
+                        fuel-air ratio needed to heat the flow from t0 to t1
+    combustion_t(t0, dfar, fhv, far0)
+                        temperature reached by burning dfar more fuel
+
+An isentropic change between pressures p0 and p1 is then just
+phi(t1) = phi(t0) + R*ln(p1/p0), whatever the model.
+
+PerfectGas keeps cp and gamma constant, which is what the components
+originally did. SemiPerfectGas has cp varying with temperature and
+fuel-air ratio, using the polynomials for dry air and kerosene
+combustion products given by Walsh & Fletcher (Gas Turbine Performance).
+Enthalpy and entropy function are integrated analytically from the cp
+polynomial. The inverses start from a table built once per gas object
+and finish off with a couple of Newton steps, so they don't turn into
+an open-ended iteration inside every component.
+
+The polynomials only hold up to about 2000K; beyond 2100K cp turns over
+and by 2800K it is negative, so h and phi are no longer one-to-one and
+the inverses can find the wrong root. Each model has a valid range
+[tmin, tmax] and in_range(t) to check against it, and SemiPerfectGas
+gives NaN rather than an answer outside it. The components report
+temperatures outside the range as infeasible (see Component.violations).
+"""
+import numpy as np
+
+
+class PerfectGas(object):
+    """Constant cp and gamma."""
+    tmin = 0.0
+    tmax = np.inf
+
+    def __init__(self, cp=1004.0, gamma=1.4):
+        self._cp = cp
+        self._gamma = gamma
+        # the R consistent with cp and gamma, so that isentropic changes
+        # come out as t1/t0 = (p1/p0)**((gamma-1)/gamma)
+        self._R = cp * (gamma - 1) / gamma
+
+    def in_range(self, t):
+        with np.errstate(invalid='ignore'):
+            return (t > self.tmin) & (t <= self.tmax)
+
+    def cp(self, t, far=0.0):
+        return self._cp + 0.0*t
+
+    def R(self, far=0.0):
+        return self._R + 0.0*far
+
+    def gamma(self, t, far=0.0):
+        return self._gamma + 0.0*t
+
+    def h(self, t, far=0.0):
+        return self._cp * t
+
+    def phi(self, t, far=0.0):
+        return self._cp * np.log(t)
+
+    def t_from_h(self, h, far=0.0):
+        return h / self._cp
+
+    def t_from_phi(self, phi, far=0.0):
+        return np.exp(phi / self._cp)
+
+    def combustion_far(self, t0, t1, fhv, far0=0.0):
+        return self._cp * (t1 - t0) / fhv
+
+    def combustion_t(self, t0, dfar, fhv, far0=0.0):
+        return t0 + dfar * fhv / self._cp
+
+
+class SemiPerfectGas(object):
+    """
+    cp as a function of temperature and fuel-air ratio (far):
+
+        cp = A(tz) + far/(1+far) * B(tz),   tz = t/1000
+
+    with A and B polynomials in kJ/kg/K.
+
+    tmax defaults to 2200K, just past the peak in cp; above that the
+    polynomials are no use.
+    """
+    # dry air
+    A = (0.992313, 0.236688, -1.852148, 6.083152, -8.893933,
+         7.097112, -3.234725, 0.794571, -0.081873)
+    # correction for kerosene combustion products
+    B = (-0.718874, 8.747481, -15.863157, 17.254096, -10.233795,
+         3.081778, -0.361112, -0.003919)
+
+    def __init__(self, tmin=150.0, tmax=2200.0, tstep=5.0):
+        self.tmin = tmin
+        self.tmax = tmax
+        self.a = np.array(self.A) * 1000.0
+        self.b = np.array(self.B) * 1000.0
+
+        # integrated polynomials, highest power first for np.polyval.
+        # h = 1000 * integral(cp dtz) and phi = a0*ln(tz) + integral((cp-a0)/tz dtz)
+        n = np.arange(1, len(self.a) + 1)
+        self.ha = np.append((self.a / n)[::-1], 0.0) * 1000.0
+        n = np.arange(1, len(self.b) + 1)
+        self.hb = np.append((self.b / n)[::-1], 0.0) * 1000.0
+        n = np.arange(1, len(self.a))
+        self.phia = np.append((self.a[1:] / n)[::-1], 0.0)
+        n = np.arange(1, len(self.b))
+        self.phib = np.append((self.b[1:] / n)[::-1], 0.0)
+
+        # tables for starting the inverses (dry air)
+        self.t_table = np.arange(tmin, tmax + tstep, tstep)
+        self.h_table = self.h(self.t_table)
+        self.phi_table = self.phi(self.t_table)
+
+    def in_range(self, t):
+        with np.errstate(invalid='ignore'):
+            return (t >= self.tmin) & (t <= self.tmax)
+
+    def fraction(self, far):
+        return far / (1.0 + far)
+
+    def cp(self, t, far=0.0):
+        tz = t / 1000.0
+        return (np.polyval(self.a[::-1], tz) +
+                self.fraction(far) * np.polyval(self.b[::-1], tz))
+
+    def R(self, far=0.0):
+        return 287.05 - 0.00990*far + 1e-7*far**2
+
+    def gamma(self, t, far=0.0):
+        cp = self.cp(t, far)
+        return cp / (cp - self.R(far))
+
+    def h(self, t, far=0.0):
+        tz = t / 1000.0
+        return np.polyval(self.ha, tz) + self.fraction(far) * np.polyval(self.hb, tz)
+
+    def phi(self, t, far=0.0):
+        tz = t / 1000.0
+        return (self.a[0]*np.log(tz) + np.polyval(self.phia, tz) +
+                self.fraction(far) * (self.b[0]*np.log(tz) + np.polyval(self.phib, tz)))
+
+    def t_from_h(self, h, far=0.0, tolerance=1e-6, iter_limit=10):
+        t = np.interp(h, self.h_table, self.t_table)
+        for _ in range(iter_limit):
+            dt = (h - self.h(t, far)) / self.cp(t, far)
+            t = t + dt
+            # points that have gone to NaN are never going to settle
+            with np.errstate(invalid='ignore'):
+                if np.all((np.abs(dt) < tolerance) | np.isnan(dt)):
+                    break
+        return self.limit(t)
+
+    def t_from_phi(self, phi, far=0.0, tolerance=1e-6, iter_limit=10):
+        t = np.interp(phi, self.phi_table, self.t_table)
+        for _ in range(iter_limit):
+            dt = (phi - self.phi(t, far)) * t / self.cp(t, far)
+            t = t + dt
+            # points that have gone to NaN are never going to settle
+            with np.errstate(invalid='ignore'):
+                if np.all((np.abs(dt) < tolerance) | np.isnan(dt)):
+                    break
+        return self.limit(t)
+
+    def limit(self, t):
+        """t, with NaN wherever it is outside the valid range."""
+        return np.where(self.in_range(t), t, np.nan)[()]
+
+    def combustion_far(self, t0, t1, fhv, far0=0.0):
+        """
+        Energy balance per kg of air, neglecting the sensible enthalpy of
+        the fuel: (1+far)*h(t1, far) - h(t0, far0) = (far-far0)*fhv, which is
+        linear in far since (1+far)*h(t, far) = (1+far)*hA(t) + far*hB(t).
+        """
+        tz = self.limit(t1) / 1000.0
+        ha1 = np.polyval(self.ha, tz)
+        hb1 = np.polyval(self.hb, tz)
+        h0 = (1.0 + far0) * self.h(t0, far0)
+        far = (ha1 - h0 + far0*fhv) / (fhv - ha1 - hb1)
+        return far - far0
+
+    def combustion_t(self, t0, dfar, fhv, far0=0.0):
+        """The inverse of combustion_far, from the same energy balance."""
+        far = far0 + dfar
+        h1 = ((1.0 + far0) * self.h(t0, far0) + dfar*fhv) / (1.0 + far)
+        return self.t_from_h(h1, far)
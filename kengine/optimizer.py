@@ -0,0 +1,304 @@
+"""
+Design optimisation over the input aliases of an engine.
+
+Generic black-box optimisers throw away everything we know about the
+problem: the inputs have hard limits (the alias min/max) and we can get
+gradients cheaply from the Solver's finite difference Jacobian. The
+Optimizer here is a sequential quadratic programming (SQP) method:
+
+    minimise   f(x)
+    subject to c(x) >= 0 (or == 0), min <= x <= max
+
+Each iteration builds the Jacobian of the objective and constraints
+(len(inputs) engine calls), then takes the step that minimises a
+quadratic model of the Lagrangian subject to the linearised constraints
+and the bounds. The model's Hessian is built up by damped BFGS updates
+from the change in the gradients, so near the optimum the steps are
+quasi-Newton ones and converge superlinearly rather than crawling like a
+gradient method. The quadratic subproblems are tiny (one variable per
+input) and are solved with Hildreth's dual coordinate ascent. The step
+length comes from a backtracking line search on an L1 penalty merit
+function.
+
+The inputs are scaled onto [0,1] using their limits. The finite
+difference gradients are only good to about the perturbation size, so
+the optimum is not chased any closer than that. Every engine evaluation
+goes through a cache, so the point that the line search accepts is not
+recalculated when its Jacobian is built.
+"""
+import numpy as np
+
+from solver import Solver
+
+
+class CachedEvaluator(object):
+    """
+    Wraps an engine and memoises calculate() on the exact input values.
+    Counts real engine evaluations and cache hits.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.cache = {}
+        self.evaluations = 0
+        self.hits = 0
+
+    def __getattr__(self, attr):
+        return getattr(self.engine, attr)
+
+    def calculate(self, inputs):
+        key = tuple(sorted(inputs.items()))
+        if key in self.cache:
+            self.hits += 1
+        else:
+            self.evaluations += 1
+            self.cache[key] = dict(self.engine.calculate(inputs))
+        return dict(self.cache[key])
+
+    def clear(self):
+        self.cache = {}
+
+
+class OptimizationResult(object):
+    """Outcome of Optimizer.optimize."""
+    def __init__(self, inputs, outputs, objective, converged, iterations,
+                 evaluations, cache_hits, message):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.objective = objective
+        self.converged = converged
+        self.iterations = iterations
+        self.evaluations = evaluations
+        self.cache_hits = cache_hits
+        self.message = message
+
+    def __repr__(self):
+        return ('OptimizationResult(objective=%g, converged=%s, iterations=%i, '
+                'evaluations=%i, message=%r)' % (self.objective, self.converged,
+                self.iterations, self.evaluations, self.message))
+
+
+class Optimizer(Solver):
+    """
+    Minimises (or maximises) one engine output over the inputs named in
+    input_settings, subject to inequality/equality constraints on other
+    outputs. input_settings follows the Solver format, with optional
+    'min'/'max' entries to override the engine's alias limits:
+    {'HPCPR':{'perturbation':0.01, 'sval':15.0},
+     'BPR':{'perturbation':0.01, 'sval':8.0, 'min':6.0, 'max':10.0}}
+
+    Constraints are (output, relation, value) tuples where relation is
+    one of '>=', '<=' or '==', eg. [('THRUST', '>=', 300.0)].
+    """
+    relations = ('>=', '<=', '==')
+    # sweeps allowed for the dual coordinate ascent in each subproblem
+    qp_sweeps = 500
+
+    def __init__(self, engine, input_settings, objective, constraints=(),
+                 maximise=False):
+        super(Optimizer, self).__init__(CachedEvaluator(engine), input_settings)
+        self.objective = objective
+        self.constraints = list(constraints)
+        self.sign = -1.0 if maximise else 1.0
+        for name, relation, value in self.constraints:
+            if relation not in self.relations:
+                raise ValueError('Unknown constraint relation: %s' % relation)
+
+        # generate_jacobian looks here for the outputs to differentiate
+        self.targets = dict([(name, None) for name in
+                             [objective] + [c[0] for c in self.constraints]])
+
+        self.names = list(input_settings)
+        self.lower, self.upper = self.get_bounds()
+
+    def get_bounds(self):
+        lower = []
+        upper = []
+        for x in self.names:
+            settings = self.input_settings[x]
+            _min, _max = None, None
+            if hasattr(self.engine.engine, 'get_input_limits'):
+                _min, _max = self.engine.engine.get_input_limits(x)
+            _min = settings.get('min', _min)
+            _max = settings.get('max', _max)
+            if _min is None or _max is None:
+                raise ValueError('Optimizer needs finite limits on input: %s' % x)
+            lower.append(float(_min))
+            upper.append(float(_max))
+        return np.array(lower), np.array(upper)
+
+    def to_values(self, u):
+        x = self.lower + u * (self.upper - self.lower)
+        return dict(zip(self.names, x))
+
+    def constraint_values(self, outputs):
+        """Scaled constraints in c >= 0 (or c == 0) form."""
+        c = []
+        for name, relation, value in self.constraints:
+            if relation == '<=':
+                c.append(value - outputs[name])
+            else:
+                c.append(outputs[name] - value)
+        return np.array(c) / self.cscale
+
+    def violations(self, outputs):
+        """Scaled constraint violations, zero when satisfied."""
+        c = self.constraint_values(outputs)
+        return np.where(self.equality, c, np.minimum(c, 0.0))
+
+    def merit(self, outputs):
+        """The L1 penalty merit function."""
+        f = self.sign * outputs[self.objective] / self.fscale
+        return f + self.penalty * np.sum(np.abs(self.violations(outputs)))
+
+    def derivatives(self, gradients):
+        """
+        Gradient of the scaled objective and Jacobian of the scaled
+        constraints, both w.r.t. the scaled inputs.
+        """
+        width = self.upper - self.lower
+        g = np.array([self.sign * gradients[x][self.objective] / self.fscale
+                      for x in self.names]) * width
+        A = np.empty((len(self.constraints), len(self.names)))
+        for i, (name, relation, value) in enumerate(self.constraints):
+            row = np.array([gradients[x][name] for x in self.names]) / self.cscale[i]
+            A[i] = (-row if relation == '<=' else row) * width
+        return g, A
+
+    def subproblem(self, u, g, A, c):
+        """
+        The SQP step d minimising g.d + d.B.d/2 subject to c + A.d >= 0
+        (== 0 for equalities) and 0 <= u + d <= 1, with the multipliers
+        of the constraints. Solved by Hildreth's method: coordinate
+        ascent on the dual, which is a bound-constrained quadratic.
+        """
+        n = len(u)
+        eye = np.eye(n)
+        # every condition as a row of G.d >= h; only the bounds and the
+        # inequalities have multipliers restricted to be positive
+        G = np.vstack([A, eye, -eye])
+        h = np.concatenate([-c, -u, u - 1.0])
+        free = np.concatenate([self.equality, np.zeros(2*n, dtype=bool)])
+
+        H = np.linalg.inv(self.hessian)
+        P = np.dot(G, np.dot(H, G.T))
+        q = h + np.dot(G, np.dot(H, g))
+        lam = np.zeros(len(h))
+        diagonal = np.maximum(np.diag(P), 1e-300)
+        for sweep in range(self.qp_sweeps):
+            largest = 0.0
+            for i in range(len(h)):
+                new = lam[i] - (np.dot(P[i], lam) - q[i]) / diagonal[i]
+                if not free[i]:
+                    new = max(new, 0.0)
+                largest = max(largest, abs(new - lam[i]))
+                lam[i] = new
+            if largest <= 1e-12 * max(1.0, np.max(np.abs(lam))):
+                break
+        d = np.dot(H, np.dot(G.T, lam) - g)
+        # the bounds must hold exactly, whatever the dual got to
+        d = np.clip(u + d, 0.0, 1.0) - u
+        return d, lam[:len(c)]
+
+    def update_hessian(self, s, y):
+        """Damped BFGS update (Powell), which keeps the model convex."""
+        B = self.hessian
+        Bs = np.dot(B, s)
+        sBs = np.dot(s, Bs)
+        if sBs <= 0.0:
+            return
+        sy = np.dot(s, y)
+        if self.first_update:
+            # start from a sensibly sized multiple of the identity
+            if sy > 0.0:
+                B = B * (np.dot(y, y) / sy) / (sBs / np.dot(s, s))
+                Bs = np.dot(B, s)
+                sBs = np.dot(s, Bs)
+            self.first_update = False
+        theta = 1.0 if sy >= 0.2 * sBs else 0.8 * sBs / (sBs - sy)
+        r = theta * y + (1.0 - theta) * Bs
+        self.hessian = B - np.outer(Bs, Bs) / sBs + np.outer(r, r) / np.dot(s, r)
+
+    def optimize(self, fixed=None, iter_limit=100, tolerance=None,
+                 constraint_tolerance=1e-6, penalty=1.0):
+        """
+        Runs the optimisation from the 'sval' start point. Any inputs in
+        'fixed' are set on the engine and held for the whole run.
+
+        The run has converged once the constraints are met to within
+        constraint_tolerance and the step is smaller than tolerance, in
+        the scaled inputs. By default that is each input's perturbation
+        over its range, since the gradients are no better than that.
+        Returns an OptimizationResult.
+        """
+        evaluator = self.engine
+        evaluator.clear()
+        evals0, hits0 = evaluator.evaluations, evaluator.hits
+        for alias, value in (fixed or {}).items():
+            evaluator.engine.set_input_alias(alias, value)
+
+        width = self.upper - self.lower
+        if tolerance is None:
+            tolerance = np.array([self.input_settings[x]['perturbation'] for x in self.names]) / width
+        start = np.array([self.input_settings[x]['sval'] for x in self.names], dtype=float)
+        u = np.clip((start - self.lower) / width, 0.0, 1.0)
+        outputs = evaluator.calculate(self.to_values(u))
+
+        # scale the objective and constraints so that the penalty weight
+        # means something regardless of units
+        self.fscale = max(abs(outputs[self.objective]), 1e-12)
+        self.cscale = np.array([max(abs(value), 1.0) for _, _, value in self.constraints])
+        self.equality = np.array([relation == '==' for _, relation, _ in self.constraints],
+                                 dtype=bool)
+        self.multipliers = np.zeros(len(self.constraints))
+        self.penalty = penalty
+        self.hessian = np.eye(len(self.names))
+        self.first_update = True
+
+        converged = False
+        message = 'Exceeded iteration limit'
+        iteration = 0
+        last = None
+        while iteration < iter_limit:
+            iteration += 1
+            gradients = self.generate_jacobian(self.to_values(u))
+            g, A = self.derivatives(gradients)
+            if last is not None:
+                # change in the gradient of the Lagrangian over the step
+                s, g0, A0 = last
+                lam = self.multipliers
+                self.update_hessian(s, (g - np.dot(A.T, lam)) - (g0 - np.dot(A0.T, lam)))
+
+            c = self.constraint_values(outputs)
+            d, self.multipliers = self.subproblem(u, g, A, c)
+            violation = np.max(np.abs(np.append(self.violations(outputs), 0.0)))
+            if np.all(np.abs(d) <= tolerance) and violation < constraint_tolerance:
+                converged = True
+                message = 'Converged'
+                break
+
+            # the penalty has to outweigh the multipliers for the step to
+            # be a descent direction of the merit function
+            if len(c):
+                self.penalty = max(self.penalty, 1.5 * np.max(np.abs(self.multipliers)))
+            m0 = self.merit(outputs)
+            slope = np.dot(g, d) - self.penalty * np.sum(np.abs(self.violations(outputs)))
+            step = 1.0
+            for _ in range(30):
+                u_new = u + step * d
+                outputs_new = evaluator.calculate(self.to_values(u_new))
+                if self.merit(outputs_new) <= m0 + 1e-4 * step * min(slope, 0.0):
+                    break
+                step *= 0.5
+            else:
+                message = 'Line search failed'
+                break
+
+            last = (u_new - u, g, A)
+            u, outputs = u_new, outputs_new
+
+        return OptimizationResult(inputs=self.to_values(u), outputs=outputs,
+                                  objective=outputs[self.objective],
+                                  converged=converged, iterations=iteration,
+                                  evaluations=evaluator.evaluations - evals0,
+                                  cache_hits=evaluator.hits - hits0,
+                                  message=message)
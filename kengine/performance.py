@@ -1,5 +1,10 @@
+from contextlib import contextmanager
 import compressible
-from compressible import gamma, R, cp
+from compressible import gamma, R
+import gasprops
+import atmosphere
+import numpy as np
+import tearing
 #gamma = 1.4
 #cp = 1004.0
 
@@ -25,18 +30,17 @@ class Calculable(object):
     This can be resolved by passing an update() message back up the
     dependency tree to cause unfired Calculables to trigger.
 
-    Circular references will not be caught. There are a couple of ways to
-    catch this...
-    Maintain a global set of Calculable ids. If a Calculable is able to
-    find itself in this set when it is asked to recalculate then
-    there are some circular dependencies.
-    Also, if a Calculable is asked to recalculate despite already
-    being marked as 'clean' then something has gone wrong.
+    Circular references (recirculating flows) are handled by the Engine
+    rather than here: it finds the cycles and tears each one at a Station,
+    converging the loop by fixed-point iteration (see tearing.py).
+    make_dirty stops at anything that is already dirty, so it terminates
+    on a graph that hasn't been torn yet.
 
-    Alternatively, instead of maintaining a global set of calculated
-    Calculables, we could pass the set down the calculation network
-    as an argument.
+    While an Engine's guard is active, calculation goes through the guard
+    so that physically impossible states are caught where they arise
+    (see FeasibilityGuard).
     """
+    guard = None
 
     def __init__(self):
         """
@@ -52,10 +56,17 @@ class Calculable(object):
         """
         When the Calculable is marked as dirty, all of its depedents
         need to be marked as well.
+
+        Anything downstream of a dirty Calculable is already dirty (we
+        only ever get clean by calculating, which needs clean precedents)
+        so there is no need to carry on past a node that is dirty.
         """
+        if self.dirty:
+            return
         self.dirty = True
         for d in self.dependents:
-            d.make_dirty()
+            if not d.dirty:
+                d.make_dirty()
 
     def update(self):
         """
@@ -73,7 +84,10 @@ class Calculable(object):
         if not any([p.dirty for p in self.precedents]):
             #print 'Undirtying',self
             self.dirty = False
-            self.calculate()
+            if self.guard is not None and self.guard.active:
+                self.guard.calculate(self)
+            else:
+                self.calculate()
             for d in self.dependents:
                 d.update()
 
@@ -91,7 +105,7 @@ class Station(Calculable):
     """
     A station represents the state of the gas flow between two
     connected components. It has fields for total pressure,
-    total temperature, and mass flow.
+    total temperature, mass flow and fuel-air ratio.
     """
     def __init__(self, name=None):
         super(Station,self).__init__()
@@ -99,6 +113,7 @@ class Station(Calculable):
         self.p = 0.0
         self.t = 0.0
         self.w = 0.0
+        self.far = 0.0
 
     def __repr__(self):
         return 'Station(name=%s, p=%f,t=%f,w=%f)' % (self.name,self.p,self.t,self.w)
@@ -112,10 +127,27 @@ class Environment(Station):
     """
     def __init__(self, attributes={}, name=None):
         super(Environment, self).__init__(name)
-        self.attributes = attributes
+        self.attributes = dict(attributes)
 
     def __getattr__(self, name):
-        return self.attributes[name]
+        # go through __dict__ so that half-built instances (eg. during
+        # unpickling) raise AttributeError instead of recursing
+        try:
+            return self.__dict__['attributes'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def set_flight_condition(self, altitude, mach, delta_isa=0.0):
+        """
+        Sets the ambient conditions from the standard atmosphere and the
+        airspeed from a flight Mach number. Takes scalars or arrays.
+        """
+        self.t, self.p = atmosphere.isa(altitude, delta_isa)
+        self.attributes.pop('v0', None)
+        self.attributes['MACH'] = mach
+        self.attributes['ALT'] = altitude
+        self.attributes['DISA'] = delta_isa
+        self.make_dirty()
 
     def calculate(self):
         #print 'CALCULATING ENVIRONMENT'
@@ -135,11 +167,19 @@ class Component(Calculable):
     """
     An engine is built up from several components connected with
     stations.
+
+    Gas properties come from the 'gas' object (see gasprops.py). By
+    default every component shares one semi-perfect gas model; use
+    Engine.set_gas to give an engine something else, such as a
+    gasprops.PerfectGas for the old constant cp/gamma behaviour.
     """
     cname = 'generic component'
+    gas = gasprops.SemiPerfectGas()
+    batch = None
     def __init__(self, attributes={}, name=None):
         super(Component,self).__init__()
-        self.attributes = attributes
+        # a copy, so that components never share a dict (eg. the default)
+        self.attributes = dict(attributes)
         if name is None:
             self.name = self.cname
         else:
@@ -151,11 +191,38 @@ class Component(Calculable):
     def __setitem__(self,name,value):
         if not name in self.attributes:
             raise LookupError('Component does not have access to parameter: %s'%name)
-        self.make_dirty()
+        if self.batch is not None and self.batch.depth:
+            # invalidation is deferred until the batch finishes
+            self.batch.changed.append(self)
+        else:
+            self.make_dirty()
         self.attributes[name] = value
     
     def calculate(self):
         raise NotImplementedError('Components need to provide the calculation logic.')
+
+    def violations(self):
+        """
+        Physical feasibility checks, made after calculate while the
+        engine's guard is active. Returns a list of (reason, bad) pairs,
+        where bad is a bool, or a bool array for batch calculations.
+        """
+        return []
+
+    def gas_range(self, t):
+        """The violation for a temperature outside the gas model's range."""
+        return ('Temperature outside the range of the gas model',
+                np.logical_not(self.gas.in_range(t)))
+
+    def mask(self, bad):
+        """
+        Replaces the results for the infeasible points of a batch
+        calculation with NaN, so that they carry on harmlessly downstream.
+        """
+        for d in self.dependents:
+            if isinstance(d, Station):
+                for field in ('p', 't', 'w', 'far'):
+                    setattr(d, field, np.where(bad, np.nan, getattr(d, field)))
     
 class InletComponent(Component):
     """
@@ -219,6 +286,10 @@ class Intake(ExitComponent):
         self.exit.p = self.ambient.p / compressible.p_P(M)
         self.exit.t = self.ambient.t / compressible.t_T(M)
         self.exit.w = w
+        self.exit.far = 0.0
+
+    def violations(self):
+        return [('Mass flow must be positive', np.logical_not(self['W'] > 0))]
     
 class Splitter(Component):
     """
@@ -250,6 +321,11 @@ class Splitter(Component):
         self.exit1.t = t0
         self.exit1.w = w0*bpr/(bpr+1)
 
+        self.exit0.far = self.exit1.far = self.inlet.far
+
+    def violations(self):
+        return [('Negative bypass ratio', self['BPR'] < 0)]
+
 class Shaft(Component):
     """
     The shaft is one of the more complicated components.
@@ -281,6 +357,37 @@ class Shaft(Component):
     def calculate(self):
         self.power = sum([p.shaft_power() for p in self.precedents])
 
+class Mixer(Component):
+    """
+    The Mixer joins two flows into one, for example to bring a bleed or
+    cooling flow back into the main stream. Total temperature is mass
+    averaged and the exit takes the pressure of the main (first) inlet;
+    the returning flow is assumed to arrive with enough pressure to get in.
+    """
+    cname = 'mixer'
+
+    def connect_stations(self, inlet0, inlet1, exit):
+        """inlet0 is the main flow and inlet1 is the returning flow"""
+        for inlet in (inlet0, inlet1):
+            inlet.add_dependent(self)
+            self.add_precedent(inlet)
+        self.add_dependent(exit)
+        exit.add_precedent(self)
+        self.inlet0 = inlet0
+        self.inlet1 = inlet1
+        self.exit = exit
+
+    def calculate(self):
+        w0, w1 = self.inlet0.w, self.inlet1.w
+        w = w0 + w1
+        self.exit.p = self.inlet0.p
+        self.exit.t = (w0*self.inlet0.t + w1*self.inlet1.t) / w
+        self.exit.w = w
+        self.exit.far = (w0*self.inlet0.far + w1*self.inlet1.far) / w
+
+    def violations(self):
+        return [('Mass flow must be positive', np.logical_not(self.exit.w > 0))]
+
 class Propeller(Component):
     """
     EXPERIMENTAL:
@@ -300,16 +407,24 @@ class Compressor(FlowComponent):
     cname = 'compressor'
     
     def calculate(self):
-        print 'Calculating compressor'
+        #print 'Calculating compressor'
         
         p0,t0,w0 = self.inlet.p, self.inlet.t, self.inlet.w
+        far = self.inlet.far
+        gas = self.gas
         
         p1 = p0 * self['PR']
-        t1 = t0 * self['PR'] ** (1-1/gamma)
+        # isentropic compression
+        t1 = gas.t_from_phi(gas.phi(t0, far) + gas.R(far)*np.log(self['PR']), far)
         w1 = w0
 
         self.exit.p, self.exit.t, self.exit.w = p1, t1, w1
-        
+        self.exit.far = far
+
+    def violations(self):
+        return [('Pressure ratio below 1', np.logical_not(self['PR'] >= 1)),
+                self.gas_range(self.exit.t)]
+
     def shaft_power(self):
         """
         All components that consume shaft power need to implement
@@ -319,8 +434,9 @@ class Compressor(FlowComponent):
         w0 = self.inlet.w
         t0 = self.inlet.t
         t1 = self.exit.t
+        far = self.inlet.far
         
-        return cp*w0*(t1-t0)
+        return w0*(self.gas.h(t1, far) - self.gas.h(t0, far))
     
 class Turbine(FlowComponent):
     """
@@ -337,20 +453,42 @@ class Turbine(FlowComponent):
     solvers to convert the fail-safe parameterisation into useful engine
     attributes (the difference between solver-friendly parameterisation and
     engineer-friendly parameterisation - an interesting topic!)
+
+    Given an expansion ratio attribute 'ER', the turbine expands the flow
+    by that much instead and self.power is whatever that produces. This
+    is how transients let the shafts get out of balance.
     """
     cname = 'turbine'
     
     def calculate(self):
         #print 'Calculating turbine'
         p0,t0,w0 = self.inlet.p, self.inlet.t, self.inlet.w
-        power = self.shaft.power
-        
-        t1 = t0 - power/(cp*w0)
-        p1 = p0 * (t1/t0)**(gamma / (gamma-1))
+        far = self.inlet.far
+        gas = self.gas
+
+        if 'ER' in self.attributes:
+            # fixed expansion ratio (eg. during transients), so the power
+            # produced need not match what the shaft is asking for
+            p1 = p0 / self['ER']
+            t1 = gas.t_from_phi(gas.phi(t0, far) - gas.R(far)*np.log(self['ER']), far)
+            self.power = w0*(gas.h(t0, far) - gas.h(t1, far))
+        else:
+            self.power = power = self.shaft.power
+            t1 = gas.t_from_h(gas.h(t0, far) - power/w0, far)
+            # isentropic expansion
+            p1 = p0 * np.exp((gas.phi(t1, far) - gas.phi(t0, far)) / gas.R(far))
         w1 = w0
         
         self.exit.p, self.exit.t, self.exit.w = p1, t1, w1
-        
+        self.exit.far = far
+
+    def violations(self):
+        # asked for more power than there is enthalpy in the flow
+        h1 = self.gas.h(self.inlet.t, self.inlet.far) - self.power/self.inlet.w
+        return [('Shaft power exceeds the enthalpy of the flow', np.logical_not(h1 > 0)),
+                self.gas_range(self.exit.t),
+                ('Exit temperature above inlet temperature', self.exit.t > self.inlet.t)]
+
 
 class Combustor(FlowComponent):
     """
@@ -358,34 +496,54 @@ class Combustor(FlowComponent):
     or mass flow. This heat addition can be expressed as a fuel-flow
     by factoring in a fuel-heating value.
 
-    I have made no attempt to account for changes in fuel-air ratio.
+    The fuel-air ratio is tracked so that the gas properties downstream
+    are those of the combustion products, but the fuel is not added to
+    the mass flow.
 
     Note that we have a couple of different methods for parameterising
     the exit temperature here, either as a temperature delta across the
-    combustor, or as a fixed exit temperature.
+    combustor, or as a fixed exit temperature. If there is a fuel flow
+    'WF' attribute, that takes over and the exit temperature follows
+    from it (this is what transients are driven by).
 
     I have added the fixed exit temperature as an option to make up for
     not having a whole-engine solver that can achieve a target turbine
     Rotor Inlet Temperature (RIT).
     """
     cname = 'combustor'
+    # kerosene in air
+    stoichiometric_far = 0.068
         
     def calculate(self):
         #print 'calculating combustor'
         p0,t0,w0 = self.inlet.p, self.inlet.t, self.inlet.w
+        far0 = self.inlet.far
 
-        try:
-            dt = self['deltaT']
-            p1,t1,w1 = p0, t0+dt, w0
-        except:
-            t1 = self['TEX']
+        if 'WF' in self.attributes:
+            dfar = self['WF'] / w0
+            t1 = self.gas.combustion_t(t0, dfar, self['FHV'], far0)
             p1,w1 = p0,w0
+        else:
+            try:
+                dt = self['deltaT']
+                p1,t1,w1 = p0, t0+dt, w0
+            except:
+                t1 = self['TEX']
+                p1,w1 = p0,w0
+            dfar = self.gas.combustion_far(t0, t1, self['FHV'], far0)
         
         self.exit.p, self.exit.t, self.exit.w = p1, t1, w1
+        self.exit.far = far0 + dfar
+
+    def violations(self):
+        return [('Exit temperature below inlet temperature', self.exit.t < self.inlet.t),
+                self.gas_range(self.exit.t),
+                ('Fuel-air ratio above stoichiometric',
+                 self.exit.far > self.stoichiometric_far)]
 
     def fuel_flow(self):
-        w0,t0,t1 = self.inlet.w, self.inlet.t, self.exit.t
-        ff = w0 * cp * (t1 - t0) / self['FHV']
+        w0 = self.inlet.w
+        ff = w0 * (self.exit.far - self.inlet.far)
         return ff
         
 class Nozzle(InletComponent):
@@ -418,10 +576,118 @@ class Nozzle(InletComponent):
         npr = p0 / pamb
 
         #throat_mach = 1.0
-        self.vj = (2*cp*t1*eta * (1 - (1/npr)**((gamma-1)/gamma)))**0.5
+        # isentropic expansion to ambient pressure
+        far = self.inlet.far
+        gas = self.gas
+        self.ts = ts = gas.t_from_phi(gas.phi(t1, far) - gas.R(far)*np.log(npr), far)
+        self.vj = (2*eta*(gas.h(t1, far) - gas.h(ts, far)))**0.5
         self.athroat = w0 * t0**0.5 / (p0 * compressible.q_choke())
         self.throat_ps = p0 * compressible.p_P(1.0)
-        
+
+    def violations(self):
+        return [('Nozzle pressure ratio below 1', np.logical_not(self.inlet.p >= self.ambient.p)),
+                self.gas_range(self.ts)]
+
+    def mask(self, bad):
+        for name in ('ts', 'vj', 'athroat', 'throat_ps'):
+            setattr(self, name, np.where(bad, np.nan, getattr(self, name)))
+
+
+class UpdateBatch(object):
+    """
+    Shared between an Engine and its Components to record which
+    components were changed inside Engine.batch_update.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.changed = []
+
+class InfeasibleError(Exception):
+    """
+    Raised inside a guarded update when a component's state is physically
+    impossible (for a batch, when every point has become impossible).
+    """
+    def __init__(self, component, reason):
+        Exception.__init__(self, '%s: %s' % (component, reason))
+        self.component = component
+        self.reason = reason
+
+class EvaluationStatus(object):
+    """
+    The outcome of Engine.update_guarded. For a single point 'feasible'
+    is a bool and 'component' and 'reason' describe the violation (None
+    if there wasn't one). For a batch all three are arrays with an entry
+    per point.
+    """
+    def __init__(self, feasible, component=None, reason=None):
+        self.feasible = feasible
+        self.component = component
+        self.reason = reason
+
+    def __nonzero__(self):
+        return bool(np.all(self.feasible))
+
+    def __repr__(self):
+        if np.ndim(self.feasible):
+            return 'EvaluationStatus(%i of %i feasible)' % (np.count_nonzero(self.feasible),
+                                                           np.size(self.feasible))
+        return 'EvaluationStatus(feasible=%s, component=%s, reason=%s)' % (
+            self.feasible, self.component, self.reason)
+
+class FeasibilityGuard(object):
+    """
+    Shared between an Engine and its Components, like UpdateBatch. While
+    it is active each Calculable is calculated through the guard, which
+    checks the component's violations straight away.
+
+    For a single point the first violation raises InfeasibleError, which
+    stops the calculation there. For a batch, the offending points are
+    recorded and masked with NaN, and the rest carry on; the calculation
+    only stops once no feasible points are left.
+    """
+    def __init__(self):
+        self.active = False
+        self.names = {}
+        self.reset()
+
+    def reset(self):
+        self.feasible = True
+        self.component = None
+        self.reason = None
+
+    def calculate(self, calculable):
+        name = self.names.get(id(calculable), getattr(calculable, 'name', None))
+        try:
+            calculable.calculate()
+        except (ArithmeticError, ValueError), e:
+            raise InfeasibleError(name, str(e))
+        if not isinstance(calculable, Component):
+            return
+
+        for reason, bad in calculable.violations():
+            bad = np.asarray(bad, dtype=bool)
+            if not bad.any():
+                continue
+            if not bad.shape:
+                raise InfeasibleError(name, reason)
+
+            if self.feasible is True:
+                self.feasible = np.ones(bad.shape, dtype=bool)
+                self.component = np.empty(bad.shape, dtype=object)
+                self.reason = np.empty(bad.shape, dtype=object)
+            elif self.feasible.shape != bad.shape:
+                shape = np.broadcast(self.feasible, bad).shape
+                self.feasible, self.component, self.reason = [
+                    np.broadcast_to(a, shape).copy()
+                    for a in (self.feasible, self.component, self.reason)]
+            # only the first violation at each point is reported
+            first = bad & self.feasible
+            self.component[first] = name
+            self.reason[first] = reason
+            self.feasible = self.feasible & ~bad
+            calculable.mask(bad)
+            if not self.feasible.any():
+                raise InfeasibleError(name, reason)
 
 class Engine(object):
     """
@@ -438,10 +704,20 @@ class Engine(object):
         self.stations={}
         self.attributes={}
         self.components['ENGINE']=self.attributes
+        self.batch=UpdateBatch()
+        self.guard=FeasibilityGuard()
+        self.tears=None
+        self.tear_settings={'method':'anderson', 'depth':5,
+                            'rtol':1e-9, 'atol':1e-9, 'max_iter':100}
+        self.tear_iterations=0
+        self.tear_passes=0
                 
     def __setitem__(self, ident, component):
         assert not ident in self.components, 'Component idents must be unique: %s'%ident
         self.components[ident]=component
+        if isinstance(component,Component):
+            component.batch = self.batch
+            component.guard = self.guard
         if isinstance(component,Nozzle):
             component.connect_ambient(self.environment)
             self.nozzles.append(component)
@@ -455,10 +731,215 @@ class Engine(object):
         return self.components[ident]
 
     def update(self):
-        self.environment.make_dirty()
-        self.environment.update()
+        if self.tears is None:
+            self.tear_cycles()
+
+        if self.tears:
+            self.converge_tears()
+        else:
+            self.environment.make_dirty()
+            self.environment.update()
         self.calculate_thrust()
         self.calculate_attributes()
+
+    def update_guarded(self):
+        """
+        Like update, but checks the physical feasibility of each
+        component as it is calculated (see Component.violations) and
+        returns an EvaluationStatus instead of raising or quietly
+        producing garbage. A single point stops at the first violation,
+        leaving the engine's results stale. In a batch the infeasible
+        points come out as NaN and the others are calculated as normal.
+        """
+        guard = self.guard
+        guard.reset()
+        guard.names = dict([(id(c), ident) for ident, c in self.components.items()])
+        guard.active = True
+        try:
+            with np.errstate(all='ignore'):
+                self.update()
+        except InfeasibleError, e:
+            if guard.feasible is True:
+                return EvaluationStatus(False, e.component, e.reason)
+            # a single-valued violation in the middle of a batch
+            alive = guard.feasible
+            guard.component[alive] = e.component
+            guard.reason[alive] = e.reason
+            guard.feasible = np.zeros_like(alive)
+        finally:
+            guard.active = False
+        return EvaluationStatus(guard.feasible, guard.component, guard.reason)
+
+    @contextmanager
+    def batch_update(self):
+        """
+        Context manager for setting several component attributes at
+        once. Rather than each one dirtying everything downstream as it
+        is set, the changed components are recorded and invalidated in a
+        single pass on the way out:
+
+            with engine.batch_update():
+                engine['HPC']['PR'] = 20.0
+                engine['COMBUSTOR']['TEX'] = 1700.0
+
+        Batches can be nested; the invalidation happens when the outermost
+        one finishes.
+        """
+        batch = self.batch
+        batch.depth += 1
+        try:
+            yield
+        finally:
+            batch.depth -= 1
+            if not batch.depth:
+                changed, batch.changed = batch.changed, []
+                for c in changed:
+                    c.make_dirty()
+
+    def set_gas(self, gas):
+        """Gives every component in the engine the same gas model."""
+        for c in self.calculables():
+            if isinstance(c, Component):
+                c.gas = gas
+
+    def calculables(self):
+        """Every Calculable connected to the environment."""
+        found = [self.environment]
+        seen = set([id(self.environment)])
+        for c in found:
+            for n in c.dependents + c.precedents:
+                if id(n) not in seen:
+                    seen.add(id(n))
+                    found.append(n)
+        return found
+
+    def tear_cycles(self):
+        """
+        Finds any circular references in the calculation network and
+        tears them at a Station, until the network is acyclic. This is
+        done automatically on the first update; call it again if the
+        engine is rewired after that.
+        """
+        if self.tears is None:
+            self.tears = []
+        while True:
+            cycles = tearing.find_cycles(self.calculables())
+            if not cycles:
+                break
+            for cycle in cycles:
+                members = set([id(n) for n in cycle])
+                station = tearing.select_tear(cycle, Station)
+                source = [n for n in cycle
+                          if station in n.dependents and id(n) in members][0]
+
+                # the source now feeds a shadow of the torn station
+                shadow = Station('%s*' % station.name)
+                for k, v in vars(source).items():
+                    if v is station:
+                        setattr(source, k, shadow)
+                source.dependents[source.dependents.index(station)] = shadow
+                shadow.add_precedent(source)
+                if source in station.precedents:
+                    station.precedents.remove(source)
+                self.tears.append(tearing.Tear(station, source, shadow))
+        return self.tears
+
+    def converge_tears(self):
+        """
+        Iterates calculation passes until the state arriving at each
+        shadow station matches the guess in its torn station. The torn
+        stations start from whatever state they currently hold (see
+        seed_tears for the first time round).
+        """
+        settings = self.tear_settings
+        accelerator = tearing.ACCELERATORS[settings['method']](**settings)
+        shape = self.input_shape()
+        for t in self.tears:
+            if any([np.shape(v) not in ((), shape) for v in t.guess()]):
+                # left over from a batch of a different size
+                t.clear()
+        self.seed_tears()
+
+        # everything is flattened into one vector for the accelerator;
+        # station fields may be scalars or (batch) arrays
+        guesses = [np.asarray(v, dtype=float) for t in self.tears for v in t.guess()]
+        nfields = len(tearing.Tear.fields)
+        x = None
+
+        for iteration in range(1, settings['max_iter'] + 1):
+            if x is not None:
+                values = [x[i*size:(i+1)*size].reshape(shape) for i in range(len(guesses))]
+                if not shape:
+                    values = [float(v) for v in values]
+                for i, t in enumerate(self.tears):
+                    t.set_guess(values[nfields*i:nfields*(i+1)])
+
+            self.environment.make_dirty()
+            for t in self.tears:
+                t.station.make_dirty()
+            self.environment.update()
+            for t in self.tears:
+                t.station.update()
+            self.tear_passes += 1
+
+            results = [np.asarray(v, dtype=float) for t in self.tears for v in t.result()]
+            if x is None:
+                # the guesses are usually scalars on a fresh engine, so the
+                # shape of a batch comes from what the first pass produced
+                shape = ()
+                for v in guesses + results:
+                    shape = np.broadcast(np.empty(shape), v).shape
+                flatten = lambda vs: np.concatenate(
+                    [np.broadcast_to(v, shape).ravel() for v in vs])
+                x = flatten(guesses)
+                size = x.size // len(guesses)
+            g = flatten(results)
+            if self.guard.active:
+                # masked points mustn't leak into the others through the
+                # accelerator; just hold their guesses
+                g = np.where(np.isfinite(g), g, x)
+            if np.all(np.abs(g - x) <= settings['atol'] + settings['rtol']*np.abs(g)):
+                break
+            x = accelerator.next(x, g)
+        else:
+            raise Exception('Torn loops did not converge in %i passes' % settings['max_iter'])
+        self.tear_iterations = iteration
+
+    def input_shape(self):
+        """The batch shape of the inputs: () unless some are arrays."""
+        values = [self.environment.p, self.environment.t, self.environment.w]
+        values.extend(self.environment.attributes.values())
+        for c in self.components.values():
+            if isinstance(c, Component):
+                values.extend(c.attributes.values())
+        shape = ()
+        for v in values:
+            if isinstance(v, np.ndarray):
+                shape = np.broadcast(np.empty(shape), v).shape
+        return shape
+
+    def seed_tears(self):
+        """
+        Gives any torn station that has never held a state a starting
+        guess, rather than leaving it at zero pressure, temperature and
+        flow. A partial pass calculates everything upstream of the tears;
+        each unset torn station then takes the state of the flow it
+        joins (another inlet station of the component it feeds) or, if
+        there is none, the state leaving the intake.
+        """
+        unset = [t for t in self.tears if t.unset()]
+        if not unset:
+            return
+        self.environment.make_dirty()
+        for t in self.tears:
+            t.station.make_dirty()
+        self.environment.update()
+
+        fallback = self.intake.exit if self.intake is not None else self.environment
+        for t in unset:
+            joined = [p for d in t.station.dependents for p in d.precedents
+                      if isinstance(p, Station) and p is not t.station and not p.dirty]
+            t.seed(joined[0] if joined else fallback)
     
     def calculate_thrust(self):
         thrust=0
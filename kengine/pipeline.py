@@ -0,0 +1,198 @@
+"""
+Streaming recorded engine data through a model, for health monitoring.
+
+Everything here is a generator of chunks, where a chunk is a dict of
+equal-length column arrays. Stages are chained together and only ever
+hold a chunk or two, so memory use doesn't grow with the length of the
+file:
+
+    chunks = read_csv('snapshots.csv', chunk_size=50000)
+    chunks = prefetch(chunks)
+    chunks = evaluate_deltas(chunks, xrates,
+                             inputs={'a': 'A_MEAS', 'b': 'B_MEAS', 'c': 'C_MEAS'},
+                             outputs={'x': 'X_MEAS'})
+    rows = write_csv(chunks, 'deltas.csv')
+
+The model can be an XRates table or an EngineAssembly, or anything else
+with a vectorised calculate(dict) method. Each model output comes out as
+NAME_MODEL, and NAME_DELTA holds model minus measured.
+
+prefetch reads ahead on a background thread through a bounded queue.
+That overlaps the file reading with the model evaluation, and a slow
+consumer just blocks the reader (backpressure) rather than piling up
+chunks in memory.
+"""
+import csv
+import itertools
+import threading
+import Queue
+
+import numpy as np
+
+MODEL = '%s_MODEL'
+DELTA = '%s_DELTA'
+
+
+def read_csv(path, chunk_size=10000, columns=None, delimiter=','):
+    """
+    Yields chunks of a CSV file with a header row. All the columns read
+    must be numeric; 'columns' picks out a subset.
+    """
+    with open(path, 'rb') as f:
+        header = [name.strip() for name in csv.reader([f.readline()],
+                                                      delimiter=delimiter).next()]
+        if columns is None:
+            columns = header
+        usecols = [header.index(name) for name in columns]
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                break
+            data = np.loadtxt(lines, delimiter=delimiter, usecols=usecols, ndmin=2)
+            yield dict([(name, data[:, i]) for i, name in enumerate(columns)])
+
+
+def read_binary(path, dtype, chunk_size=10000, offset=0):
+    """
+    Yields chunks of a file of fixed-size binary records, described by a
+    numpy structured dtype (eg. np.dtype([('N1', '<f4'), ('EGT', '<f4')])),
+    after skipping 'offset' bytes of header.
+    """
+    dtype = np.dtype(dtype)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            data = f.read(dtype.itemsize * chunk_size)
+            if not data:
+                break
+            # a truncated last record is dropped
+            records = np.frombuffer(data[:len(data) - len(data) % dtype.itemsize], dtype)
+            yield dict([(name, records[name].astype(float)) for name in dtype.names])
+
+
+def prefetch(chunks, depth=2):
+    """
+    Pulls chunks from another generator on a background thread, keeping
+    at most 'depth' of them waiting. Exceptions in the producer are
+    re-raised in the consumer.
+    """
+    queue = Queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        # gives up if the consumer has gone, so the reader never blocks
+        # on a queue that nobody will empty
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put((chunk, None)):
+                    return
+            put((done, None))
+        except Exception, e:
+            put((done, e))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            chunk, error = queue.get()
+            if chunk is done:
+                if error is not None:
+                    raise error
+                break
+            yield chunk
+    finally:
+        # the consumer may give up early; don't leave the reader blocked
+        stop.set()
+        thread.join()
+
+
+def evaluate_deltas(chunks, model, inputs, outputs, fixed=None, keep=None):
+    """
+    Runs each chunk through the model and yields it with the model
+    outputs and deltas added.
+
+    inputs: {model input: column} for the inputs taken from the data
+    outputs: {model output: measured column} for the outputs to compare
+    fixed: {model input: value} for any inputs held constant
+    keep: the data columns to pass through (default: all of them)
+
+    XRates inputs that aren't mapped or fixed are held at the table's
+    reference values. If the model has calculate_guarded (engines do),
+    that is used, infeasible rows come out as NaN (a chunk with no
+    feasible rows at all is just NaN) and a FEASIBLE column is added.
+    An engine's inputs are put back once the chunks run out or the
+    generator is closed, so it isn't left holding the last chunk.
+    """
+    constant = {}
+    if hasattr(model, 'inputs_orig'):
+        constant.update(model.inputs_orig)
+    constant.update(fixed or {})
+    guarded = hasattr(model, 'calculate_guarded')
+
+    saved = {}
+    if hasattr(model, 'get_input_alias'):
+        saved = dict([(name, model.get_input_alias(name))
+                      for name in set(inputs).union(fixed or {})])
+    try:
+        for chunk in chunks:
+            n = len(chunk.values()[0])
+            values = dict(constant)
+            values.update([(name, chunk[column]) for name, column in inputs.items()])
+
+            if guarded:
+                results, status = model.calculate_guarded(values)
+            else:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    results = model.calculate(values)
+
+            if keep is None:
+                out = dict(chunk)
+            else:
+                out = dict([(column, chunk[column]) for column in keep])
+            for name, column in outputs.items():
+                result = np.broadcast_to(results[name], (n,))
+                out[MODEL % name] = result
+                out[DELTA % name] = result - chunk[column]
+            if guarded:
+                out['FEASIBLE'] = np.broadcast_to(status.feasible, (n,))
+            yield out
+    finally:
+        if saved:
+            model.set_inputs(saved)
+
+
+def write_csv(chunks, path, columns=None, fmt='%.10g', delimiter=','):
+    """
+    Writes chunks to a CSV file as they arrive and returns the number of
+    rows written. The columns default to those of the first chunk, sorted.
+    """
+    rows = 0
+    with open(path, 'wb') as f:
+        for chunk in chunks:
+            if columns is None:
+                columns = sorted(chunk)
+            if not rows:
+                f.write(delimiter.join(columns) + '\n')
+            data = np.column_stack([np.asarray(chunk[c], dtype=float) for c in columns])
+            np.savetxt(f, data, fmt=fmt, delimiter=delimiter)
+            rows += len(data)
+    return rows
+
+
+def process_csv(source, destination, model, inputs, outputs, chunk_size=10000,
+                **settings):
+    """The whole pipeline for one CSV file, as in the module docstring."""
+    chunks = prefetch(read_csv(source, chunk_size))
+    return write_csv(evaluate_deltas(chunks, model, inputs, outputs, **settings),
+                     destination)
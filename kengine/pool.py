@@ -0,0 +1,123 @@
+"""
+A pool of identical engine replicas for multi-threaded callers.
+
+Engines are stateful: set_inputs writes into component attributes and
+update writes into the stations, so two threads can't share one engine.
+The EnginePool builds a fixed number of replicas up front and hands them
+out one caller at a time:
+
+    pool = EnginePool(TurboFan, size=8)
+    with pool.checkout() as engine:
+        results = engine.calculate({'RIT': 1700.0})
+
+When an engine is returned its component and environment attributes are
+put back to how they were when it was built, so the next caller always
+starts from the same state whatever the last one did to it.
+"""
+from contextlib import contextmanager
+import Queue
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """Raised when no engine becomes free within the checkout timeout."""
+    pass
+
+
+class EnginePool(object):
+    def __init__(self, factory, size):
+        """
+        factory is any zero-argument callable returning a new engine,
+        for example the TurboFan class.
+        """
+        self.size = size
+        self.free = Queue.Queue()
+        self.snapshots = {}
+        for _ in range(size):
+            engine = factory()
+            self.snapshots[id(engine)] = self.snapshot(engine)
+            self.free.put(engine)
+
+        self.lock = threading.Lock()
+        self.created = time.time()
+        self.checkouts = 0
+        self.in_use = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.busy_time = 0.0
+
+    def snapshot(self, engine):
+        """Copies of every attribute dict in the engine."""
+        env = engine.environment
+        components = {}
+        for ident, component in engine.components.items():
+            if isinstance(component, dict):
+                components[ident] = dict(component)
+            else:
+                components[ident] = dict(component.attributes)
+        return {'components': components,
+                'environment': (dict(env.attributes), env.p, env.t, env.w)}
+
+    def reset(self, engine):
+        """Restores an engine to the state it was built in."""
+        state = self.snapshots[id(engine)]
+        for ident, saved in state['components'].items():
+            component = engine.components[ident]
+            if isinstance(component, dict):
+                component.clear()
+                component.update(saved)
+            else:
+                component.attributes.clear()
+                component.attributes.update(saved)
+                component.make_dirty()
+
+        env = engine.environment
+        attributes, env.p, env.t, env.w = state['environment']
+        env.attributes.clear()
+        env.attributes.update(attributes)
+        env.make_dirty()
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        Context manager that yields a free engine, blocking until one is
+        available. Raises PoolTimeout if timeout (seconds) runs out first.
+        The engine is reset and returned to the pool on exit.
+        """
+        start = time.time()
+        try:
+            engine = self.free.get(timeout=timeout)
+        except Queue.Empty:
+            raise PoolTimeout('No engine free after %.3fs' % timeout)
+        acquired = time.time()
+        wait = acquired - start
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        try:
+            yield engine
+        finally:
+            self.reset(engine)
+            with self.lock:
+                self.in_use -= 1
+                self.busy_time += time.time() - acquired
+            self.free.put(engine)
+
+    def stats(self):
+        """
+        Returns a dict of pool statistics. Utilisation is the fraction of
+        available engine-time (size * age of the pool) spent checked out.
+        """
+        with self.lock:
+            elapsed = time.time() - self.created
+            return {'size': self.size,
+                    'in_use': self.in_use,
+                    'checkouts': self.checkouts,
+                    'total_wait': self.total_wait,
+                    'mean_wait': self.total_wait / max(self.checkouts, 1),
+                    'max_wait': self.max_wait,
+                    'utilisation': self.busy_time / (self.size * elapsed)}
@@ -1,8 +1,217 @@
 import numpy as np
 from numpy.linalg import tensorsolve
 
+class ConvergenceTrace(object):
+    """
+    A record of how a solve went, one entry per iteration: the residual
+    norm, the size of the step taken, the condition number of the
+    jacobian used for it and the running count of engine calls. It is
+    kept in preallocated arrays (grown if a solve runs long), so leaving
+    it switched on costs next to nothing, and a failed solve can be
+    picked over afterwards.
+
+    Callbacks are called as callback(trace) after every iteration, for
+    anyone who wants to watch (see print_iteration).
+    """
+    def __init__(self, capacity=128, callbacks=()):
+        self.capacity = capacity
+        self.callbacks = list(callbacks)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.residual_norm = np.full(self.capacity, np.nan)
+        self.step_norm = np.full(self.capacity, np.nan)
+        self.condition = np.full(self.capacity, np.nan)
+        self.engine_calls = np.zeros(self.capacity, dtype=int)
+        self.values = None
+        self.errors = None
+        self.converged = None
+        self.message = None
+
+    def record(self, residual_norm, step_norm=np.nan, condition=np.nan, engine_calls=0,
+               values=None, errors=None):
+        if self.count == len(self.residual_norm):
+            for name in ('residual_norm', 'step_norm', 'condition', 'engine_calls'):
+                old = getattr(self, name)
+                extra = np.zeros_like(old) if name == 'engine_calls' else np.full_like(old, np.nan)
+                setattr(self, name, np.append(old, extra))
+        i = self.count
+        self.residual_norm[i] = residual_norm
+        self.step_norm[i] = step_norm
+        self.condition[i] = condition
+        self.engine_calls[i] = engine_calls
+        # only the latest values and errors are kept
+        self.values = values
+        self.errors = errors
+        self.count += 1
+        for callback in self.callbacks:
+            callback(self)
+
+    def finish(self, converged, message=None):
+        self.converged = converged
+        self.message = message
+
+    @property
+    def iterations(self):
+        return self.count
+
+    def as_dict(self):
+        """The recorded arrays, trimmed to the iterations taken."""
+        n = self.count
+        return {'residual_norm': self.residual_norm[:n],
+                'step_norm': self.step_norm[:n],
+                'condition': self.condition[:n],
+                'engine_calls': self.engine_calls[:n]}
+
+    def __repr__(self):
+        if not self.count:
+            return 'ConvergenceTrace(empty)'
+        return ('ConvergenceTrace(iterations=%i, converged=%s, residual=%g, engine_calls=%i)'
+                % (self.count, self.converged, self.residual_norm[self.count-1],
+                   self.engine_calls[self.count-1]))
+
+def print_iteration(trace):
+    """A ConvergenceTrace callback that prints each iteration as it goes."""
+    i = trace.count - 1
+    print 'Iteration #%i residual=%g step=%g cond=%g calls=%i' % (
+        i, trace.residual_norm[i], trace.step_norm[i], trace.condition[i],
+        trace.engine_calls[i])
+
+def _lu_factor(a):
+    """
+    LU factorisation with partial pivoting, packed into one matrix with
+    the row swaps in piv, as scipy.linalg.lu_factor gives it.
+    """
+    lu = np.array(a, dtype=float)
+    n = len(lu)
+    piv = np.arange(n)
+    for k in range(n):
+        p = k + np.argmax(np.abs(lu[k:,k]))
+        piv[k] = p
+        if p != k:
+            lu[[k,p]] = lu[[p,k]]
+        if lu[k,k] == 0:
+            raise np.linalg.LinAlgError('Singular matrix')
+        lu[k+1:,k] /= lu[k,k]
+        lu[k+1:,k+1:] -= np.outer(lu[k+1:,k], lu[k,k+1:])
+    return lu, piv
+
+def _lu_solve(factors, b):
+    """Solves with the factors from _lu_factor, as scipy.linalg.lu_solve."""
+    lu, piv = factors
+    x = np.array(b, dtype=float)
+    for k, p in enumerate(piv):
+        x[k], x[p] = x[p], x[k]
+    for k in range(len(x)):
+        x[k] -= np.dot(lu[k,:k], x[:k])
+    for k in reversed(range(len(x))):
+        x[k] = (x[k] - np.dot(lu[k,k+1:], x[k+1:])) / lu[k,k]
+    return x
+
+try:
+    from scipy.linalg import lu_factor, lu_solve
+except ImportError:
+    lu_factor, lu_solve = _lu_factor, _lu_solve
+
+class JacobianCache(object):
+    """
+    Jacobians kept from one solve to the next, so that repeated solves
+    near the same operating point (a control loop, an optimiser, a
+    sweep in small steps) can skip the finite differencing.
+
+    Each entry is a jacobian for one set of solver variables and
+    targets, together with the point it was differenced at (the solver
+    variables and the direct inputs), its LU factorisation, so that
+    using it is just a pair of triangular solves, and its condition
+    number. A lookup takes the nearest entry for the same variables and
+    targets, as long as no value has moved by more than max_step (5% by
+    default) from it.
+
+    The Solver keeps using a jacobian, cached or fresh, while its
+    iterates stay within max_step of where it was differenced and each
+    step cuts the residual by at least max_ratio. Once either fails it
+    is differenced afresh where the solve has got to, and that replaces
+    the entry. The least recently used entries are dropped beyond
+    max_entries.
+
+    What this saves is the differencing, len(variables) engine calls a
+    time, less whatever extra iterations the older jacobian costs. A
+    sweep of small steps, each starting from the last answer, comes down
+    to a couple of calls a solve. Solves that start far from their
+    answer save much less, since Newton needs fresh jacobians on the
+    way in anyway.
+
+    One cache may be shared between several solvers on the same engine.
+    """
+    def __init__(self, max_step=0.05, max_ratio=0.5, max_entries=64):
+        self.max_step = max_step
+        self.max_ratio = max_ratio
+        self.max_entries = max_entries
+        # [(key, entry)], the most recently used last
+        self.entries = []
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def key(self, xs, zs, direct):
+        return (tuple(sorted(xs)), tuple(sorted(zs)), tuple(sorted(direct)))
+
+    def distance(self, entry, values, direct):
+        """The largest relative change in any value since entry was differenced."""
+        point = entry[3]
+        here = dict(values)
+        here.update(direct)
+        return max([abs(here[name] - value) / (abs(value) or 1.0)
+                    for name, value in point.items()] or [0.0])
+
+    def entry(self, jacobian, values, direct):
+        """A (jacobian, LU factors, condition, point) entry, not kept."""
+        point = dict(values)
+        point.update(direct)
+        return (jacobian, lu_factor(jacobian), np.linalg.cond(jacobian), point)
+
+    def nearest(self, key, values, direct):
+        best = None
+        for i, (k, entry) in enumerate(self.entries):
+            if k == key:
+                d = self.distance(entry, values, direct)
+                if d <= self.max_step and (best is None or d < best[0]):
+                    best = (d, i)
+        return best and best[1]
+
+    def get(self, xs, zs, values, direct):
+        key = self.key(xs, zs, direct)
+        i = self.nearest(key, values, direct)
+        if i is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        item = self.entries.pop(i)
+        self.entries.append(item)
+        return item[1]
+
+    def put(self, xs, zs, values, direct, jacobian):
+        key = self.key(xs, zs, direct)
+        entry = self.entry(jacobian, values, direct)
+        i = self.nearest(key, values, direct)
+        if i is not None:
+            del self.entries[i]
+        elif len(self.entries) >= self.max_entries:
+            del self.entries[0]
+        self.entries.append((key, entry))
+        return entry
+
+    def clear(self):
+        self.entries = []
+
 class Solver(object):
-    def __init__(self, engine, input_settings):
+    # set while a subclass hands over to Solver.solve part way through,
+    # so that the trace and call count carry on rather than restart
+    resuming = False
+
+    def __init__(self, engine, input_settings, predictor=None, jacobian_cache=None,
+                 conv_crit=1e-6):
         """
         input_settings is a dict containing some info for the solver
         on how to work the inputs. Example:
@@ -12,9 +221,31 @@ class Solver(object):
               'sval':3.0}}
 
         The solver completely WRAPS the engine. This is important.
+
+        predictor is an optional XRates model of the engine (inputs named
+        as the engine's input aliases). When there is one, the start
+        values come from a linear inverse solve instead of the 'sval's,
+        and its rates serve as the first jacobian, which saves the first
+        round of perturbed engine calls as well as most of the iterations.
+
+        jacobian_cache is an optional JacobianCache for reusing jacobians
+        within and across solves.
+
+        conv_crit is the largest error in a target that counts as met.
+        It's absolute, in the target's own units, so it can also be a dict
+        of {target: conv_crit} for targets on different scales (SFC
+        against THRUST, say). Every check of the targets goes by it.
         """
         self.engine = engine
         self.input_settings = input_settings
+        self.predictor = predictor
+        self.jacobian_cache = jacobian_cache
+        self.conv_crit = conv_crit
+        self.jacobian = None
+        self.last_residual = None
+        self.trace = ConvergenceTrace()
+        self.calls = 0
+        self.condition = np.nan
 
 
     def __getattr__(self,attr):
@@ -23,6 +254,11 @@ class Solver(object):
         """
         return getattr(self.engine,attr)
 
+    def evaluate(self, values):
+        """engine.calculate, counted."""
+        self.calls += 1
+        return self.engine.calculate(values)
+
     def solve(self, targets):
         """
         Run the engine until all of our targets are met. We first
@@ -36,12 +272,13 @@ class Solver(object):
 
         # { name: value }
         solver_targets = {}
-        
+        direct = {}
 
         # partition inputs into direct inputs and solver targets
         for t,v in targets.iteritems():
             if t in self.engine.input_aliases:
                 self.engine.set_input_alias(t,v)
+                direct[t]=v
             else:
                 solver_targets[t]=v
 
@@ -52,54 +289,284 @@ class Solver(object):
         assert len(solver_targets) == len(isets)
 
         # do some reshuffling of input settings to get start values
-        values = dict([(x,isets[x]['sval']) for x in isets])
+        values, gradients = self.start_values(solver_targets)
 
+        trace = self.trace
+        if not self.resuming:
+            trace.reset()
+            self.calls = 0
+        self.jacobian = None
         iter_limit = 100
         iteration = 0
+        previous = None
         while True: # do until converged
-            print 'Iteration #%i'%iteration
-            print 'values:',values
             if iteration > iter_limit:
+                trace.finish(False, 'Exceeded iteration limit')
                 raise Exception('Exceeded iteration limit')
             
             # calculate some results
-            results = self.engine.calculate(values)
-            print 'RESULTS:'
-            print results
+            results = self.evaluate(values)
             # calculate errors
-            errors = dict([(z,(targets[z] - results[z])) for z in targets])
-            print 'ERRORS:'
-            print errors
+            errors = dict([(z,(solver_targets[z] - results[z])) for z in solver_targets])
+            residual = np.linalg.norm(errors.values())
+            if not np.isfinite(residual):
+                # the step went somewhere the engine can't be calculated
+                # (eg. past the range of the gas model), so go half as far
+                if previous is None:
+                    trace.finish(False, 'Engine results are not finite')
+                    raise Exception('Engine results are not finite')
+                last, corrections = previous
+                corrections = dict([(x,0.5*corrections[x]) for x in corrections])
+                previous = last, corrections
+                values = dict([(x,last[x]+corrections[x]) for x in last])
+                iteration += 1
+                continue
             if self.isconverged(errors):
+                trace.record(residual, engine_calls=self.calls, values=values, errors=errors)
+                trace.finish(True)
                 break
             
             # iterate!
-            corrections = self.next_iteration(values, errors)
+            if self.jacobian_cache is not None:
+                corrections = self.cached_iteration(values, errors, residual, direct, gradients,
+                                                    results)
+            else:
+                corrections = self.next_iteration(values, errors, gradients, results)
+            gradients = None
+            trace.record(residual, np.linalg.norm(corrections.values()), self.condition,
+                         self.calls, values, errors)
 
+            previous = values, corrections
             values = dict([(x,values[x]+corrections[x]) for x in values])
             
             iteration += 1
             
         return values
 
+    def start_values(self, solver_targets, direct=None):
+        """
+        The values to start iterating from, and a jacobian to go with
+        them (None if it has to be worked out the usual way).
+
+        The predictor only helps with the targets it has rates for; with
+        none of them we start from the 'sval's as usual, and with some of
+        them only those are used. Variables the predictor doesn't have
+        keep their 'sval' either way.
+        """
+        isets = self.input_settings
+        values = dict([(x,isets[x]['sval']) for x in isets])
+        predictor = self.predictor
+        if predictor is None:
+            return values, None
+        covered = dict([(z,v) for z,v in solver_targets.items() if z in predictor.outputs_orig])
+        if not covered or not set(isets) & set(predictor.xheader):
+            return values, None
+
+        # predictor inputs that we aren't solving for are held where the
+        # engine has them (or at the table's reference values)
+        direct = direct or {}
+        aliases = getattr(self.engine, 'input_aliases', {})
+        fixed = {}
+        for name in predictor.xheader:
+            if name in isets:
+                continue
+            if name in direct:
+                fixed[name] = direct[name]
+            elif name in aliases:
+                fixed[name] = self.engine.get_input_alias(name)
+            else:
+                fixed[name] = predictor.inputs_orig[name]
+        predicted = predictor.solve_inverse(covered, fixed)
+        values.update(predicted)
+
+        if set(isets) <= set(predictor.xheader) and len(covered) == len(solver_targets):
+            return values, predictor.gradients(list(isets), list(solver_targets))
+        return values, None
+
+    def solve_batch(self, targets, conv_crit=None, iter_limit=100):
+        """
+        Vectorised version of solve for many independent operating points.
+        Targets is a dict of arrays, with one row per operating point
+        (scalars are broadcast to every row):
+        {'varname': array_of_target_vals}
+
+        The engine is run on whole arrays at once, so everything in the
+        calculation chain must be numpy-friendly. Each iteration builds a
+        stack of Jacobians, one per operating point, from len(inputs)+1
+        vectorised engine calls and solves the whole stack with a single
+        numpy.linalg.solve call. Points that have converged are masked out
+        and are not sent through the engine again.
+
+        Returns a dict of arrays with the solved input values. Points that
+        did not converge within the iteration limit are left at their last
+        iterate and flagged False in self.batch_converged. Points that
+        can't carry on at all (non-finite results, or a singular
+        Jacobian) are dropped from the batch there and then, and come
+        back as NaN, also flagged False; they don't hold up the rest.
+
+        The engine's inputs are put back as they were afterwards.
+        conv_crit defaults to the solver's own.
+        """
+        if conv_crit is None:
+            conv_crit = self.conv_crit
+        aliases = getattr(self.engine, 'input_aliases', {})
+        npoints = np.broadcast(*[np.asarray(v) for v in targets.values()]).size
+
+        # partition inputs into direct inputs and solver targets
+        direct = {}
+        solver_targets = {}
+        for t,v in targets.iteritems():
+            v = np.array(np.broadcast_to(v, (npoints,)), dtype=float)
+            if t in aliases:
+                direct[t]=v
+            else:
+                solver_targets[t]=v
+
+        isets = self.input_settings
+        assert len(solver_targets) == len(isets)
+        xs = list(isets)
+        zs = list(solver_targets)
+
+        saved = dict([(name, self.engine.get_input_alias(name))
+                      for name in xs + list(direct) if name in aliases])
+        try:
+            values = self.iterate_batch(solver_targets, direct, conv_crit, iter_limit)
+        finally:
+            if saved:
+                self.engine.set_inputs(saved)
+        return values
+
+    def iterate_batch(self, solver_targets, direct, conv_crit, iter_limit):
+        """The Newton iterations of solve_batch."""
+        isets = self.input_settings
+        xs = list(isets)
+        zs = list(solver_targets)
+        npoints = len(solver_targets[zs[0]])
+
+        start, gradients = self.start_values(solver_targets, direct)
+        values = dict([(x,np.array(np.broadcast_to(start[x], (npoints,)), dtype=float))
+                       for x in xs])
+        # the last step taken at each point, for backing off (see below)
+        steps = dict([(x,np.zeros(npoints)) for x in xs])
+        halvings = np.zeros(npoints, dtype=int)
+        active = np.ones(npoints, dtype=bool)
+        failed = np.zeros(npoints, dtype=bool)
+        iterations = np.zeros(npoints, dtype=int)
+        trace = self.trace
+        trace.reset()
+        self.calls = 0
+        # anything worse than this is as good as singular
+        max_condition = 1.0 / np.finfo(float).eps
+        limits = np.array([self.tolerance(z, conv_crit) for z in zs])
+
+        for iteration in range(iter_limit+1):
+            idx = np.flatnonzero(active)
+            if not len(idx):
+                trace.finish(False, 'No points left that can be solved')
+                break
+            point = dict([(x,values[x][idx]) for x in xs])
+            point.update([(d,direct[d][idx]) for d in direct])
+
+            results = self.evaluate(point)
+            errors = np.column_stack([np.broadcast_to(solver_targets[z][idx] - results[z],
+                                                      (len(idx),)) for z in zs])
+
+            # like solve, a step that lands somewhere the engine can't be
+            # calculated is halved; a point that still can't be calculated
+            # is given up on
+            bad = ~np.all(np.isfinite(errors), axis=1)
+            retry = bad & (halvings[idx] < 10) & (iteration > 0)
+            for x in xs:
+                steps[x][idx[retry]] *= 0.5
+                values[x][idx[retry]] -= steps[x][idx[retry]]
+            halvings[idx[retry]] += 1
+            bad &= ~retry
+
+            with np.errstate(invalid='ignore'):
+                converged = np.all(np.abs(errors) < limits, axis=1)
+            active[idx[converged | bad]] = False
+            failed[idx[bad]] = True
+            iterations[idx] = iteration
+            # the trace follows the worst point still going
+            finite = errors[~(bad | retry)]
+            residual = np.max(np.linalg.norm(finite, axis=1)) if len(finite) else np.nan
+            if iteration == iter_limit or np.all(converged | bad):
+                done = converged.all() and not failed.any()
+                trace.record(residual, engine_calls=self.calls)
+                trace.finish(done, None if done else
+                             'Some points failed' if np.all(converged | bad) else
+                             'Exceeded iteration limit')
+                break
+
+            # drop the finished points before the expensive bit
+            going = ~(converged | bad | retry)
+            idx = idx[going]
+            errors = errors[going]
+            point = dict([(k,v[going]) for k,v in point.items()])
+            results = dict([(z,np.broadcast_to(results[z], going.shape)[going]) for z in zs])
+
+            # one stacked jacobian, shape (points, targets, inputs)
+            jacobians = np.empty((len(idx), len(zs), len(xs)))
+            if gradients is not None:
+                # the predictor's rates stand in for the first one
+                jacobians[:] = [[gradients[x][z] for x in xs] for z in zs]
+                gradients = None
+            elif len(idx):
+                for j,x in enumerate(xs):
+                    perturbation = isets[x]['perturbation']
+                    new_values = point.copy()
+                    new_values[x] = point[x] + perturbation
+                    calcd_outputs = self.evaluate(new_values)
+                    for i,z in enumerate(zs):
+                        jacobians[:,i,j] = (calcd_outputs[z] - results[z]) / perturbation
+
+            # a singular (or NaN) jacobian at one point mustn't sink the rest
+            condition = np.full(len(idx), np.inf)
+            finite = np.all(np.isfinite(jacobians), axis=(1,2))
+            if finite.any():
+                condition[finite] = np.linalg.cond(jacobians[finite])
+            solvable = condition < max_condition
+            active[idx[~solvable]] = False
+            failed[idx[~solvable]] = True
+            idx, jacobians, errors = idx[solvable], jacobians[solvable], errors[solvable]
+            if not len(idx):
+                trace.record(residual, engine_calls=self.calls)
+                continue
+
+            corrections = np.linalg.solve(jacobians, errors[...,np.newaxis])[...,0]
+            trace.record(residual, np.max(np.linalg.norm(corrections, axis=1)),
+                         np.max(condition[solvable]), self.calls)
+            for j,x in enumerate(xs):
+                steps[x][idx] = corrections[:,j]
+                values[x][idx] += corrections[:,j]
+            halvings[idx] = 0
+
+        for x in xs:
+            values[x][failed] = np.nan
+        self.batch_converged = ~active & ~failed
+        self.batch_iterations = iterations
+        return values
+
+    def tolerance(self, target, conv_crit=None):
+        """The conv_crit for one target."""
+        if conv_crit is None:
+            conv_crit = self.conv_crit
+        if isinstance(conv_crit, dict):
+            return conv_crit[target]
+        return conv_crit
 
     def isconverged(self, errors):
         """
         Check to see whether our calculated errors are within our allowable
         limits.
         """
-        #simple to start!
-        conv_crit = 1e-6
-        print errors
-        conv_results = [abs(errors[e]) < conv_crit for e in errors]
-        print conv_results
+        conv_results = [abs(errors[e]) < self.tolerance(e) for e in errors]
         converged = all(conv_results)
         return converged
             
-    def next_iteration(self, current_values, errors):
-        gradients = self.generate_jacobian(current_values)
-        print 'GRADIENTS'
-        print gradients
+    def next_iteration(self, current_values, errors, gradients=None, results=None):
+        if gradients is None:
+            gradients = self.generate_jacobian(current_values, results)
         xs = gradients.keys()
         zs = gradients[xs[0]].keys()
 
@@ -107,6 +574,7 @@ class Solver(object):
 
         J = np.array(jacobian_matrix)
         e = np.array([errors[z] for z in zs])
+        self.condition = np.linalg.cond(J)
 
 #        print 'jacobian\n',J
 #        print 'errors\n',e
@@ -121,12 +589,67 @@ class Solver(object):
 
         return corrections
                                                     
-    def generate_jacobian(self, current_values):
+    def cached_iteration(self, current_values, errors, residual, direct, gradients=None,
+                         results=None):
+        """
+        next_iteration, but keeping hold of the jacobian (and sharing it
+        through the jacobian cache) for as long as it stays close to the
+        iterates and keeps the residual coming down quickly enough. In
+        the meantime each step gives it a Broyden update, which goes back
+        in the cache as the jacobian at the new point.
+        """
+        cache = self.jacobian_cache
+        xs = sorted(current_values)
+        zs = sorted(errors)
+        e = np.array([errors[z] for z in zs])
+
+        stale = False
+        if self.jacobian is not None:
+            if residual > cache.max_ratio * self.last_residual:
+                # not pulling its weight any more
+                stale = True
+                self.jacobian = None
+            elif cache.distance(self.jacobian, current_values, direct) > cache.max_step:
+                # moved on, so look for one nearer to hand
+                self.jacobian = None
+            else:
+                # errors are targets - results, so they move by -J*step
+                J = self.jacobian[0]
+                step, change = self.last_step, self.last_errors - e
+                J = J + np.outer(change - np.dot(J, step), step) / np.dot(step, step)
+                self.jacobian = cache.put(xs, zs, current_values, direct, J)
+
+        if self.jacobian is None:
+            entry = None if stale else cache.get(xs, zs, current_values, direct)
+            if entry is None:
+                if stale:
+                    cache.refreshes += 1
+                if gradients is not None and not stale:
+                    J = np.array([[gradients[x][z] for x in xs] for z in zs])
+                    entry = cache.entry(J, current_values, direct)
+                else:
+                    gradients = self.generate_jacobian(current_values, results)
+                    J = np.array([[gradients[x][z] for x in xs] for z in zs])
+                    entry = cache.put(xs, zs, current_values, direct, J)
+            self.jacobian = entry
+
+        self.last_residual = residual
+        J, factors, self.condition, point = self.jacobian
+        result = lu_solve(factors, e)
+        self.last_step, self.last_errors = result, e
+        return dict([(x,result[i]) for i,x in enumerate(xs)])
+
+    def generate_jacobian(self, current_values, defaults=None):
+        """
+        Jacobian by forward differences. defaults are the outputs at
+        current_values, if they are already known, which saves a call.
+        """
         jacobian = {}
 
         # start with defaults
         #defaults = dict([(nm, self.engine.get_output_alias(nm)) for nm in outputs])
-        defaults = self.engine.calculate(current_values)
+        if defaults is None:
+            defaults = self.evaluate(current_values)
         #defaults = {}
         #for output_name in outputs:
         #    value = self.engine.get_output_alias(output_name)
@@ -141,14 +664,12 @@ class Solver(object):
             new_values[input_name]=current_values[input_name]+perturbation
             
             # treat the wrapped engine as a function to make testing easier
-            calcd_outputs = self.engine.calculate(new_values)
+            calcd_outputs = self.evaluate(new_values)
             target_names = self.targets.keys()
             gradient_row = {}
             
             # look at the outputs and calculate the gradients for each
             for output_name in target_names:
-                print 'OUTPUT NAME'
-                print output_name
                 value = calcd_outputs[output_name]
                 default = defaults[output_name]
                 difference = value - default
@@ -157,9 +678,523 @@ class Solver(object):
                 gradient_row[output_name]=gradient
 
             gradients[input_name]=gradient_row
-            
+
         return gradients
 
+
+class DecomposedSolver(Solver):
+    """
+    A Solver that uses the structure of the problem to break it into
+    small pieces before running Newton on it.
+
+    An input alias can only affect components downstream of the one it
+    sets. Following the dependents from each input component (through
+    stations, and through shafts to the turbines that balance them) tells
+    us which targets each solver variable can possibly move. The shaft
+    power balances themselves never become unknowns here: a Shaft adds up
+    what its compressors take and its turbine extracts exactly that in
+    the same pass, so each balance is closed inside the calculation, and
+    all it does to the solve is couple the turbine's downstream to every
+    input on the shaft.
+
+    For whole-engine targets (THRUST, SFC) the graph alone finds little,
+    since everything ends at the nozzles. So the incidence is narrowed
+    down with the first Jacobian of the solve, which Newton needs anyway:
+    an entry that is negligible next to the rest of its row (SFC against
+    mass flow, say, as the engine scales with flow) is dropped. The
+    pattern is matched and ordered into a block-triangular form, so each
+    block of (variables, targets) can be converged on its own with a
+    small Jacobian, in an order where every block only depends on blocks
+    that have already been solved.
+
+    If the problem doesn't decompose we go straight on to the plain
+    global Newton in Solver.solve, starting with the Jacobian we already
+    have. If a block fails to converge it does the same from the start
+    values, and if the blocks don't settle within a few block
+    Gauss-Seidel sweeps it carries on from wherever they got to.
+    """
+    def __init__(self, engine, input_settings, sweeps=5, predictor=None, jacobian_cache=None,
+                 structure_tol=1e-6, conv_crit=1e-6):
+        super(DecomposedSolver,self).__init__(engine, input_settings, predictor, jacobian_cache,
+                                              conv_crit)
+        self.sweeps = sweeps
+        self.structure_tol = structure_tol
+        self.blocks = None
+        self.probe = None
+
+    def start_values(self, solver_targets, direct=None):
+        # the global fallback picks up where the decomposition left off
+        if self.probe is not None:
+            return self.probe
+        return super(DecomposedSolver,self).start_values(solver_targets, direct)
+
+    def solve(self, targets):
+        solver_targets = {}
+        for t,v in targets.iteritems():
+            if t in self.engine.input_aliases:
+                self.engine.set_input_alias(t,v)
+            else:
+                solver_targets[t]=v
+        self.targets = solver_targets
+
+        isets = self.input_settings
+        assert len(solver_targets) == len(isets)
+        xs = list(isets)
+        zs = list(solver_targets)
+
+        trace = self.trace
+        trace.reset()
+        self.calls = 0
+        values, gradients = self.start_values(solver_targets)
+        if gradients is None:
+            gradients = self.generate_jacobian(values)
+        J = np.array([[gradients[x][z] for x in xs] for z in zs])
+
+        self.blocks = self.find_blocks(xs, zs, J, values)
+        if self.blocks is not None and len(self.blocks) > 1:
+            start = dict(values)
+            outcome = self.run_sweeps(values, solver_targets, xs, zs, J)
+            if outcome is True:
+                trace.finish(True)
+                return values
+            elif outcome is None:
+                # a block broke down, so start the global solve afresh
+                values = start
+            elif values != start:
+                # the blocks fight each other; carry on from where they
+                # got to, where the first Jacobian is stale
+                gradients = None
+
+        self.probe = (values, gradients)
+        predictor, self.predictor = self.predictor, None
+        self.resuming = True
+        try:
+            return super(DecomposedSolver,self).solve(solver_targets)
+        finally:
+            self.probe = None
+            self.predictor = predictor
+            self.resuming = False
+
+    def run_sweeps(self, values, targets, xs, zs, J):
+        """
+        Block Gauss-Seidel sweeps over self.blocks, updating values in
+        place. Returns True once every target is met, False if the sweeps
+        run out first and None if a block fails to converge.
+        """
+        for sweep in range(self.sweeps):
+            before = dict(values)
+            for bxs, bzs in self.blocks:
+                block_J = None
+                if sweep == 0:
+                    # the first Jacobian serves for each block's first step
+                    block_J = J[np.ix_([zs.index(z) for z in bzs], [xs.index(x) for x in bxs])]
+                if not self.solve_block(values, bxs, bzs, targets, block_J):
+                    return None
+            results = self.evaluate(values)
+            errors = dict([(z,(targets[z] - results[z])) for z in zs])
+            # one trace entry per sweep
+            self.trace.record(np.linalg.norm(errors.values()),
+                              np.linalg.norm([values[x] - before[x] for x in xs]),
+                              engine_calls=self.calls, values=dict(values), errors=errors)
+            if all([self.met(errors[z], z) for z in zs]):
+                return True
+        return False
+
+    def met(self, error, target):
+        """The same test as isconverged, so the blocks stop where Solver would."""
+        return abs(error) < self.tolerance(target)
+
+    def solve_block(self, values, xs, zs, targets, J=None, iter_limit=20):
+        """
+        Newton iteration on the variables xs to meet targets zs, holding
+        every other variable fixed. Updates values in place and returns
+        False if the block doesn't converge. J, if given, is used to start
+        with instead of working one out. After a step the Jacobian gets a
+        Broyden update from the change in the errors, and is only worked
+        out afresh if the errors stop at least halving.
+        """
+        last = None
+        for iteration in range(iter_limit):
+            results = self.evaluate(values)
+            errors = np.array([targets[z] - results[z] for z in zs])
+            if not np.all(np.isfinite(errors)):
+                return False
+            if all([self.met(e, z) for e, z in zip(errors, zs)]):
+                return True
+
+            size = np.linalg.norm(errors)
+            if last is not None:
+                if size > 0.5*last[0]:
+                    J = None
+                else:
+                    # errors are targets - results, so they move by -J*step
+                    step, change = last[1], last[2] - errors
+                    J = J + np.outer(change - np.dot(J, step), step) / np.dot(step, step)
+            if J is None:
+                J = np.empty((len(zs), len(xs)))
+                for j,x in enumerate(xs):
+                    perturbation = self.input_settings[x]['perturbation']
+                    new_values = values.copy()
+                    new_values[x] = values[x] + perturbation
+                    calcd_outputs = self.evaluate(new_values)
+                    for i,z in enumerate(zs):
+                        J[i,j] = (calcd_outputs[z] - results[z]) / perturbation
+
+            try:
+                corrections = np.linalg.solve(J, errors)
+            except np.linalg.LinAlgError:
+                return False
+            last = (size, corrections, errors)
+            for j,x in enumerate(xs):
+                values[x] += corrections[j]
+        return False
+
+    def downstream(self, item):
+        """Everything in the calculation graph that item can influence."""
+        found = set()
+        stack = [item]
+        while stack:
+            c = stack.pop()
+            if id(c) in found:
+                continue
+            found.add(id(c))
+            stack.extend(c.dependents)
+        return found
+
+    def incidence(self, xs, zs):
+        """
+        {target: set(variables that can affect it)}, or None if the
+        engine doesn't expose enough structure.
+        """
+        engine = self.engine
+        if not hasattr(engine, 'input_aliases') or not hasattr(engine, 'output_aliases'):
+            return None
+
+        # whole-engine outputs come from the nozzles (thrust) and/or the
+        # combustor (fuel flow)
+        nozzles = [id(n) for n in engine.nozzles]
+        combustor = []
+        if 'COMBUSTOR' in engine.components:
+            combustor.append(id(engine['COMBUSTOR']))
+        engine_level = {'THRUST': nozzles, 'FUEL_FLOW': combustor}
+
+        reach = {}
+        for x in xs:
+            if x not in engine.input_aliases:
+                return None
+            reach[x] = self.downstream(engine[engine.input_aliases[x][0][0]])
+
+        deps = {}
+        for z in zs:
+            if z not in engine.output_aliases:
+                return None
+            owner, attribute = engine.output_aliases[z][:2]
+            if owner == 'ENGINE':
+                needs = engine_level.get(attribute, nozzles + combustor)
+            else:
+                needs = [id(engine[owner])]
+            deps[z] = set([x for x in xs if any([n in reach[x] for n in needs])])
+        return deps
+
+    def find_blocks(self, xs, zs, J=None, values=None):
+        """
+        Returns a list of (variables, targets) blocks in the order they
+        should be solved, or None if the problem is structurally singular
+        or has no visible structure.
+
+        J (targets by variables, at values) narrows down the incidence
+        from the graph, or stands in for it if the graph can't be read.
+        An entry counts if its effect over the variable's magnitude is
+        more than structure_tol of the largest in its row.
+        """
+        deps = self.incidence(xs, zs)
+        if J is not None:
+            scale = np.array([abs(values[x]) or self.input_settings[x]['perturbation']
+                              for x in xs])
+            effect = np.abs(J) * scale
+            significant = effect > self.structure_tol * effect.max(axis=1)[:, np.newaxis]
+            found = dict([(z, set([x for j, x in enumerate(xs) if significant[i, j]]))
+                          for i, z in enumerate(zs)])
+            if deps is None:
+                deps = found
+            else:
+                deps = dict([(z, deps[z] & found[z]) for z in zs])
+        if deps is None:
+            return None
+
+        # maximum matching of targets onto variables (augmenting paths)
+        match = {}
+        def augment(z, seen):
+            for x in deps[z]:
+                if x in seen:
+                    continue
+                seen.add(x)
+                if x not in match or augment(match[x], seen):
+                    match[x] = z
+                    return True
+            return False
+        for z in zs:
+            if not augment(z, set()):
+                return None
+
+        # variable x -> variables that its matched target depends on
+        edges = dict([(x, deps[match[x]] - set([x])) for x in xs])
+
+        # Tarjan's algorithm gives the SCCs sinks-first, which is exactly
+        # the order to solve them in
+        index = {}
+        lowlink = {}
+        stack = []
+        blocks = []
+        def strongconnect(x):
+            index[x] = lowlink[x] = len(index)
+            stack.append(x)
+            for y in edges[x]:
+                if y not in index:
+                    strongconnect(y)
+                    lowlink[x] = min(lowlink[x], lowlink[y])
+                elif y in stack:
+                    lowlink[x] = min(lowlink[x], index[y])
+            if lowlink[x] == index[x]:
+                block = []
+                while True:
+                    y = stack.pop()
+                    block.append(y)
+                    if y == x:
+                        break
+                blocks.append((block, [match[y] for y in block]))
+        for x in xs:
+            if x not in index:
+                strongconnect(x)
+        return blocks
+
+
+def gmres(matvec, b, tol=1e-6, restart=20, maxiter=None, preconditioner=None):
+    """
+    Restarted GMRES for A x = b, where A is only available through
+    matvec(v) = A v. The preconditioner, if given, is a function that
+    applies (an approximation of) the inverse of A; it is applied on the
+    right so that the residual being minimised is the true one.
+
+    maxiter caps the number of matvecs. It defaults to a small budget,
+    min(n, 10), since inside a Newton iteration each one is a model
+    evaluation; pass maxiter=n or more for a solve to full accuracy.
+
+    Returns (x, iterations, relative residual norm).
+    """
+    n = len(b)
+    maxiter = maxiter or min(n, 10)
+    apply_inverse = preconditioner or (lambda v: v)
+    x = np.zeros(n)
+    bnorm = np.linalg.norm(b)
+    if bnorm == 0:
+        return x, 0, 0.0
+
+    r = np.array(b, dtype=float)
+    beta = bnorm
+    total = 0
+    while True:
+        m = min(restart, maxiter - total)
+        V = np.zeros((m+1, n))
+        Z = np.zeros((m, n))
+        H = np.zeros((m+1, m))
+        cs = np.zeros(m)
+        sn = np.zeros(m)
+        g = np.zeros(m+1)
+        g[0] = beta
+        V[0] = r / beta
+
+        k = 0
+        for j in range(m):
+            Z[j] = apply_inverse(V[j])
+            w = matvec(Z[j])
+            total += 1
+            # Arnoldi, with modified Gram-Schmidt
+            for i in range(j+1):
+                H[i,j] = np.dot(w, V[i])
+                w = w - H[i,j]*V[i]
+            H[j+1,j] = np.linalg.norm(w)
+            if H[j+1,j] > 0:
+                V[j+1] = w / H[j+1,j]
+            # Givens rotations keep H upper triangular
+            for i in range(j):
+                H[i,j], H[i+1,j] = (cs[i]*H[i,j] + sn[i]*H[i+1,j],
+                                    -sn[i]*H[i,j] + cs[i]*H[i+1,j])
+            denom = np.hypot(H[j,j], H[j+1,j])
+            if denom == 0:
+                break
+            cs[j], sn[j] = H[j,j]/denom, H[j+1,j]/denom
+            H[j,j], H[j+1,j] = denom, 0.0
+            g[j], g[j+1] = cs[j]*g[j], -sn[j]*g[j]
+            k = j + 1
+            if abs(g[k]) <= tol*bnorm:
+                break
+
+        if k:
+            y = np.linalg.solve(np.triu(H[:k,:k]), g[:k])
+            x = x + np.dot(y, Z[:k])
+        if not k or abs(g[k]) <= tol*bnorm or total >= maxiter:
+            return x, total, abs(g[k]) / bnorm
+
+        # restart from the true residual
+        r = b - matvec(x)
+        beta = np.linalg.norm(r)
+
+class NewtonKrylovSolver(Solver):
+    """
+    A Solver that never forms the jacobian. Each Newton step is found
+    with GMRES, which only needs jacobian-vector products, and those are
+    one engine call each, by differencing along the vector. The cost of
+    a step is then one engine call per Krylov iteration rather than one
+    per solver variable, which pays off on engines with many balance
+    variables, especially as the Newton steps only need solving
+    loosely when far from the answer.
+
+    How loosely is the inexact Newton forcing term: GMRES stops once the
+    linear residual is down by a factor eta, starting from krylov_tol
+    and then following Eisenstat & Walker's choice 2,
+    eta = 0.9*(|F_new|/|F_old|)**2, which tightens as Newton starts
+    converging quickly. GMRES is also held to krylov_iter iterations a
+    step (5 by default), otherwise a step could cost as many engine
+    calls as differencing the whole jacobian.
+
+    A step is only taken if it cuts the residual norm, backing off by
+    halves up to 'backtracks' times. If none of those do, the step is
+    solved again exactly (up to one GMRES iteration per variable), and
+    if that can't be improved on either the solve fails rather than
+    wandering off uphill.
+
+    The variables are scaled by their 'perturbation' settings and the
+    targets by their own size, so that GMRES isn't at the mercy of the
+    units (thrust in N against SFC in kg/N/s). The differencing step for
+    a direction is the one that moves no variable by more than its
+    perturbation.
+
+    GMRES converges in far fewer iterations with a preconditioner. If
+    the solver has a jacobian_cache, any jacobian cached for the current
+    region is used for that, however stale; failing that the predictor's
+    rates are, if there is a predictor.
+    """
+    def __init__(self, engine, input_settings, predictor=None, jacobian_cache=None,
+                 krylov_tol=0.5, restart=20, krylov_iter=5, backtracks=4, conv_crit=1e-6):
+        super(NewtonKrylovSolver,self).__init__(engine, input_settings, predictor,
+                                                jacobian_cache, conv_crit)
+        self.krylov_tol = krylov_tol
+        self.restart = restart
+        self.krylov_iter = krylov_iter
+        self.backtracks = backtracks
+        self.krylov_iterations = 0
+
+    def solve(self, targets, iter_limit=100):
+        solver_targets = {}
+        direct = {}
+        for t,v in targets.iteritems():
+            if t in self.engine.input_aliases:
+                self.engine.set_input_alias(t,v)
+                direct[t]=v
+            else:
+                solver_targets[t]=v
+        self.targets = solver_targets
+
+        isets = self.input_settings
+        assert len(solver_targets) == len(isets)
+        xs = sorted(isets)
+        zs = sorted(solver_targets)
+
+        start, gradients = self.start_values(solver_targets)
+        perturbations = np.array([isets[x]['perturbation'] for x in xs], dtype=float)
+        target = np.array([solver_targets[z] for z in zs], dtype=float)
+        scale = np.where(target != 0, np.abs(target), 1.0)
+
+        trace = self.trace
+        trace.reset()
+        self.calls = 0
+        self.krylov_iterations = 0
+
+        def residual(x):
+            results = self.evaluate(dict(zip(xs, x)))
+            return (np.array([results[z] for z in zs], dtype=float) - target) / scale
+
+        x = np.array([start[v] for v in xs], dtype=float)
+        g = residual(x)
+        eta = self.krylov_tol
+        norm = None
+        for iteration in range(iter_limit+1):
+            values = dict(zip(xs, x))
+            errors = dict(zip(zs, -g*scale))
+            if self.isconverged(errors):
+                trace.record(np.linalg.norm(g*scale), engine_calls=self.calls,
+                             values=values, errors=errors)
+                trace.finish(True)
+                return values
+            if iteration == iter_limit:
+                break
+
+            def matvec(v, x=x, g=g):
+                if not np.any(v):
+                    return np.zeros_like(g)
+                h = 1.0 / np.max(np.abs(v))
+                return (residual(x + h*perturbations*v) - g) / h
+
+            if norm is not None:
+                # Eisenstat & Walker's choice 2, safeguarded so that eta
+                # doesn't drop suddenly when one step happens to go well
+                previous = eta
+                eta = 0.9 * (np.linalg.norm(g) / norm)**2
+                if 0.9 * previous**2 > 0.1:
+                    eta = max(eta, 0.9 * previous**2)
+                eta = min(eta, self.krylov_tol)
+            norm = np.linalg.norm(g)
+
+            preconditioner = self.preconditioner(values, direct, xs, zs, perturbations,
+                                                 scale, gradients)
+            # a loose, cheap step first; the exact one only if that gets nowhere
+            for tol, budget in ((eta, self.krylov_iter), (1e-12, max(self.krylov_iter, len(xs)))):
+                du, iterations, _ = gmres(matvec, -g, tol, self.restart, budget, preconditioner)
+                self.krylov_iterations += iterations
+                dx = perturbations*du
+
+                # back off until the step cuts the residual
+                step = 1.0
+                for attempt in range(self.backtracks+1):
+                    x_new = x + step*dx
+                    g_new = residual(x_new)
+                    if np.all(np.isfinite(g_new)) and np.linalg.norm(g_new) < norm:
+                        break
+                    step *= 0.5
+                else:
+                    continue
+                break
+            else:
+                trace.record(np.linalg.norm(g*scale), engine_calls=self.calls,
+                             values=values, errors=errors)
+                trace.finish(False, 'No step reduces the residual')
+                raise Exception('No step reduces the residual')
+
+            trace.record(np.linalg.norm(g*scale), np.linalg.norm(step*dx), np.nan,
+                         self.calls, values, errors)
+            x, g = x_new, g_new
+
+        trace.finish(False, 'Exceeded iteration limit')
+        raise Exception('Exceeded iteration limit')
+
+    def preconditioner(self, values, direct, xs, zs, perturbations, scale, gradients=None):
+        """
+        The inverse of a stale jacobian, in the scaled variables, as a
+        function. None if there isn't one to be had.
+        """
+        factors = None
+        cache = self.jacobian_cache
+        if cache is not None:
+            entry = cache.get(xs, zs, values, direct)
+            if entry is not None:
+                factors = entry[1]
+        if factors is None and gradients is not None:
+            factors = lu_factor(np.array([[gradients[x][z] for x in xs] for z in zs]))
+        if factors is None:
+            return None
+        return lambda v: lu_solve(factors, scale*v) / perturbations
+
 class TestFunction(object):
     import math
     
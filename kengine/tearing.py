@@ -0,0 +1,183 @@
+"""
+Tools for calculation networks with circular references.
+
+A recirculating flow (bleed return, recuperator, cooling air that is put
+back into the main stream) makes the Calculable graph cyclic: nothing in
+the loop can calculate because it is always waiting on itself. We deal
+with this by tearing the loop at a Station. The torn station loses its
+upstream link, so the graph becomes acyclic, and its upstream component
+writes into a shadow station instead. The engine then guesses the torn
+station's state, runs a pass, compares the guess with what arrived in
+the shadow station and goes round again. The fixed-point iteration is
+accelerated with Anderson mixing (or Aitken relaxation) so that loops
+normally close in a handful of passes.
+"""
+import numpy as np
+
+
+def find_cycles(nodes):
+    """
+    Returns the strongly connected components (following dependents) of
+    the given Calculables that contain a cycle, as lists of nodes.
+    """
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    cycles = []
+
+    # iterative Tarjan so that long flow paths don't hit the recursion limit
+    for root in nodes:
+        if id(root) in index:
+            continue
+        work = [(root, iter(root.dependents))]
+        index[id(root)] = lowlink[id(root)] = len(index)
+        stack.append(root)
+        on_stack.add(id(root))
+        while work:
+            node, children = work[-1]
+            advanced = False
+            for child in children:
+                if id(child) not in index:
+                    index[id(child)] = lowlink[id(child)] = len(index)
+                    stack.append(child)
+                    on_stack.add(id(child))
+                    work.append((child, iter(child.dependents)))
+                    advanced = True
+                    break
+                elif id(child) in on_stack:
+                    lowlink[id(node)] = min(lowlink[id(node)], index[id(child)])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[id(parent)] = min(lowlink[id(parent)], lowlink[id(node)])
+            if lowlink[id(node)] == index[id(node)]:
+                component = []
+                while True:
+                    n = stack.pop()
+                    on_stack.discard(id(n))
+                    component.append(n)
+                    if n is node:
+                        break
+                if len(component) > 1 or node in node.dependents:
+                    cycles.append(component)
+    return cycles
+
+
+def select_tear(cycle, station_type):
+    """
+    Picks the station to tear in a cycle. We prefer stations feeding a
+    mixing point (a dependent with several inlet stations), which is
+    where a recirculating stream rejoins the main flow, then go by name so
+    that the choice is repeatable. Only stations count as inlets: a
+    turbine also has its shaft as a precedent, but it isn't mixing flows.
+    """
+    members = set([id(n) for n in cycle])
+    candidates = [n for n in cycle if isinstance(n, station_type)]
+    if not candidates:
+        raise Exception('Cannot tear a cycle with no stations in it')
+
+    def inlets(component):
+        return len([p for p in component.precedents if isinstance(p, station_type)])
+
+    def score(station):
+        mixing = sum([inlets(d) > 1 for d in station.dependents
+                      if id(d) in members])
+        return (-mixing, str(station.name))
+    return sorted(candidates, key=score)[0]
+
+
+class Tear(object):
+    """
+    Records a torn station, the component that used to feed it and the
+    shadow station that component now writes to.
+    """
+    fields = ('p', 't', 'w', 'far')
+
+    def __init__(self, station, source, shadow):
+        self.station = station
+        self.source = source
+        self.shadow = shadow
+
+    def guess(self):
+        return [getattr(self.station, f) for f in self.fields]
+
+    def set_guess(self, values):
+        for f, v in zip(self.fields, values):
+            setattr(self.station, f, v)
+
+    def result(self):
+        return [getattr(self.shadow, f) for f in self.fields]
+
+    def unset(self):
+        """True if the torn station has never been given a state."""
+        return not (np.any(self.station.p) or np.any(self.station.t) or
+                    np.any(self.station.w))
+
+    def clear(self):
+        for f in self.fields:
+            setattr(self.station, f, 0.0)
+
+    def seed(self, station):
+        """Starts the torn station off from another station's state."""
+        self.set_guess([getattr(station, f) for f in self.fields])
+
+
+class Picard(object):
+    """Plain successive substitution, x <- g(x)."""
+    def __init__(self, **settings):
+        pass
+
+    def next(self, x, g):
+        return g
+
+
+class Aitken(object):
+    """
+    Dynamic (Aitken) relaxation of the fixed-point update, with the
+    relaxation factor recomputed from the last two residuals.
+    """
+    def __init__(self, relaxation=1.0, **settings):
+        self.omega = relaxation
+        self.last_r = None
+
+    def next(self, x, g):
+        r = g - x
+        if self.last_r is not None:
+            dr = r - self.last_r
+            denom = np.dot(dr, dr)
+            if denom > 0.0:
+                self.omega = -self.omega * np.dot(self.last_r, dr) / denom
+        self.last_r = r
+        return x + self.omega * r
+
+
+class Anderson(object):
+    """
+    Anderson mixing over the last 'depth' iterates. Falls back to plain
+    substitution until there is some history to work with.
+    """
+    def __init__(self, depth=5, **settings):
+        self.depth = depth
+        self.xs = []
+        self.gs = []
+
+    def next(self, x, g):
+        self.xs.append(x)
+        self.gs.append(g)
+        if len(self.xs) > self.depth + 1:
+            self.xs.pop(0)
+            self.gs.pop(0)
+        if len(self.xs) < 2:
+            return g
+
+        f = [gg - xx for xx, gg in zip(self.xs, self.gs)]
+        dF = np.column_stack([f[i+1] - f[i] for i in range(len(f) - 1)])
+        dG = np.column_stack([self.gs[i+1] - self.gs[i] for i in range(len(f) - 1)])
+        gamma = np.linalg.lstsq(dF, f[-1], rcond=None)[0]
+        return g - np.dot(dG, gamma)
+
+
+ACCELERATORS = {'picard': Picard, 'aitken': Aitken, 'anderson': Anderson}
@@ -0,0 +1,289 @@
+"""
+Transient simulation: spool speeds that change over time under a fuel
+flow schedule.
+
+At steady state every Shaft balances, with its turbine producing exactly
+the power that its compressors take. In a transient the turbines run at
+a fixed expansion ratio instead (the usual choked-nozzle approximation),
+calibrated from the steady point the simulation starts at, and the
+combustor is driven by fuel flow rather than exit temperature. Any
+power surplus or deficit then accelerates or decelerates the spool:
+
+    J * omega * d(omega)/dt = P_turbine - P_compressors
+
+The speed-dependent inputs (compressor pressure ratios, intake flow,
+...) follow working-line schedules of fractional speed N, where N = 1 is
+the starting point.
+
+The speeds are integrated with backward Euler, which is stable for the
+stiff small-spool dynamics at any step size. The implicit equations are
+solved with a modified Newton iteration: the Jacobian of the speed
+derivatives is kept from step to step and only recomputed when the
+iteration stops contracting, so most steps cost two or three engine
+calculations. The step size adapts to a local error estimate.
+
+    sim = Transient(engine, {'HPSHAFT': ShaftDynamics(0.5, 30000.0,
+                                 {'HPCPR': ([0.8, 1.0, 1.1], [20.0, 40.0, 48.0])})})
+    history = sim.run(5.0, ([0.0, 1.0, 1.2], [wf0, wf0, 1.3*wf0]))
+    print sim.stats()
+"""
+import numpy as np
+
+
+class TransientError(Exception):
+    """Raised when the integrator cannot take a step."""
+    pass
+
+
+class ShaftDynamics(object):
+    """
+    Inertia [kg m^2] and speed [rpm] at the starting point for a shaft,
+    plus its working-line schedules. The schedules map an input alias (or
+    a (component, attribute) path) to either a (speeds, values) table,
+    interpolated in fractional speed, or a function of fractional speed.
+    """
+    def __init__(self, inertia, design_speed, schedules=None):
+        self.inertia = inertia
+        self.design_omega = design_speed * np.pi / 30.0
+        self.schedules = schedules or {}
+
+    def scheduled(self, speed):
+        values = {}
+        for key, schedule in self.schedules.items():
+            if callable(schedule):
+                values[key] = schedule(speed)
+            else:
+                speeds, table = schedule
+                values[key] = np.interp(speed, speeds, table)
+        return values
+
+    def acceleration(self, speed, surplus):
+        """d(N)/dt for a power surplus [W] at fractional speed N."""
+        return surplus / (self.inertia * speed * self.design_omega**2)
+
+
+class Transient(object):
+    """
+    Integrates the spool speeds of an EngineAssembly through a fuel flow
+    schedule. 'shafts' maps shaft idents to ShaftDynamics.
+    """
+    def __init__(self, engine, shafts, combustor='COMBUSTOR', rtol=1e-4, atol=1e-6,
+                 first_step=1e-3, max_step=0.1, min_step=1e-8, newton_tol=1e-9,
+                 newton_iter=6, perturbation=1e-5):
+        self.engine = engine
+        self.shafts = sorted(shafts.items())
+        self.combustor = combustor
+        self.rtol = rtol
+        self.atol = atol
+        self.first_step = first_step
+        self.max_step = max_step
+        self.min_step = min_step
+        self.newton_tol = newton_tol
+        self.newton_iter = newton_iter
+        self.perturbation = perturbation
+
+        self.jacobian = None
+        self.iteration_matrix = None
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.steps = 0
+        self.rejected = 0
+        self.evaluations = 0
+        self.jacobians = 0
+        self.simulated = 0.0
+
+    def stats(self):
+        return {'steps': self.steps,
+                'rejected': self.rejected,
+                'evaluations': self.evaluations,
+                'jacobians': self.jacobians,
+                'simulated': self.simulated,
+                'evaluations_per_second': self.evaluations / max(self.simulated, 1e-300),
+                'steps_per_second': self.steps / max(self.simulated, 1e-300)}
+
+    def set_input(self, key, value):
+        if isinstance(key, tuple):
+            self.engine[key[0]][key[1]] = value
+        else:
+            self.engine.set_input_alias(key, value)
+
+    def get_input(self, key):
+        if isinstance(key, tuple):
+            return self.engine[key[0]][key[1]]
+        return self.engine.get_input_alias(key)
+
+    def calibrate(self):
+        """
+        Calculates the engine at its current inputs and switches it into
+        transient mode around that point. Returns the steady fuel flow.
+        """
+        engine = self.engine
+        engine.update()
+        self.saved = {}
+        for ident, dynamics in self.shafts:
+            for key in dynamics.schedules:
+                self.saved[key] = self.get_input(key)
+
+        combustor = engine[self.combustor]
+        fuel_flow = combustor.fuel_flow()
+        combustor.attributes['WF'] = fuel_flow
+        combustor.make_dirty()
+        for ident, dynamics in self.shafts:
+            turbine = engine[ident].driver
+            turbine.attributes['ER'] = turbine.inlet.p / turbine.exit.p
+            turbine.make_dirty()
+        self.jacobian = None
+        return fuel_flow
+
+    def restore(self):
+        """Puts the engine back into steady-state mode."""
+        engine = self.engine
+        engine[self.combustor].attributes.pop('WF', None)
+        engine[self.combustor].make_dirty()
+        for ident, dynamics in self.shafts:
+            turbine = engine[ident].driver
+            turbine.attributes.pop('ER', None)
+            turbine.make_dirty()
+        with engine.batch_update():
+            for key, value in self.saved.items():
+                self.set_input(key, value)
+
+    def derivatives(self, speeds, fuel_flow):
+        """d(N)/dt for every shaft at the given speeds and fuel flow."""
+        engine = self.engine
+        with engine.batch_update():
+            for (ident, dynamics), speed in zip(self.shafts, speeds):
+                for key, value in dynamics.scheduled(speed).items():
+                    self.set_input(key, value)
+            engine[self.combustor]['WF'] = fuel_flow
+        engine.update()
+        self.evaluations += 1
+
+        rates = np.empty(len(self.shafts))
+        for i, (ident, dynamics) in enumerate(self.shafts):
+            shaft = engine[ident]
+            rates[i] = dynamics.acceleration(speeds[i], shaft.driver.power - shaft.power)
+        return rates
+
+    def update_jacobian(self, speeds, fuel_flow, rates):
+        jacobian = np.empty((len(speeds), len(speeds)))
+        for j in range(len(speeds)):
+            perturbed = speeds.copy()
+            perturbed[j] += self.perturbation
+            jacobian[:, j] = (self.derivatives(perturbed, fuel_flow) - rates) / self.perturbation
+        self.jacobian = jacobian
+        self.iteration_matrix = None
+        self.jacobians += 1
+
+    def newton(self, speeds, rates, fuel_flow, h):
+        """
+        Solves speeds1 = speeds + h*f(speeds1) starting from the explicit
+        Euler predictor. Returns (speeds1, rates1), or None if the
+        iteration isn't contracting.
+        """
+        if self.iteration_matrix is None or self.iteration_matrix[0] != h:
+            matrix = np.eye(len(speeds)) - h*self.jacobian
+            self.iteration_matrix = (h, np.linalg.inv(matrix))
+        inverse = self.iteration_matrix[1]
+
+        guess = speeds + h*rates
+        last = None
+        for _ in range(self.newton_iter):
+            f = self.derivatives(guess, fuel_flow)
+            correction = -np.dot(inverse, guess - speeds - h*f)
+            guess = guess + correction
+            size = np.max(np.abs(correction))
+            if size <= self.newton_tol:
+                # the rates at the final iterate, to first order
+                return guess, f + np.dot(self.jacobian, correction)
+            if last is not None and size > 0.5*last:
+                return None
+            last = size
+        return None
+
+    def run(self, duration, fuel_flow, speeds=None):
+        """
+        Integrates for 'duration' seconds from the engine's current steady
+        point. fuel_flow is a function of time or a (times, values) table.
+        The starting speeds default to 1 (the steady point itself).
+
+        Returns a dict of arrays: time 't', fuel flow 'WF', the fractional
+        speed of each shaft under its ident, and the engine outputs, at
+        every accepted step.
+        """
+        if not callable(fuel_flow):
+            times, values = fuel_flow
+            fuel_flow = lambda t: float(np.interp(t, times, values))
+
+        self.calibrate()
+        try:
+            return self.integrate(duration, fuel_flow, speeds)
+        finally:
+            self.restore()
+
+    def integrate(self, duration, fuel_flow, speeds):
+        if speeds is None:
+            speeds = np.ones(len(self.shafts))
+        speeds = np.array(speeds, dtype=float)
+        t = 0.0
+        rates = self.derivatives(speeds, fuel_flow(t))
+
+        # recorded before the jacobian leaves the engine at a perturbed speed
+        history = {'t': [t], 'WF': [fuel_flow(t)]}
+        for i, (ident, dynamics) in enumerate(self.shafts):
+            history[ident] = [speeds[i]]
+        outputs = self.engine.get_output_aliases()
+        for name, value in self.engine.get_outputs():
+            history[name] = [value]
+
+        if self.jacobian is None:
+            self.update_jacobian(speeds, fuel_flow(t), rates)
+
+        h = self.first_step
+        fresh = True
+        while t < duration*(1 - 1e-12):
+            h = min(h, self.max_step, duration - t)
+            if h < self.min_step:
+                raise TransientError('Step size fell below %g at t=%g' % (self.min_step, t))
+            wf = fuel_flow(t + h)
+            step = self.newton(speeds, rates, wf, h)
+
+            if step is None:
+                self.rejected += 1
+                if fresh:
+                    h *= 0.5
+                else:
+                    # try again with an up to date jacobian before
+                    # blaming the step size
+                    self.update_jacobian(speeds, fuel_flow(t), rates)
+                    fresh = True
+                continue
+
+            new_speeds, new_rates = step
+            # backward Euler's local error is about h**2/2 * N'', and
+            # N'' is about (f1 - f0)/h
+            scale = self.rtol*np.abs(new_speeds) + self.atol
+            error = np.max(0.5*h*np.abs(new_rates - rates) / scale)
+            if error > 1.0:
+                self.rejected += 1
+                h *= max(0.2, 0.9/error**0.5)
+                continue
+
+            t += h
+            speeds, rates = new_speeds, new_rates
+            self.steps += 1
+            self.simulated += h
+            fresh = False
+
+            history['t'].append(t)
+            history['WF'].append(wf)
+            for i, (ident, dynamics) in enumerate(self.shafts):
+                history[ident].append(speeds[i])
+            for name in outputs:
+                history[name].append(self.engine.get_output_alias(name))
+
+            h *= min(2.0, 0.9/max(error, 1e-10)**0.5)
+
+        self.speeds = speeds
+        return dict([(k, np.array(v)) for k, v in history.items()])
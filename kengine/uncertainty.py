@@ -0,0 +1,280 @@
+"""
+Monte Carlo uncertainty propagation through an engine (or an XRates
+model).
+
+Inputs are described by distributions, keyed either by input alias
+('RIT') or by a (component, attribute) path such as ('HPC', 'PR') for
+component attributes that don't have an alias. Samples are drawn and
+pushed through the model a chunk at a time as numpy arrays, so the
+model's calculations need to be numpy-friendly.
+
+Nothing is kept per sample. Each chunk is folded into a StreamingStats
+object holding running means, the co-moment matrix (for variances and
+input/output correlations), min/max and a fixed-size reservoir sample
+for quantiles. Partial statistics from different chunks or worker
+processes merge exactly (apart from the reservoir, which stays a
+uniform random subsample), so memory use doesn't grow with the number
+of samples.
+"""
+import multiprocessing
+
+import numpy as np
+
+
+class Normal(object):
+    def __init__(self, mean, std):
+        self.mean = mean
+        self.std = std
+
+    def sample(self, n, rng):
+        return rng.normal(self.mean, self.std, n)
+
+
+class Uniform(object):
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self, n, rng):
+        return rng.uniform(self.low, self.high, n)
+
+
+class Triangular(object):
+    def __init__(self, low, mode, high):
+        self.low = low
+        self.mode = mode
+        self.high = high
+
+    def sample(self, n, rng):
+        return rng.triangular(self.low, self.mode, self.high, n)
+
+
+class StreamingStats(object):
+    """
+    Running statistics over rows of a fixed set of named variables.
+    Means and co-moments are combined with the pairwise update of Chan et
+    al., so update() and merge() give the same answer as a single pass.
+    """
+    def __init__(self, names, reservoir_size=10000, seed=None):
+        self.names = list(names)
+        d = len(self.names)
+        self.n = 0
+        self.rejected = 0
+        self.mean = np.zeros(d)
+        self.comoment = np.zeros((d, d))
+        self.min = np.full(d, np.inf)
+        self.max = np.full(d, -np.inf)
+        self.reservoir_size = reservoir_size
+        self.reservoir = np.empty((0, d))
+        self.rng = np.random.RandomState(seed)
+
+    def update(self, rows):
+        """Adds a (samples x variables) array. Non-finite rows are counted and skipped."""
+        rows = np.asarray(rows, dtype=float)
+        finite = np.all(np.isfinite(rows), axis=1)
+        self.rejected += len(rows) - np.count_nonzero(finite)
+        rows = rows[finite]
+        if not len(rows):
+            return
+
+        chunk = StreamingStats(self.names, self.reservoir_size)
+        chunk.n = len(rows)
+        chunk.mean = rows.mean(axis=0)
+        centred = rows - chunk.mean
+        chunk.comoment = np.dot(centred.T, centred)
+        chunk.min = rows.min(axis=0)
+        chunk.max = rows.max(axis=0)
+        if len(rows) > self.reservoir_size:
+            keep = self.rng.choice(len(rows), self.reservoir_size, replace=False)
+            chunk.reservoir = rows[keep]
+        else:
+            chunk.reservoir = rows
+        self.merge(chunk)
+
+    def merge(self, other):
+        """Folds another StreamingStats (over the same variables) into this one."""
+        assert other.names == self.names
+        self.rejected += other.rejected
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.comoment = (self.comoment + other.comoment +
+                         np.outer(delta, delta) * self.n * other.n / n)
+        self.mean = self.mean + delta * other.n / n
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.reservoir = self.merge_reservoirs(self.reservoir, self.n,
+                                               other.reservoir, other.n)
+        self.n = n
+
+    def merge_reservoirs(self, a, na, b, nb):
+        k = self.reservoir_size
+        if len(a) + len(b) <= k:
+            return np.vstack([a, b])
+        # each slot comes from a with probability na/(na+nb)
+        from_a = self.rng.binomial(k, float(na) / (na + nb))
+        from_a = min(max(from_a, k - len(b)), len(a))
+        pick_a = self.rng.choice(len(a), from_a, replace=False)
+        pick_b = self.rng.choice(len(b), k - from_a, replace=False)
+        return np.vstack([a[pick_a], b[pick_b]])
+
+    def variance(self):
+        return self.comoment.diagonal() / max(self.n - 1, 1)
+
+    def std(self):
+        return self.variance()**0.5
+
+    def covariance(self):
+        return self.comoment / max(self.n - 1, 1)
+
+    def correlation(self):
+        std = self.std()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.covariance() / np.outer(std, std)
+
+    def quantiles(self, q):
+        """Approximate quantiles (q in [0,1]) from the reservoir sample."""
+        return np.percentile(self.reservoir, np.asarray(q) * 100.0, axis=0)
+
+    def summary(self, q=(0.05, 0.5, 0.95)):
+        """
+        Returns {name: {'mean':..., 'std':..., 'min':..., 'max':...,
+                        'quantiles': {q: value}}}
+        """
+        std = self.std()
+        quantiles = self.quantiles(q)
+        results = {}
+        for i, name in enumerate(self.names):
+            results[name] = {'mean': self.mean[i], 'std': std[i],
+                             'min': self.min[i], 'max': self.max[i],
+                             'quantiles': dict([(qq, quantiles[j][i])
+                                                for j, qq in enumerate(q)])}
+        return results
+
+
+class MonteCarlo(object):
+    """
+    Samples the given distributions and propagates them through the
+    model's calculate() method a chunk at a time.
+
+    distributions: {alias or (component, attribute): distribution}
+    nominal: values for any model inputs that aren't sampled (XRates
+             models need every input on every call)
+    outputs: names of the outputs to keep statistics on (default: all)
+    """
+    def __init__(self, model, distributions, nominal=None, outputs=None,
+                 reservoir_size=10000):
+        self.model = model
+        self.distributions = distributions
+        self.nominal = nominal or {}
+        self.outputs = outputs
+        self.reservoir_size = reservoir_size
+        self.sampled = sorted(distributions)
+
+    def input_names(self):
+        return [k if isinstance(k, basestring) else '.'.join(k) for k in self.sampled]
+
+    def evaluate(self, n, seed):
+        """
+        Draws and evaluates one chunk of n samples. Returns a dict of
+        input and output arrays. An engine's inputs are put back as they
+        were afterwards, so that it isn't left holding sample arrays.
+        """
+        rng = np.random.RandomState(seed)
+        inputs = dict(self.nominal)
+        samples = {}
+        saved = self.snapshot()
+        try:
+            for key, name in zip(self.sampled, self.input_names()):
+                values = self.distributions[key].sample(n, rng)
+                samples[name] = values
+                if isinstance(key, basestring):
+                    inputs[key] = values
+                else:
+                    component, attribute = key
+                    self.model[component][attribute] = values
+
+            with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+                outputs = self.model.calculate(inputs)
+        finally:
+            self.restore(saved)
+        if self.outputs is None:
+            self.outputs = sorted(outputs)
+        for name in self.outputs:
+            samples[name] = np.broadcast_to(outputs[name], (n,))
+        return samples
+
+    def snapshot(self):
+        """
+        The current values of the engine inputs that evaluate sets: the
+        sampled component attributes, and the sampled and nominal aliases
+        (an XRates model has no state to keep).
+        """
+        saved = [(key, self.model[key[0]][key[1]]) for key in self.sampled
+                 if not isinstance(key, basestring)]
+        if hasattr(self.model, 'get_input_alias'):
+            aliases = set(self.nominal).union([key for key in self.sampled
+                                               if isinstance(key, basestring)])
+            saved.extend([(alias, self.model.get_input_alias(alias)) for alias in aliases])
+        return saved
+
+    def restore(self, saved):
+        for key, value in saved:
+            if isinstance(key, basestring):
+                self.model.set_input_alias(key, value)
+            else:
+                self.model[key[0]][key[1]] = value
+
+    def run_chunk(self, n, seed):
+        samples = self.evaluate(n, seed)
+        stats = StreamingStats(self.input_names() + self.outputs,
+                               self.reservoir_size, seed)
+        stats.update(np.column_stack([samples[name] for name in stats.names]))
+        return stats
+
+    def chunks(self, n_samples, chunk_size, seed):
+        """(size, seed) for each chunk. Chunk seeds don't depend on the worker count."""
+        tasks = []
+        for i, start in enumerate(range(0, n_samples, chunk_size)):
+            tasks.append((min(chunk_size, n_samples - start), [seed, i]))
+        return tasks
+
+    def run(self, n_samples, chunk_size=10000, workers=1, seed=0):
+        """
+        Runs n_samples through the model and returns the merged
+        StreamingStats. With workers > 1 the chunks are farmed out to a
+        multiprocessing pool; the model is pickled once per worker.
+        """
+        tasks = self.chunks(n_samples, chunk_size, seed)
+        if self.outputs is None:
+            # a tiny probe run to find out what the model produces
+            self.evaluate(1, seed)
+        total = StreamingStats(self.input_names() + self.outputs,
+                               self.reservoir_size, seed)
+
+        if workers <= 1:
+            for n, chunk_seed in tasks:
+                total.merge(self.run_chunk(n, chunk_seed))
+            return total
+
+        pool = multiprocessing.Pool(workers, _init_worker, (self,))
+        try:
+            for stats in pool.imap_unordered(_run_chunk, tasks):
+                total.merge(stats)
+        finally:
+            pool.close()
+            pool.join()
+        return total
+
+
+# per-process state for the worker pool
+_worker_mc = None
+
+def _init_worker(mc):
+    global _worker_mc
+    _worker_mc = mc
+
+def _run_chunk(task):
+    n, seed = task
+    return _worker_mc.run_chunk(n, seed)
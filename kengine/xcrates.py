@@ -1,3 +1,5 @@
+import numpy as np
+
 class XCTypes(object):
     ADDER = 0
     FACTOR = 1
@@ -27,6 +29,52 @@ class XRates(object):
             outputs[onm]=result
         return outputs
 
+    def gradients(self, inputs, outputs):
+        """
+        The rates in the Solver's jacobian layout:
+        { input: { output: rate } }
+        """
+        return dict([(inm, dict([(onm, self.xrates[onm][self.xheader.index(inm)])
+                                 for onm in outputs]))
+                     for inm in inputs])
+
+    def solve_inverse(self, targets, fixed=None):
+        """
+        Works backwards from target outputs to the inputs that give them.
+        Inputs in 'fixed' are held at the values given; all the others are
+        solved for, in the least squares sense if there are more targets
+        than free inputs (and with the smallest change from inputs_orig if
+        there are fewer). Targets and fixed values may be arrays, in which
+        case every point is solved in one go.
+
+        Returns a dict of the solved inputs.
+        """
+        fixed = fixed or {}
+        free = [inm for inm in self.xheader if inm not in fixed]
+        onms = list(targets)
+        values = [np.asarray(v, dtype=float) for v in targets.values() + fixed.values()]
+        shape = np.broadcast(*values).shape if values else ()
+
+        # what's left to find once the fixed inputs have had their say,
+        # one column per point
+        rhs = []
+        for onm in onms:
+            needed = targets[onm] - self.outputs_orig[onm]
+            for inm, ival in fixed.items():
+                index = self.xheader.index(inm)
+                needed = needed - self.xrates[onm][index] * (ival - self.inputs_orig[inm])
+            rhs.append(np.broadcast_to(needed, shape).ravel())
+
+        A = np.array([[self.xrates[onm][self.xheader.index(inm)] for inm in free]
+                      for onm in onms], dtype=float)
+        deltas = np.linalg.lstsq(A, np.array(rhs), rcond=None)[0]
+
+        inputs = {}
+        for i, inm in enumerate(free):
+            value = self.inputs_orig[inm] + deltas[i].reshape(shape)
+            inputs[inm] = float(value) if not shape else value
+        return inputs
+
 
 def get_test_xrates():
     inputs_orig = {'a':1.0,'b':10.0,'c':20.}
@@ -0,0 +1,10 @@
+"""
+The kengine modules import each other by name, so they are put on the
+path here. Run the tests from the top of the repository with:
+
+    python -m unittest discover -t . -s tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kengine'))
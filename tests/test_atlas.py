@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from atlas import XRatesAtlas
+from engines import TurboJet
+from xcrates import XRates
+
+
+def sines(points):
+    """XRates tables for y = sin(a) + sin(b) + sin(c), anchored at points."""
+    return [XRates(dict(zip('abc', x)), {'y': float(np.sin(x).sum())}, list('abc'),
+                   {'y': list(np.cos(x))}) for x in points]
+
+
+class AtlasTest(unittest.TestCase):
+    def setUp(self):
+        self.points = np.random.RandomState(0).uniform(0.0, 1.0, (300, 3))
+        self.atlas = XRatesAtlas(sines(self.points))
+
+    def calculate(self, points):
+        return self.atlas.calculate(dict(zip('abc', np.asarray(points).T)))['y']
+
+    def test_exact_at_anchors(self):
+        np.testing.assert_allclose(self.calculate(self.points), np.sin(self.points).sum(axis=1))
+
+    def test_accurate_between_anchors(self):
+        query = np.random.RandomState(1).uniform(0.1, 0.9, (500, 3))
+        error = self.calculate(query) - np.sin(query).sum(axis=1)
+        self.assertTrue(np.abs(error).max() < 0.05)
+
+    def test_continuous(self):
+        t = np.linspace(0.0, 1.0, 20001)[:, np.newaxis]
+        line = (1 - t) * np.array([0.05, 0.2, 0.9]) + t * np.array([0.95, 0.7, 0.1])
+        steps = np.abs(np.diff(self.calculate(line)))
+        # the function itself moves by about 1e-4 per step
+        self.assertTrue(steps.max() < 1e-3, steps.max())
+
+    def test_grid_finds_everything_in_reach(self):
+        atlas = self.atlas
+        query = np.random.RandomState(2).uniform(-0.2, 1.2, (200, 3)) / atlas.scale
+        found = atlas.candidates(query)
+        for q, row in zip(query, found):
+            reach = np.flatnonzero(np.sqrt(((atlas.points - q)**2).sum(axis=1)) < atlas.radius)
+            self.assertTrue(set(reach) <= set(row[row >= 0]))
+
+    def test_far_away_uses_nearest_table(self):
+        far = np.array([[3.0, 0.5, 0.5]])
+        nearest = np.argmin(((self.points - far)**2).sum(axis=1))
+        expected = self.atlas.table(nearest).calculate(dict(zip('abc', far[0])))['y']
+        self.assertAlmostEqual(self.calculate(far)[0], expected)
+
+    def test_input_without_spread(self):
+        points = self.points.copy()
+        points[:, 2] = 0.5
+        atlas = XRatesAtlas(sines(points))
+        # off the plane, the rates carry it
+        outputs = atlas.calculate({'a': points[:, 0], 'b': points[:, 1], 'c': 0.51})
+        np.testing.assert_allclose(outputs['y'], np.sin(points).sum(axis=1) + 0.01*np.cos(0.5))
+
+    def test_scalar_and_shape(self):
+        self.assertTrue(isinstance(self.atlas.calculate({'a': 0.5, 'b': 0.5, 'c': 0.5})['y'],
+                                   float))
+        y = self.atlas.calculate({'a': np.zeros((2, 3)) + 0.5, 'b': 0.5, 'c': 0.5})['y']
+        self.assertEqual(y.shape, (2, 3))
+
+    def test_tables_must_match(self):
+        tables = sines(self.points[:2])
+        tables[1].outputs_orig['z'] = 0.0
+        self.assertRaises(ValueError, XRatesAtlas, tables)
+
+    def test_save_and_load(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'atlas.npz')
+            self.atlas.save(path)
+            atlas = XRatesAtlas.load(path)
+        finally:
+            shutil.rmtree(tmp)
+        self.assertEqual(atlas.radius, self.atlas.radius)
+        query = {'a': np.linspace(0, 1, 7), 'b': 0.3, 'c': 0.6}
+        np.testing.assert_array_equal(atlas.calculate(query)['y'],
+                                      self.atlas.calculate(query)['y'])
+
+
+class FromEngineTest(unittest.TestCase):
+    def test_tables_match_the_engine(self):
+        engine = TurboJet()
+        rit, pr = np.meshgrid(np.linspace(1200.0, 1600.0, 5), np.linspace(10.0, 30.0, 5))
+        anchors = {'RIT': rit.ravel(), 'HPCPR': pr.ravel(), 'FLOW': 20.0}
+        atlas = XRatesAtlas.from_engine(engine, anchors,
+                                        {'RIT': 1.0, 'HPCPR': 0.01, 'FLOW': 0.001},
+                                        ['THRUST', 'SFC'])
+        self.assertEqual(len(atlas.X0), 25)
+        query = {'RIT': 1412.0, 'HPCPR': 17.3, 'FLOW': 20.5}
+        expected = engine.calculate(dict(query))
+        outputs = atlas.calculate(query)
+        for y in ('THRUST', 'SFC'):
+            self.assertTrue(abs(outputs[y] / expected[y] - 1) < 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
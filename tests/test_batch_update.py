@@ -0,0 +1,72 @@
+import unittest
+
+from engines import TurboJet
+from performance import Calculable
+
+
+class BatchUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = TurboJet()
+        self.engine.calculate({})
+
+    def dirty(self):
+        return sorted([c.name for c in self.engine.calculables() if c.dirty])
+
+    def test_deferred_to_the_end(self):
+        engine = self.engine
+        with engine.batch_update():
+            engine['HPC']['PR'] = 20.0
+            engine['COMBUSTOR']['TEX'] = 1600.0
+            self.assertEqual(self.dirty(), [])
+        self.assertTrue(engine['HPC'].dirty and engine['NOZ'].dirty)
+        self.assertFalse(engine['INTAKE'].dirty)
+
+    def test_nested(self):
+        engine = self.engine
+        with engine.batch_update():
+            with engine.batch_update():
+                engine['HPC']['PR'] = 20.0
+            self.assertEqual(self.dirty(), [])
+        self.assertTrue(engine['HPC'].dirty)
+
+    def test_flushed_after_an_error(self):
+        engine = self.engine
+        try:
+            with engine.batch_update():
+                engine['HPC']['PR'] = 20.0
+                raise ValueError('x')
+        except ValueError:
+            pass
+        self.assertEqual(engine.batch.depth, 0)
+        self.assertTrue(engine['HPC'].dirty)
+
+    def test_same_results(self):
+        inputs = {'HPCPR': 20.0, 'RIT': 1600.0, 'FLOW': 25.0}
+        batched = self.engine.calculate(dict(inputs))
+        one_at_a_time = TurboJet()
+        one_at_a_time.calculate({})
+        for name, value in inputs.items():
+            one_at_a_time.set_input_alias(name, value)
+        self.assertEqual(batched, one_at_a_time.calculate({}))
+
+    def test_bad_attribute_still_raises(self):
+        def bad():
+            with self.engine.batch_update():
+                self.engine['HPC']['XX'] = 1.0
+        self.assertRaises(LookupError, bad)
+
+
+class MakeDirtyTest(unittest.TestCase):
+    def test_stops_at_dirty_nodes(self):
+        a, b, c = Calculable(), Calculable(), Calculable()
+        a.dependents = [b]
+        b.dependents = [c]
+        c.dependents = [a]
+        for n in (a, b, c):
+            n.dirty = False
+        a.make_dirty()
+        self.assertTrue(a.dirty and b.dirty and c.dirty)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import builder
+from builder import DefinitionError, EngineBuilder
+from engines import TurboJet
+
+
+TURBOJET = {
+    'components': {
+        'INTAKE': {'type': 'Intake', 'attributes': {'W': 1.0}, 'exit': '2'},
+        'HPC': {'type': 'Compressor', 'attributes': {'PR': 40.0}, 'inlet': '2', 'exit': '3'},
+        'COMBUSTOR': {'type': 'Combustor', 'attributes': {'TEX': 1600.0, 'FHV': 45.0e6},
+                      'inlet': '3', 'exit': '4'},
+        'HPT': {'type': 'Turbine', 'inlet': '4', 'exit': '5'},
+        'NOZ': {'type': 'Nozzle', 'inlet': '5'}},
+    'stations': ['2', '3', '4', '5'],
+    'shafts': {'HPSHAFT': {'name': 'hp_shaft', 'turbine': 'HPT', 'driven': ['HPC']}},
+    'inputs': {'HPCPR': {'path': ['HPC', 'PR'], 'min': 10.0, 'max': 25.0},
+               'RIT': {'path': ['COMBUSTOR', 'TEX']},
+               'FLOW': {'path': ['INTAKE', 'W']}},
+    'outputs': {'THRUST': ['ENGINE', 'THRUST'], 'SFC': ['ENGINE', 'SFC']},
+    'environment': {'p': 30000.0, 't': 300.0, 'w': 1.0}}
+
+INPUTS = {'HPCPR': 15.0, 'RIT': 1500.0, 'FLOW': 20.0}
+
+
+class BuildTest(unittest.TestCase):
+    def test_matches_hand_written_engine(self):
+        engine = EngineBuilder().build(TURBOJET)
+        self.assertEqual(engine.calculation_order, ['INTAKE', 'HPC', 'COMBUSTOR', 'HPT', 'NOZ'])
+        self.assertEqual(engine.calculate(INPUTS), TurboJet().calculate(INPUTS))
+
+    def test_builds_are_independent(self):
+        one = EngineBuilder().build(TURBOJET)
+        two = EngineBuilder().build(TURBOJET)
+        two['HPC']['PR'] = 3.0
+        self.assertEqual(one['HPC']['PR'], 40.0)
+
+    def check_error(self, change, message):
+        definition = copy.deepcopy(TURBOJET)
+        change(definition)
+        try:
+            EngineBuilder().build(definition)
+        except DefinitionError, e:
+            self.assertTrue(message in str(e), str(e))
+        else:
+            self.fail('no DefinitionError')
+
+    def test_validation(self):
+        self.check_error(lambda d: d['components']['NOZ'].update(inlet='4'),
+                         'Station 4 feeds both HPT and NOZ')
+        self.check_error(lambda d: d['shafts'].clear(), 'Turbine HPT is not on a shaft')
+        self.check_error(lambda d: d['components']['HPC'].update(type='Fan'),
+                         'Unknown component type')
+        self.check_error(lambda d: d['inputs'].update(X={'path': ['HPC', 'ER']}),
+                         'HPC has no attribute ER')
+        self.check_error(lambda d: d['components']['HPC'].update(exit='2'),
+                         'Station 2 is fed by both')
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        self.text = json.dumps(TURBOJET)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        builder._source_hash = None
+
+    def test_hit_gives_a_fresh_engine(self):
+        b = EngineBuilder(self.cache_dir)
+        first = b.loads(self.text)
+        second = b.loads(self.text)
+        self.assertEqual((b.cache_hits, b.cache_misses), (1, 1))
+        self.assertFalse(first is second)
+        self.assertEqual(second.calculate(INPUTS), TurboJet().calculate(INPUTS))
+
+    def test_entries_are_private(self):
+        EngineBuilder(self.cache_dir).loads(self.text)
+        self.assertEqual(os.stat(self.cache_dir).st_mode & 0777, 0700)
+        for name in os.listdir(self.cache_dir):
+            self.assertEqual(os.stat(os.path.join(self.cache_dir, name)).st_mode & 0777, 0600)
+
+    def test_code_changes_invalidate(self):
+        EngineBuilder(self.cache_dir).loads(self.text)
+        builder._source_hash = 'something else'
+        b = EngineBuilder(self.cache_dir)
+        b.loads(self.text)
+        self.assertEqual((b.cache_hits, b.cache_misses), (0, 1))
+
+    def test_shared_directory_not_used(self):
+        os.makedirs(self.cache_dir)
+        os.chmod(self.cache_dir, 0777)
+        b = EngineBuilder(self.cache_dir)
+        b.loads(self.text)
+        b.loads(self.text)
+        self.assertEqual((b.cache_hits, b.cache_misses), (0, 2))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_writable_entry_not_loaded(self):
+        b = EngineBuilder(self.cache_dir)
+        b.loads(self.text)
+        path = b.cache_path(self.text)
+        os.chmod(path, 0666)
+        b.loads(self.text)
+        self.assertEqual((b.cache_hits, b.cache_misses), (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import time
+import unittest
+
+import numpy as np
+
+import distributed
+from engines import TurboJet
+
+
+INPUTS = {'RIT': np.linspace(1400.0, 1800.0, 400), 'FLOW': 20.0, 'HPCPR': 15.0}
+
+
+def slow(engine, inputs):
+    time.sleep(1.5)
+    return distributed.evaluate_chunk(engine, inputs)
+
+
+def failing(engine, inputs):
+    raise ValueError('boom')
+
+
+def broken_factory():
+    raise RuntimeError('no engine')
+
+
+def take_a_chunk_and_die(address, authkey):
+    manager = distributed._WorkerManager(address=address, authkey=authkey)
+    manager.connect()
+    manager.get_tasks().get()
+    os._exit(1)
+
+
+class RunLocalTest(unittest.TestCase):
+    def test_matches_single_calculation(self):
+        results = distributed.run_local(TurboJet, INPUTS, workers=2, chunk_size=150)
+        expected = TurboJet().calculate(dict(INPUTS))
+        np.testing.assert_allclose(results['THRUST'], expected['THRUST'])
+        np.testing.assert_array_equal(results['RIT'], INPUTS['RIT'])
+
+    def test_slow_chunks_are_not_retried(self):
+        # each chunk takes three times the lease, but the heartbeats keep it
+        coordinator = distributed.Coordinator(address=('127.0.0.1', 0), lease_timeout=0.5,
+                                              max_retries=0, straggler_factor=100.0)
+        worker = multiprocessing.Process(target=distributed.run_worker,
+                                         args=(coordinator.address, coordinator.authkey,
+                                               TurboJet, slow))
+        worker.start()
+        try:
+            results = coordinator.run(INPUTS, chunk_size=200)
+        finally:
+            coordinator.shutdown(1)
+            worker.join()
+        self.assertEqual(len(results['THRUST']), 400)
+        self.assertEqual((coordinator.retries, coordinator.lost), (0, 0))
+
+    def test_failing_chunks_give_up(self):
+        self.assertRaises(distributed.SweepError, distributed.run_local, TurboJet, INPUTS,
+                          workers=1, chunk_size=200, evaluate=failing, max_retries=1)
+
+    def test_dead_workers(self):
+        start = time.time()
+        self.assertRaises(distributed.SweepError, distributed.run_local, broken_factory,
+                          INPUTS, workers=2, chunk_size=200)
+        self.assertTrue(time.time() - start < 30.0)
+
+    def test_lost_chunk_recovered(self):
+        # no stragglers, so the lost chunk has to wait for its lease
+        coordinator = distributed.Coordinator(address=('127.0.0.1', 0), lease_timeout=1.0,
+                                              straggler_factor=1e9)
+        # the thief is waiting for the first chunk before the worker starts
+        thief = multiprocessing.Process(target=take_a_chunk_and_die,
+                                        args=(coordinator.address, coordinator.authkey))
+        worker = multiprocessing.Process(target=distributed.run_worker,
+                                         args=(coordinator.address, coordinator.authkey,
+                                               TurboJet))
+        thief.start()
+        time.sleep(0.5)
+        worker.start()
+        try:
+            results = coordinator.run(INPUTS, chunk_size=200)
+        finally:
+            coordinator.shutdown(1)
+            worker.join()
+            thief.join()
+        expected = TurboJet().calculate(dict(INPUTS))
+        np.testing.assert_allclose(results['THRUST'], expected['THRUST'])
+        self.assertEqual((coordinator.retries, coordinator.lost), (0, 1))
+
+    def test_idle_timeout(self):
+        coordinator = distributed.Coordinator(address=('127.0.0.1', 0), idle_timeout=0.5)
+        try:
+            self.assertRaises(distributed.SweepError, coordinator.run, INPUTS, 200)
+        finally:
+            coordinator.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+import atmosphere
+from engines import TurboFan
+from envelope import evaluate_envelope
+
+
+class AtmosphereTest(unittest.TestCase):
+    def test_standard_values(self):
+        self.assertEqual(atmosphere.isa(0.0), (288.15, 101325.0))
+        t, p = atmosphere.isa(11000.0)
+        self.assertAlmostEqual(t, 216.65)
+        self.assertAlmostEqual(p, 22632.06, places=1)
+        self.assertAlmostEqual(atmosphere.pressure(20000.0), 5474.89, places=1)
+
+    def test_arrays_match_scalars(self):
+        altitudes = np.array([0.0, 5000.0, 15000.0, 40000.0])
+        t, p = atmosphere.isa(altitudes, 10.0)
+        for i, h in enumerate(altitudes):
+            self.assertEqual((t[i], p[i]), atmosphere.isa(h, 10.0))
+
+    def test_out_of_range(self):
+        self.assertRaises(ValueError, atmosphere.isa, 90000.0)
+
+
+class EnvelopeTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = TurboFan()
+        self.engine.set_inputs({'HPCPR': 15.0, 'BPR': 8.0, 'FLOW': 500.0, 'RIT': 1700.0})
+
+    def test_grid_matches_point_calculations(self):
+        deck = evaluate_envelope(self.engine, [0.0, 10000.0], [0.0, 0.6], [1500.0, 1800.0])
+        self.assertEqual(deck['THRUST'].shape, (2, 2, 2))
+        self.assertTrue(deck['FEASIBLE'].all())
+
+        engine = TurboFan()
+        engine.set_inputs({'HPCPR': 15.0, 'BPR': 8.0, 'FLOW': 500.0})
+        engine.environment.set_flight_condition(10000.0, 0.6)
+        thrust = engine.calculate({'RIT': 1800.0})['THRUST']
+        self.assertAlmostEqual(deck['THRUST'][1, 1, 1], thrust, places=6)
+
+    def test_infeasible_points_flagged(self):
+        # at low power the core nozzle ends up below ambient pressure
+        deck = evaluate_envelope(self.engine, [0.0], [0.0], [900.0, 1500.0])
+        self.assertFalse(deck['FEASIBLE'][0, 0, 0])
+        self.assertEqual(deck['VIOLATION'][0, 0, 0], 'HNOZ')
+        self.assertTrue(np.isnan(deck['THRUST'][0, 0, 0]))
+        self.assertTrue(deck['FEASIBLE'][0, 0, 1])
+
+    def test_engine_state_restored(self):
+        before = self.engine.calculate({})
+        evaluate_envelope(self.engine, [0.0, 5000.0], [0.0, 0.5], [1500.0, 1700.0],
+                          inputs={'FLOW': 400.0})
+        self.assertEqual(self.engine.get_input_alias('RIT'), 1700.0)
+        self.assertEqual(self.engine.get_input_alias('FLOW'), 500.0)
+        self.assertEqual(self.engine.environment.p, 30000.0)
+        self.assertEqual(self.engine.calculate({}), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+from gasprops import PerfectGas, SemiPerfectGas
+from engines import TurboFan
+from solver import Solver
+
+
+class SemiPerfectGasTest(unittest.TestCase):
+    def setUp(self):
+        self.gas = SemiPerfectGas()
+
+    def test_inverses_round_trip(self):
+        t = np.array([200.0, 700.0, 1500.0, 2000.0, 2150.0])
+        for far in (0.0, 0.03):
+            np.testing.assert_allclose(self.gas.t_from_h(self.gas.h(t, far), far), t)
+            np.testing.assert_allclose(self.gas.t_from_phi(self.gas.phi(t, far), far), t)
+
+    def test_scalar_in_scalar_out(self):
+        self.assertEqual(np.ndim(self.gas.t_from_h(self.gas.h(1000.0))), 0)
+
+    def test_outside_range_is_nan(self):
+        # cp turns over above about 2100K, so these used to find the
+        # wrong root (around 3000K)
+        self.assertTrue(np.isnan(self.gas.t_from_h(self.gas.h(2300.0, 0.03), 0.03)))
+        self.assertTrue(np.isnan(self.gas.combustion_far(700.0, 2500.0, 45e6)))
+        t = self.gas.t_from_h(self.gas.h(np.array([1500.0, 2400.0])))
+        self.assertAlmostEqual(t[0], 1500.0)
+        self.assertTrue(np.isnan(t[1]))
+
+    def test_combustion_round_trip(self):
+        dfar = self.gas.combustion_far(700.0, 1600.0, 45e6)
+        self.assertAlmostEqual(self.gas.combustion_t(700.0, dfar, 45e6), 1600.0)
+
+    def test_perfect_gas_matches_constant_cp(self):
+        gas = PerfectGas()
+        t1 = gas.t_from_phi(gas.phi(300.0) + gas.R()*np.log(10.0))
+        self.assertAlmostEqual(t1, 300.0 * 10.0**(0.4/1.4))
+        self.assertTrue(gas.in_range(5000.0))
+
+
+class GasRangeFeasibilityTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = TurboFan()
+        self.engine.set_inputs({'HPCPR': 15.0, 'BPR': 8.0, 'FLOW': 500.0})
+
+    def test_turbine_exit_below_inlet(self):
+        self.engine.calculate({'RIT': 2000.0})
+        st = self.engine.stations
+        self.assertTrue(st['5'].t < st['4'].t)
+        self.assertTrue(st['6'].t < st['5'].t)
+
+    def test_hot_point_infeasible(self):
+        outputs, status = self.engine.calculate_guarded({'RIT': 2484.0})
+        self.assertFalse(status)
+        self.assertEqual(status.reason, 'Temperature outside the range of the gas model')
+        self.assertTrue(np.isnan(outputs['THRUST']))
+
+    def test_hot_points_masked_in_batch(self):
+        outputs, status = self.engine.calculate_guarded({'RIT': np.array([1700.0, 2484.0])})
+        np.testing.assert_array_equal(status.feasible, [True, False])
+        self.assertTrue(np.isfinite(outputs['THRUST'][0]))
+        self.assertTrue(np.isnan(outputs['THRUST'][1]))
+
+    def test_unguarded_hot_point_is_nan(self):
+        outputs = self.engine.calculate({'RIT': 2484.0})
+        self.assertTrue(np.isnan(outputs['THRUST']))
+
+    def test_solver_steps_back_into_range(self):
+        # the first Newton step from 1200K overshoots past tmax
+        solver = Solver(self.engine, {'RIT': {'perturbation': 1.0, 'sval': 1200.0}})
+        values = solver.solve({'THRUST': 1.85e5})
+        self.assertTrue(1600.0 < values['RIT'] < 2200.0)
+        self.assertAlmostEqual(self.engine.calculate(values)['THRUST'], 1.85e5, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
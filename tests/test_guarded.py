@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+
+from engines import TurboFan
+
+
+class CalculateGuardedTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = TurboFan()
+        self.engine.set_inputs({'HPCPR': 15.0, 'BPR': 8.0, 'FLOW': 500.0, 'RIT': 1700.0})
+
+    def test_feasible_point(self):
+        outputs, status = self.engine.calculate_guarded({})
+        self.assertTrue(status)
+        self.assertEqual(outputs, self.engine.calculate({}))
+
+    def test_infeasible_point(self):
+        outputs, status = self.engine.calculate_guarded({'FLOW': -1.0})
+        self.assertFalse(status)
+        self.assertEqual(status.component, 'INTAKE')
+        self.assertTrue(np.isnan(outputs['SFC']))
+
+    def test_partly_infeasible_batch(self):
+        outputs, status = self.engine.calculate_guarded({'HPCPR': np.array([15.0, 0.5, 20.0])})
+        np.testing.assert_array_equal(status.feasible, [True, False, True])
+        self.assertEqual(status.component[1], 'HPC')
+        self.assertTrue(np.isnan(outputs['THRUST'][1]))
+        self.assertAlmostEqual(outputs['THRUST'][0], self.engine.calculate({'HPCPR': 15.0})['THRUST'])
+
+    def test_all_infeasible_batch_on_fresh_engine(self):
+        # nothing has been calculated yet, so there are no outputs to mask
+        outputs, status = TurboFan().calculate_guarded({'FLOW': np.array([-1.0, -2.0])})
+        self.assertFalse(np.any(status.feasible))
+        for name in ('THRUST', 'SFC'):
+            self.assertEqual(outputs[name].shape, (2,))
+            self.assertTrue(np.isnan(outputs[name]).all())
+
+    def test_all_infeasible_batch_after_other_batch(self):
+        self.engine.calculate_guarded({'FLOW': np.array([400.0, 500.0])})
+        outputs, status = self.engine.calculate_guarded({'FLOW': np.array([-1.0, -2.0, -3.0])})
+        self.assertEqual(outputs['THRUST'].shape, (3,))
+        self.assertTrue(np.isnan(outputs['THRUST']).all())
+
+    def test_all_infeasible_batch_same_shape(self):
+        # the previous outputs must not leak through
+        self.engine.calculate_guarded({'FLOW': np.array([400.0, 500.0])})
+        outputs, status = self.engine.calculate_guarded({'FLOW': np.array([-1.0, -2.0])})
+        self.assertTrue(np.isnan(outputs['THRUST']).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
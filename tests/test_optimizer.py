@@ -0,0 +1,88 @@
+import unittest
+
+from engines import TurboFan, TurboJet
+from optimizer import Optimizer
+
+
+class Bowl(object):
+    def calculate(self, inputs):
+        x, y = inputs['x'], inputs['y']
+        return {'f': (x - 1)**2 + (y - 2)**2, 'g': x + y}
+
+
+class Rosenbrock(object):
+    def calculate(self, inputs):
+        x, y = inputs['x'], inputs['y']
+        return {'f': 100*(y - x*x)**2 + (1 - x)**2, 'h': x + y}
+
+
+def settings(perturbation, x, y, low=-2.0, high=2.0, y_high=2.0):
+    return {'x': {'perturbation': perturbation, 'sval': x, 'min': low, 'max': high},
+            'y': {'perturbation': perturbation, 'sval': y, 'min': low, 'max': y_high}}
+
+
+class OptimizerTest(unittest.TestCase):
+    def test_active_bound_and_constraint(self):
+        # the unconstrained minimum (1, 2) is past y's limit and x+y >= 4
+        # pushes x out to 2.5
+        optimizer = Optimizer(Bowl(), settings(1e-6, 0.0, 0.0, -5.0, 5.0, 1.5), 'f',
+                              [('g', '>=', 4.0)])
+        result = optimizer.optimize()
+        self.assertTrue(result.converged)
+        self.assertAlmostEqual(result.inputs['x'], 2.5, places=5)
+        self.assertAlmostEqual(result.inputs['y'], 1.5)
+        self.assertTrue(result.iterations <= 5)
+
+    def test_rosenbrock(self):
+        result = Optimizer(Rosenbrock(), settings(1e-7, -1.2, 1.0), 'f').optimize()
+        self.assertTrue(result.converged)
+        self.assertAlmostEqual(result.inputs['x'], 1.0, places=3)
+        self.assertAlmostEqual(result.inputs['y'], 1.0, places=3)
+        # a gradient method takes thousands
+        self.assertTrue(result.iterations < 100)
+
+    def test_equality(self):
+        result = Optimizer(Rosenbrock(), settings(1e-7, -1.2, 1.0), 'f',
+                           [('h', '==', 1.5)]).optimize()
+        self.assertTrue(result.converged)
+        self.assertAlmostEqual(result.outputs['h'], 1.5, places=6)
+        self.assertAlmostEqual(result.objective, 0.0313283, places=6)
+
+    def test_maximise(self):
+        result = Optimizer(Bowl(), settings(1e-6, 0.0, 0.0), 'f', maximise=True).optimize()
+        self.assertEqual(result.inputs, {'x': -2.0, 'y': -2.0})
+
+    def test_evaluations_cached(self):
+        result = Optimizer(Bowl(), settings(1e-6, 0.0, 0.0, -5.0, 5.0, 1.5), 'f',
+                           [('g', '>=', 4.0)]).optimize()
+        self.assertTrue(result.cache_hits > 0)
+
+    def test_bad_settings(self):
+        self.assertRaises(ValueError, Optimizer, Bowl(), settings(1e-6, 0.0, 0.0), 'f',
+                          [('g', '>', 4.0)])
+        unbounded = {'x': {'perturbation': 1e-6, 'sval': 0.0}}
+        self.assertRaises(ValueError, Optimizer, Bowl(), unbounded, 'f')
+
+    def test_turbojet(self):
+        optimizer = Optimizer(TurboJet(), {'HPCPR': {'perturbation': 0.01, 'sval': 15.0},
+                                           'RIT': {'perturbation': 0.1, 'sval': 1500.0}},
+                              'SFC', [('THRUST', '>=', 15000.0)])
+        result = optimizer.optimize(fixed={'FLOW': 20.0})
+        self.assertTrue(result.converged)
+        # the alias limits
+        self.assertEqual(result.inputs['HPCPR'], 25.0)
+        self.assertAlmostEqual(result.inputs['RIT'], 1400.0)
+        self.assertTrue(result.outputs['THRUST'] >= 15000.0)
+
+    def test_turbofan_constraint_active(self):
+        optimizer = Optimizer(TurboFan(), {'HPCPR': {'perturbation': 0.01, 'sval': 15.0},
+                                           'RIT': {'perturbation': 0.1, 'sval': 1700.0},
+                                           'BPR': {'perturbation': 0.01, 'sval': 8.0}},
+                              'SFC', [('THRUST', '>=', 120000.0)])
+        result = optimizer.optimize(fixed={'FLOW': 400.0})
+        self.assertTrue(result.converged)
+        self.assertAlmostEqual(result.outputs['THRUST'] / 120000.0, 1.0, places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
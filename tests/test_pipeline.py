@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+import pipeline
+from engines import TurboFan
+from xcrates import get_test_xrates
+
+
+def chunked(columns, size):
+    n = len(columns.values()[0])
+    for start in range(0, n, size):
+        yield dict([(name, np.asarray(v[start:start+size], dtype=float))
+                    for name, v in columns.items()])
+
+
+class CsvTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_round_trip_in_chunks(self):
+        source = os.path.join(self.tmp, 'in.csv')
+        with open(source, 'w') as f:
+            f.write('A, B\n')
+            for i in range(25):
+                f.write('%i,%g\n' % (i, 0.5*i))
+        chunks = list(pipeline.read_csv(source, chunk_size=10))
+        self.assertEqual([len(c['A']) for c in chunks], [10, 10, 5])
+
+        destination = os.path.join(self.tmp, 'out.csv')
+        self.assertEqual(pipeline.write_csv(iter(chunks), destination), 25)
+        again = list(pipeline.read_csv(destination, chunk_size=100))[0]
+        np.testing.assert_array_equal(again['B'], 0.5*np.arange(25))
+
+    def test_binary_records(self):
+        dtype = np.dtype([('N1', '<f4'), ('EGT', '<f4')])
+        records = np.zeros(7, dtype)
+        records['N1'] = np.arange(7)
+        path = os.path.join(self.tmp, 'in.bin')
+        with open(path, 'wb') as f:
+            f.write('HEAD')
+            f.write(records.tobytes())
+        chunks = list(pipeline.read_binary(path, dtype, chunk_size=3, offset=4))
+        self.assertEqual([len(c['N1']) for c in chunks], [3, 3, 1])
+        self.assertEqual(chunks[2]['N1'][0], 6.0)
+
+
+class PrefetchTest(unittest.TestCase):
+    def test_passes_everything_through(self):
+        self.assertEqual(list(pipeline.prefetch(iter(range(10)), depth=2)), range(10))
+
+    def test_producer_errors_reraised(self):
+        def broken():
+            yield 1
+            raise IOError('disk gone')
+        chunks = pipeline.prefetch(broken())
+        self.assertEqual(chunks.next(), 1)
+        self.assertRaises(IOError, chunks.next)
+
+    def test_consumer_stopping_early(self):
+        # the reader would otherwise be stuck putting the end marker
+        before = threading.active_count()
+        chunks = pipeline.prefetch(iter(range(3)), depth=2)
+        chunks.next()
+        chunks.close()
+        self.assertEqual(threading.active_count(), before)
+
+
+class EvaluateDeltasTest(unittest.TestCase):
+    def test_xrates(self):
+        xrates = get_test_xrates()
+        data = {'A': [1.0, 2.0], 'X': [100.0, 100.0]}
+        out = list(pipeline.evaluate_deltas(chunked(data, 10), xrates,
+                                            inputs={'a': 'A'}, outputs={'x': 'X'}))[0]
+        np.testing.assert_allclose(out['x_MODEL'], [100.0, 101.0])
+        np.testing.assert_allclose(out['x_DELTA'], [0.0, 1.0])
+
+    def test_engine_with_infeasible_chunk(self):
+        engine = TurboFan()
+        engine.set_inputs({'HPCPR': 15.0, 'BPR': 8.0, 'FLOW': 500.0, 'RIT': 1700.0})
+        # the second chunk is all below the compressor exit temperature
+        data = {'RIT': [1600.0, 1700.0, 500.0, 600.0, 1800.0], 'THRUST': [1e5]*5}
+        out = list(pipeline.evaluate_deltas(chunked(data, 2), engine,
+                                            inputs={'RIT': 'RIT'},
+                                            outputs={'THRUST': 'THRUST'}))
+        self.assertEqual(len(out), 3)
+        self.assertFalse(out[1]['FEASIBLE'].any())
+        self.assertTrue(np.isnan(out[1]['THRUST_DELTA']).all())
+        self.assertTrue(out[2]['FEASIBLE'].all())
+        self.assertAlmostEqual(out[0]['THRUST_MODEL'][1], engine.calculate({})['THRUST'])
+
+    def test_engine_inputs_restored(self):
+        engine = TurboFan()
+        engine.set_inputs({'HPCPR': 15.0, 'BPR': 8.0, 'FLOW': 500.0, 'RIT': 1700.0})
+        data = {'RIT': [1600.0, 1650.0, 1750.0], 'THRUST': [1e5]*3}
+        deltas = pipeline.evaluate_deltas(chunked(data, 2), engine, inputs={'RIT': 'RIT'},
+                                          outputs={'THRUST': 'THRUST'}, fixed={'FLOW': 400.0})
+        deltas.next()
+        deltas.close()
+        self.assertEqual(engine.get_input_alias('RIT'), 1700.0)
+        self.assertEqual(engine.get_input_alias('FLOW'), 500.0)
+        self.assertEqual(np.ndim(engine.calculate({})['THRUST']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import threading
+import unittest
+
+from engines import TurboJet
+from pool import EnginePool, PoolTimeout
+
+INPUTS = {'RIT': 1500.0, 'FLOW': 20.0, 'HPCPR': 15.0}
+
+
+class EnginePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = EnginePool(TurboJet, 2)
+
+    def test_reset_on_return(self):
+        with self.pool.checkout() as engine:
+            built = engine.get_inputs()
+            expected = engine.calculate({})
+            engine.set_inputs({'RIT': 1800.0})
+            engine.environment.p = 20000.0
+            engine.environment.make_dirty()
+        with self.pool.checkout() as first:
+            with self.pool.checkout() as second:
+                for checked_out in (first, second):
+                    self.assertEqual(checked_out.get_inputs(), built)
+                    self.assertEqual(checked_out.calculate({}), expected)
+
+    def test_returned_after_an_error(self):
+        def fail():
+            with self.pool.checkout():
+                raise ValueError('x')
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.pool.free.qsize(), 2)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_timeout(self):
+        with self.pool.checkout():
+            with self.pool.checkout():
+                def wait():
+                    with self.pool.checkout(timeout=0.01):
+                        pass
+                self.assertRaises(PoolTimeout, wait)
+
+    def test_threads(self):
+        expected = TurboJet().calculate(dict(INPUTS))
+        wrong = []
+        held = set()
+        clash = []
+        lock = threading.Lock()
+
+        def work():
+            for _ in range(20):
+                with self.pool.checkout() as engine:
+                    with lock:
+                        if id(engine) in held:
+                            clash.append(engine)
+                        held.add(id(engine))
+                    results = engine.calculate(dict(INPUTS))
+                    if results != expected:
+                        wrong.append(results)
+                    engine.set_inputs({'RIT': 1800.0})
+                    with lock:
+                        held.discard(id(engine))
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((wrong, clash), ([], []))
+        stats = self.pool.stats()
+        self.assertEqual(stats['checkouts'], 120)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertTrue(0.0 < stats['utilisation'] <= 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,402 @@
+from StringIO import StringIO
+import sys
+import unittest
+
+import numpy as np
+
+from atlas import XRatesAtlas
+from engines import TurboFan, TurboJet
+from solver import (ConvergenceTrace, DecomposedSolver, JacobianCache, NewtonKrylovSolver,
+                    Solver, TestFunction, _lu_factor, _lu_solve, gmres, lu_solve, print_iteration)
+
+
+class Function(TestFunction):
+    """solver.TestFunction, with the input_aliases that Solver looks for."""
+    input_aliases = {}
+
+
+class Cubic(object):
+    """
+    A stand-in engine, z = k*(x + x**3), with k a direct input: k=0
+    makes the jacobian singular and k<-1 gives NaN.
+    """
+    def __init__(self):
+        self.input_aliases = {'X': None, 'K': None}
+        self.inputs = {'X': 1.0, 'K': 1.0}
+
+    def get_input_alias(self, name):
+        return self.inputs[name]
+
+    def set_input_alias(self, name, value):
+        self.inputs[name] = value
+
+    def set_inputs(self, inputs):
+        self.inputs.update(inputs)
+
+    def calculate(self, inputs):
+        self.set_inputs(inputs)
+        x, k = self.inputs['X'], self.inputs['K']
+        with np.errstate(invalid='ignore'):
+            z = k*(x + x**3) + np.where(k < -1, np.sqrt(k), 0.0)
+        return {'Z': z}
+
+
+class SolveBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = TurboJet()
+        self.engine.set_inputs({'HPCPR': 15.0, 'FLOW': 20.0, 'RIT': 1500.0})
+        self.solver = Solver(self.engine, {'RIT': {'perturbation': 1.0, 'sval': 1500.0}})
+
+    def test_matches_scalar_solves(self):
+        thrusts = np.array([8000.0, 10000.0, 12000.0])
+        values = self.solver.solve_batch({'THRUST': thrusts})
+        self.assertTrue(self.solver.batch_converged.all())
+        for thrust, rit in zip(thrusts, values['RIT']):
+            self.assertAlmostEqual(self.solver.solve({'THRUST': thrust})['RIT'], rit, places=4)
+
+    def test_direct_inputs_broadcast(self):
+        values = self.solver.solve_batch({'THRUST': 10000.0, 'FLOW': np.array([20.0, 25.0])})
+        self.assertEqual(values['RIT'].shape, (2,))
+        self.assertTrue(values['RIT'][1] < values['RIT'][0])
+
+    def test_unreachable_point_masked(self):
+        # a million newtons needs a turbine temperature past the gas model
+        values = self.solver.solve_batch({'THRUST': np.array([8000.0, 1e6, 12000.0])})
+        np.testing.assert_array_equal(self.solver.batch_converged, [True, False, True])
+        self.assertTrue(np.isnan(values['RIT'][1]))
+        self.assertTrue(np.isfinite(values['RIT'][[0, 2]]).all())
+
+    def test_engine_inputs_restored(self):
+        self.solver.solve_batch({'THRUST': np.array([8000.0, 12000.0]),
+                                 'FLOW': np.array([20.0, 22.0])})
+        self.assertEqual(self.engine.get_input_alias('RIT'), 1500.0)
+        self.assertEqual(self.engine.get_input_alias('FLOW'), 20.0)
+        self.assertEqual(np.ndim(self.engine.calculate({})['THRUST']), 0)
+
+    def test_singular_point_masked(self):
+        # z doesn't depend on x at all where k is 0
+        solver = Solver(Cubic(), {'X': {'perturbation': 1e-6, 'sval': 1.0}})
+        values = solver.solve_batch({'Z': np.array([2.0, 2.0, 30.0]),
+                                     'K': np.array([1.0, 0.0, 1.0])})
+        np.testing.assert_array_equal(solver.batch_converged, [True, False, True])
+        np.testing.assert_allclose(values['X'][[0, 2]], [1.0, 3.0])
+        self.assertTrue(np.isnan(values['X'][1]))
+
+    def test_nan_point_masked(self):
+        solver = Solver(Cubic(), {'X': {'perturbation': 1e-6, 'sval': 1.0}})
+        values = solver.solve_batch({'Z': 2.0, 'K': np.array([1.0, -4.0, 2.0])})
+        np.testing.assert_array_equal(solver.batch_converged, [True, False, True])
+        np.testing.assert_allclose(values['X'][[0, 2]], [1.0, 0.6823278])
+
+
+class Coupled(object):
+    """A stand-in engine with twenty mildly nonlinear, coupled targets."""
+    n = 20
+
+    def __init__(self, diagonal=1.5):
+        rng = np.random.RandomState(1)
+        self.A = diagonal*np.eye(self.n) + 0.3*rng.randn(self.n, self.n)
+        self.input_aliases = {}
+
+    def calculate(self, inputs):
+        x = np.array([inputs['x%02i' % i] for i in range(self.n)])
+        z = np.dot(self.A, x) + 0.1*x**3 + np.sin(x)
+        return dict([('z%02i' % i, z[i]) for i in range(self.n)])
+
+    def settings(self):
+        return dict([('x%02i' % i, {'perturbation': 1e-4, 'sval': 0.0}) for i in range(self.n)])
+
+    def targets(self):
+        return dict([('z%02i' % i, 1.0 + 0.1*i) for i in range(self.n)])
+
+
+class GmresTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.A = rng.randn(30, 30) + 8*np.eye(30)
+        self.b = rng.randn(30)
+
+    def test_solves_with_enough_iterations(self):
+        x, iterations, residual = gmres(lambda v: np.dot(self.A, v), self.b, tol=1e-10,
+                                        restart=10, maxiter=200)
+        self.assertTrue(residual <= 1e-10)
+        np.testing.assert_allclose(np.dot(self.A, x), self.b, atol=1e-8)
+
+    def test_preconditioner_cuts_iterations(self):
+        plain = gmres(lambda v: np.dot(self.A, v), self.b, tol=1e-10, maxiter=200)[1]
+        inverse = np.linalg.inv(self.A)
+        preconditioned = gmres(lambda v: np.dot(self.A, v), self.b, tol=1e-10, maxiter=200,
+                               preconditioner=lambda v: np.dot(inverse, v))[1]
+        self.assertTrue(preconditioned < plain)
+        self.assertTrue(preconditioned <= 2)
+
+    def test_default_budget_is_small(self):
+        matvecs = []
+        def matvec(v):
+            matvecs.append(v)
+            return np.dot(self.A, v)
+        x, iterations, residual = gmres(matvec, self.b, tol=1e-14)
+        self.assertEqual(iterations, 10)
+        self.assertEqual(len(matvecs), 10)
+
+
+class NewtonKrylovSolverTest(unittest.TestCase):
+    def test_matches_newton(self):
+        settings = {'x': {'perturbation': 0.01, 'sval': 2.0},
+                    'y': {'perturbation': 0.01, 'sval': 3.0}}
+        targets = {'z': 10.0, 'zz': 20.0}
+        expected = Solver(Function(), settings).solve(targets)
+        values = NewtonKrylovSolver(Function(), settings).solve(targets)
+        for name in expected:
+            self.assertAlmostEqual(values[name], expected[name], places=6)
+
+    def test_fewer_calls_than_newton_on_many_variables(self):
+        model = Coupled()
+        newton = Solver(model, model.settings())
+        newton.solve(model.targets())
+        krylov = NewtonKrylovSolver(model, model.settings())
+        values = krylov.solve(model.targets())
+        self.assertTrue(krylov.calls < 0.6*newton.calls)
+        results = model.calculate(values)
+        for name, target in model.targets().items():
+            self.assertAlmostEqual(results[name], target, places=6)
+
+    def test_residual_never_goes_up(self):
+        model = Coupled(diagonal=1.0)
+        krylov = NewtonKrylovSolver(model, model.settings())
+        krylov.solve(model.targets())
+        residuals = krylov.trace.as_dict()['residual_norm']
+        self.assertTrue(np.all(np.diff(residuals) < 0))
+
+    def test_engine(self):
+        engine = TurboJet()
+        engine.set_inputs({'HPCPR': 25.0})
+        settings = {'RIT': {'perturbation': 0.1, 'sval': 1500.0},
+                    'FLOW': {'perturbation': 0.001, 'sval': 1.0}}
+        targets = {'THRUST': 1300.0, 'SFC': 2.2e-5}
+        expected = Solver(engine, settings).solve(dict(targets))
+        values = NewtonKrylovSolver(engine, settings).solve(dict(targets))
+        self.assertAlmostEqual(values['RIT'], expected['RIT'], places=4)
+        self.assertAlmostEqual(values['FLOW'], expected['FLOW'], places=6)
+
+
+class LuTest(unittest.TestCase):
+    def test_matches_numpy(self):
+        rng = np.random.RandomState(2)
+        for n in (1, 2, 5, 12):
+            a = rng.randn(n, n)
+            b = rng.randn(n)
+            np.testing.assert_allclose(_lu_solve(_lu_factor(a), b), np.linalg.solve(a, b))
+
+    def test_needs_pivoting(self):
+        a = np.array([[0.0, 1.0], [2.0, 3.0]])
+        np.testing.assert_allclose(_lu_solve(_lu_factor(a), [1.0, 8.0]), [2.5, 1.0])
+
+    def test_singular(self):
+        self.assertRaises(np.linalg.LinAlgError, _lu_factor, [[1.0, 2.0], [2.0, 4.0]])
+
+
+class JacobianCacheTest(unittest.TestCase):
+    settings = {'RIT': {'perturbation': 0.1, 'sval': 1500.0},
+                'FLOW': {'perturbation': 0.001, 'sval': 1.0}}
+
+    def sweep(self, cache, warm):
+        solver = Solver(TurboJet(), dict(self.settings), jacobian_cache=cache)
+        answers, calls = [], 0
+        for thrust in np.linspace(1300.0, 1330.0, 8):
+            values = solver.solve({'THRUST': thrust, 'SFC': 2.2e-5, 'HPCPR': 25.0})
+            if warm:
+                solver.input_settings = dict([(x, dict(self.settings[x], sval=values[x]))
+                                              for x in values])
+            answers.append(values)
+            calls += solver.calls
+        return answers, calls
+
+    def test_same_answers_fewer_calls(self):
+        for warm in (False, True):
+            expected, plain = self.sweep(None, warm)
+            answers, cached = self.sweep(JacobianCache(), warm)
+            for a, b in zip(answers, expected):
+                self.assertAlmostEqual(a['RIT'], b['RIT'], places=4)
+                self.assertAlmostEqual(a['FLOW'], b['FLOW'], places=7)
+            self.assertTrue(cached < 0.7*plain, (warm, cached, plain))
+
+    def test_lookup_only_nearby(self):
+        cache = JacobianCache(max_step=0.05)
+        J = np.array([[2.0, 0.0], [0.0, 3.0]])
+        cache.put(['x', 'y'], ['a', 'b'], {'x': 1.0, 'y': 10.0}, {'d': 5.0}, J)
+        entry = cache.get(['y', 'x'], ['b', 'a'], {'x': 1.04, 'y': 10.0}, {'d': 5.0})
+        np.testing.assert_array_equal(entry[0], J)
+        np.testing.assert_allclose(lu_solve(entry[1], [1.0, 1.0]), [0.5, 1.0/3])
+        self.assertTrue(cache.get(['x', 'y'], ['a', 'b'], {'x': 1.1, 'y': 10.0}, {'d': 5.0})
+                        is None)
+        self.assertTrue(cache.get(['x', 'y'], ['a', 'b'], {'x': 1.0, 'y': 10.0}, {'d': 5.5})
+                        is None)
+        self.assertTrue(cache.get(['x', 'y'], ['a', 'c'], {'x': 1.0, 'y': 10.0}, {'d': 5.0})
+                        is None)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_replaces_nearby_and_drops_oldest(self):
+        cache = JacobianCache(max_entries=2)
+        J = np.eye(1)
+        cache.put(['x'], ['a'], {'x': 1.0}, {}, J)
+        cache.put(['x'], ['a'], {'x': 1.01}, {}, 2*J)
+        self.assertEqual(len(cache.entries), 1)
+        cache.put(['x'], ['a'], {'x': 2.0}, {}, 3*J)
+        cache.put(['x'], ['a'], {'x': 3.0}, {}, 4*J)
+        self.assertEqual(len(cache.entries), 2)
+        self.assertTrue(cache.get(['x'], ['a'], {'x': 1.0}, {}) is None)
+
+
+
+class DecomposedSolverTest(unittest.TestCase):
+    settings = {'FLOW': {'perturbation': 0.1, 'sval': 400.0},
+                'BPR': {'perturbation': 0.01, 'sval': 8.0}}
+    targets = {'THRUST': 120000.0, 'SFC': 7e-6}
+    conv_crit = {'THRUST': 1e-6, 'SFC': 1e-14}
+
+    def solve(self, cls, **kwargs):
+        engine = TurboFan()
+        solver = cls(engine, dict(self.settings), conv_crit=self.conv_crit, **kwargs)
+        values = solver.solve(dict(self.targets))
+        return solver, values, engine.calculate(values)
+
+    def test_blocks_agree_with_solver(self):
+        decomposed, values, results = self.solve(DecomposedSolver)
+        self.assertEqual(decomposed.blocks, [(['BPR'], ['SFC']), (['FLOW'], ['THRUST'])])
+        self.assertTrue(decomposed.trace.converged)
+        plain, expected, _ = self.solve(Solver)
+        for x in expected:
+            self.assertAlmostEqual(values[x], expected[x], places=6)
+        self.assertTrue(decomposed.calls < plain.calls)
+
+    def test_blocks_use_the_callers_criterion(self):
+        # SFC is far smaller than the default 1e-6, so with that it's
+        # as good as met from the start
+        engine = TurboFan()
+        solver = DecomposedSolver(engine, dict(self.settings))
+        values = solver.solve(dict(self.targets))
+        self.assertEqual(values['BPR'], 8.0)
+        self.assertTrue(solver.isconverged({'SFC': 7e-6 - engine.calculate(values)['SFC']}))
+        _, values, results = self.solve(DecomposedSolver)
+        self.assertTrue(abs(results['SFC'] - 7e-6) < 1e-14)
+        self.assertTrue(abs(results['THRUST'] - 120000.0) < 1e-6)
+
+    def test_falls_back_when_a_block_fails(self):
+        engine = TurboFan()
+        solver = DecomposedSolver(engine, dict(self.settings), conv_crit=self.conv_crit)
+        solver.solve_block = lambda *args: False
+        values = solver.solve(dict(self.targets))
+        self.assertTrue(solver.trace.converged)
+        results = engine.calculate(values)
+        self.assertTrue(abs(results['SFC'] - 7e-6) < 1e-14)
+
+
+
+class PredictorTest(unittest.TestCase):
+    settings = {'RIT': {'perturbation': 0.1, 'sval': 1500.0},
+                'FLOW': {'perturbation': 0.001, 'sval': 1.0}}
+
+    def setUp(self):
+        self.engine = TurboJet()
+        atlas = XRatesAtlas.from_engine(self.engine, {'RIT': [1500.0], 'HPCPR': [30.0],
+                                                      'FLOW': [1.0]},
+                                        {'RIT': 1.0, 'HPCPR': 0.01, 'FLOW': 0.001},
+                                        ['THRUST', 'SFC'])
+        self.predictor = atlas.table(0)
+
+    def test_fewer_calls(self):
+        targets = {'THRUST': 1300.0, 'SFC': 2.2e-5, 'HPCPR': 25.0}
+        plain = Solver(self.engine, dict(self.settings))
+        expected = plain.solve(dict(targets))
+        predicted = Solver(self.engine, dict(self.settings), predictor=self.predictor)
+        values = predicted.solve(dict(targets))
+        for x in expected:
+            self.assertAlmostEqual(values[x], expected[x], places=6)
+        self.assertTrue(predicted.calls < plain.calls)
+
+    def test_targets_the_predictor_lacks(self):
+        self.engine.add_output_alias('FF', ('ENGINE', 'FUEL_FLOW'))
+        solver = Solver(self.engine, dict(self.settings), predictor=self.predictor)
+        start, gradients = solver.start_values({'THRUST': 1300.0, 'FF': 0.03})
+        self.assertTrue(gradients is None)
+        self.assertNotEqual(start, {'RIT': 1500.0, 'FLOW': 1.0})
+        values = solver.solve({'THRUST': 1300.0, 'FF': 0.03, 'HPCPR': 25.0})
+        results = self.engine.calculate(values)
+        self.assertAlmostEqual(results['THRUST'], 1300.0, places=5)
+
+    def test_no_targets_covered(self):
+        self.engine.add_output_alias('FF', ('ENGINE', 'FUEL_FLOW'))
+        self.engine.add_output_alias('PRX', ('HPC', 'PR'))
+        solver = Solver(self.engine, dict(self.settings), predictor=self.predictor)
+        self.assertEqual(solver.start_values({'FF': 0.03, 'PRX': 25.0}),
+                         ({'RIT': 1500.0, 'FLOW': 1.0}, None))
+
+    def test_variables_the_predictor_lacks(self):
+        settings = dict(self.settings, BPR={'perturbation': 0.01, 'sval': 8.0})
+        solver = Solver(self.engine, settings, predictor=self.predictor)
+        start, gradients = solver.start_values({'THRUST': 1300.0, 'SFC': 2.2e-5, 'X': 1.0})
+        self.assertEqual(start['BPR'], 8.0)
+        self.assertTrue(gradients is None)
+
+
+
+class ConvergenceTraceTest(unittest.TestCase):
+    settings = {'RIT': {'perturbation': 0.1, 'sval': 1500.0},
+                'FLOW': {'perturbation': 0.001, 'sval': 1.0}}
+    targets = {'THRUST': 1300.0, 'SFC': 2.2e-5, 'HPCPR': 25.0}
+
+    def test_grows_past_capacity(self):
+        seen = []
+        trace = ConvergenceTrace(capacity=2, callbacks=[lambda t: seen.append(t.count)])
+        for i in range(5):
+            trace.record(10.0**-i, engine_calls=i)
+        self.assertEqual(trace.iterations, 5)
+        self.assertEqual(seen, [1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(trace.as_dict()['engine_calls'], range(5))
+        self.assertTrue(np.isnan(trace.as_dict()['step_norm']).all())
+
+    def test_solve_is_quiet_and_traced(self):
+        solver = Solver(TurboJet(), dict(self.settings))
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            solver.solve(dict(self.targets))
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(printed, '')
+        trace = solver.trace
+        self.assertTrue(trace.converged)
+        record = trace.as_dict()
+        self.assertEqual(record['engine_calls'][-1], solver.calls)
+        self.assertTrue(record['residual_norm'][-1] < 1e-6)
+        self.assertTrue(np.all(np.diff(record['engine_calls']) > 0))
+        self.assertTrue(np.isfinite(record['condition'][:-1]).all())
+        self.assertEqual(sorted(trace.errors), ['SFC', 'THRUST'])
+
+    def test_print_iteration(self):
+        solver = Solver(TurboJet(), dict(self.settings))
+        solver.trace = ConvergenceTrace(callbacks=[print_iteration])
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            solver.solve(dict(self.targets))
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(printed.count('Iteration #'), solver.trace.iterations)
+
+    def test_failure_recorded(self):
+        solver = Solver(Cubic(), {'X': {'perturbation': 1e-6, 'sval': 1.0}})
+        self.assertRaises(Exception, solver.solve, {'Z': 2.0, 'K': -4.0})
+        self.assertEqual(solver.trace.converged, False)
+        self.assertEqual(solver.trace.message, 'Engine results are not finite')
+
+    def test_batch_traced(self):
+        solver = Solver(TurboJet(), dict(self.settings))
+        solver.solve_batch({'THRUST': np.array([1300.0, 1100.0]), 'SFC': 2.2e-5, 'HPCPR': 25.0})
+        self.assertTrue(solver.trace.converged)
+        self.assertEqual(solver.trace.iterations, solver.batch_iterations.max() + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+
+import numpy as np
+
+from builder import EngineBuilder
+from engines import TurboJet
+from tearing import ACCELERATORS, find_cycles
+
+
+class Node(object):
+    def __init__(self, name):
+        self.name = name
+        self.dependents = []
+
+
+def recirculating(bleed, after_turbine=False):
+    """A TurboJet with part of the flow fed back to the compressor inlet."""
+    components = {
+        'INTAKE': {'type': 'Intake', 'attributes': {'W': 20.0}, 'exit': '2'},
+        'MIX': {'type': 'Mixer', 'inlet': '2', 'return': 'R', 'exit': '2a'},
+        'HPC': {'type': 'Compressor', 'attributes': {'PR': 15.0}, 'inlet': '2a', 'exit': '3'},
+        'BLEED': {'type': 'Splitter', 'attributes': {'BPR': bleed}, 'inlet': '3',
+                  'core': '3a', 'bypass': 'R'},
+        'COMBUSTOR': {'type': 'Combustor', 'attributes': {'TEX': 1500.0, 'FHV': 45.0e6},
+                      'inlet': '3a', 'exit': '4'},
+        'HPT': {'type': 'Turbine', 'inlet': '4', 'exit': '5'},
+        'NOZ': {'type': 'Nozzle', 'inlet': '5'}}
+    stations = ['2', '2a', '3', '3a', '4', '5', 'R']
+    if after_turbine:
+        components['COMBUSTOR']['inlet'] = '3'
+        components['BLEED'].update(inlet='5', core='5a')
+        components['NOZ']['inlet'] = '5a'
+        stations = ['2', '2a', '3', '4', '5', '5a', 'R']
+    return EngineBuilder().build({
+        'components': components, 'stations': stations,
+        'shafts': {'HPSHAFT': {'name': 'hp_shaft', 'turbine': 'HPT', 'driven': ['HPC']}},
+        'inputs': {'BLEED': {'path': ['BLEED', 'BPR']}, 'RIT': {'path': ['COMBUSTOR', 'TEX']},
+                   'FLOW': {'path': ['INTAKE', 'W']}},
+        'outputs': {'THRUST': ['ENGINE', 'THRUST'], 'SFC': ['ENGINE', 'SFC']},
+        'environment': {'p': 30000.0, 't': 300.0, 'w': 1.0}})
+
+
+class FindCyclesTest(unittest.TestCase):
+    def test_cycles(self):
+        a, b, c, d, e = [Node(n) for n in 'abcde']
+        a.dependents = [b]
+        b.dependents = [c, d]
+        c.dependents = [a]
+        d.dependents = [d]
+        cycles = find_cycles([a, b, c, d, e])
+        self.assertEqual(sorted([sorted([n.name for n in cycle]) for cycle in cycles]),
+                         [['a', 'b', 'c'], ['d']])
+
+    def test_long_chain(self):
+        nodes = [Node(i) for i in range(5000)]
+        for n, m in zip(nodes, nodes[1:]):
+            n.dependents = [m]
+        self.assertEqual(find_cycles(nodes), [])
+        nodes[-1].dependents = [nodes[0]]
+        self.assertEqual(len(find_cycles(nodes)[0]), 5000)
+
+
+class AcceleratorTest(unittest.TestCase):
+    def iterations(self, method):
+        # x = M.x + b, slowly contracting
+        M = np.array([[0.9, 0.05], [0.02, 0.85]])
+        b = np.array([1.0, 2.0])
+        fixed = np.linalg.solve(np.eye(2) - M, b)
+        accelerator = ACCELERATORS[method]()
+        x = np.zeros(2)
+        for iteration in range(1, 1000):
+            g = np.dot(M, x) + b
+            if np.abs(g - x).max() < 1e-10:
+                break
+            x = accelerator.next(x, g)
+        np.testing.assert_allclose(x, fixed)
+        return iteration
+
+    def test_faster_than_picard(self):
+        picard = self.iterations('picard')
+        self.assertTrue(self.iterations('aitken') < picard)
+        self.assertTrue(self.iterations('anderson') < 10 < picard)
+
+
+class TornEngineTest(unittest.TestCase):
+    def test_torn_at_the_return(self):
+        engine = recirculating(0.1)
+        engine.calculate({})
+        self.assertEqual([t.station.name for t in engine.tears], ['R'])
+        # the loop is closed
+        self.assertAlmostEqual(engine.stations['R'].w, 2.0)
+        self.assertAlmostEqual(engine.stations['R'].t / engine.stations['3a'].t, 1.0, places=8)
+
+    def test_methods_agree(self):
+        results = {}
+        for method in sorted(ACCELERATORS):
+            engine = recirculating(0.1)
+            engine.tear_settings['method'] = method
+            results[method] = (engine.calculate({'RIT': 1500.0})['THRUST'],
+                               engine.tear_iterations)
+        for method in results:
+            self.assertAlmostEqual(results[method][0], results['anderson'][0], places=3)
+        self.assertTrue(results['anderson'][1] < results['picard'][1])
+
+    def test_no_bleed_is_a_turbojet(self):
+        expected = TurboJet().calculate({'RIT': 1500.0, 'FLOW': 20.0, 'HPCPR': 15.0})
+        results = recirculating(0.0).calculate({'RIT': 1500.0})
+        for name in expected:
+            self.assertAlmostEqual(results[name] / expected[name], 1.0)
+
+    def check_batch(self, after_turbine):
+        rits = np.array([1400.0, 1500.0, 1600.0])
+        batch = recirculating(0.05, after_turbine).calculate({'RIT': rits})
+        for i, rit in enumerate(rits):
+            single = recirculating(0.05, after_turbine).calculate({'RIT': rit})
+            for name in single:
+                self.assertAlmostEqual(batch[name][i] / single[name], 1.0)
+
+    def test_batch_matches_single_points(self):
+        self.check_batch(False)
+
+    def test_loop_through_the_turbine(self):
+        self.check_batch(True)
+
+    def test_guarded_batch(self):
+        engine = recirculating(0.05)
+        results, status = engine.calculate_guarded({'RIT': np.array([1400.0, 1500.0, 1600.0]),
+                                                    'BLEED': np.array([0.05, -0.1, 0.05])})
+        np.testing.assert_array_equal(status.feasible, [True, False, True])
+        self.assertTrue(np.isnan(results['THRUST'][1]))
+        single = recirculating(0.05).calculate({'RIT': 1600.0})
+        self.assertAlmostEqual(results['THRUST'][2] / single['THRUST'], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
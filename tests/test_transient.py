@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+import gasprops
+from engines import TurboFan, TurboJet
+from transient import ShaftDynamics, Transient
+
+
+def simulation(engine, **settings):
+    return Transient(engine, {'HPSHAFT': ShaftDynamics(0.05, 30000.0, {
+        'HPCPR': ([0.5, 1.0, 1.2], [10.0, 40.0, 55.0]),
+        'FLOW': ([0.5, 1.0, 1.2], [0.4, 1.0, 1.25])})}, **settings)
+
+
+class TransientTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = TurboJet()
+        self.steady = self.engine.calculate({'RIT': 1500.0})
+        self.wf = self.engine['COMBUSTOR'].fuel_flow()
+
+    def test_steady_point_stays_put(self):
+        sim = simulation(self.engine)
+        history = sim.run(2.0, ([0.0, 10.0], [self.wf, self.wf]))
+        np.testing.assert_allclose(history['HPSHAFT'], 1.0)
+        np.testing.assert_allclose(history['THRUST'], self.steady['THRUST'])
+        stats = sim.stats()
+        self.assertEqual(stats['jacobians'], 1)
+        self.assertTrue(stats['evaluations'] < 1.5 * stats['steps'])
+
+    def test_fuel_step(self):
+        sim = simulation(self.engine)
+        history = sim.run(3.0, ([0.0, 0.5, 0.6, 10.0], [self.wf, self.wf, 1.2*self.wf,
+                                                        1.2*self.wf]))
+        speed = history['HPSHAFT']
+        self.assertEqual(history['t'][-1], 3.0)
+        np.testing.assert_allclose(speed[history['t'] <= 0.5], 1.0)
+        self.assertTrue(np.all(np.diff(speed) >= -1e-9))
+        self.assertTrue(speed[-1] > 1.05)
+        self.assertTrue(history['THRUST'][-1] > self.steady['THRUST'])
+
+    def test_step_size_converges(self):
+        schedule = ([0.0, 0.1, 10.0], [self.wf, 1.2*self.wf, 1.2*self.wf])
+        coarse = simulation(self.engine).run(1.0, schedule)['HPSHAFT'][-1]
+        fine = simulation(self.engine, rtol=1e-6, max_step=0.01).run(1.0, schedule)['HPSHAFT'][-1]
+        # backward Euler is first order, so only roughly
+        self.assertTrue(abs(coarse - fine) < 1e-3)
+
+    def test_engine_restored(self):
+        simulation(self.engine).run(1.0, ([0.0, 0.1, 10.0], [self.wf, 1.3*self.wf, 1.3*self.wf]))
+        self.assertEqual(self.engine['COMBUSTOR'].attributes, {'TEX': 1500.0, 'FHV': 45.0e6})
+        self.assertEqual(self.engine['HPT'].attributes, {})
+        self.assertEqual(self.engine.get_input_alias('HPCPR'), 40.0)
+        self.assertEqual(self.engine.calculate({}), self.steady)
+
+    def test_calibration_stays_with_its_engine(self):
+        other = TurboJet()
+        other.calculate({})
+        fan = TurboFan()
+        fan.calculate({'RIT': 1600.0})
+        sim = Transient(fan, {'HPSHAFT': ShaftDynamics(0.05, 30000.0)})
+        sim.calibrate()
+        self.assertTrue('ER' in fan['HPT'].attributes)
+        self.assertEqual(fan['LPT'].attributes, {})
+        self.assertEqual(other['HPT'].attributes, {})
+        sim.restore()
+        self.assertEqual(fan['HPT'].attributes, {})
+
+
+class CombustionTest(unittest.TestCase):
+    def test_temperature_from_fuel(self):
+        for gas in (gasprops.SemiPerfectGas(), gasprops.PerfectGas()):
+            for t0, t1 in ((700.0, 1600.0), (800.0, 1200.0)):
+                far = gas.combustion_far(t0, t1, 45.0e6)
+                self.assertAlmostEqual(gas.combustion_t(t0, far, 45.0e6), t1, places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
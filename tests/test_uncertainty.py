@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+
+from engines import TurboJet
+from uncertainty import MonteCarlo, Normal, StreamingStats, Triangular, Uniform
+from xcrates import get_test_xrates
+
+
+class StreamingStatsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.rows = np.dot(rng.normal(size=(5000, 3)), [[1, 0.5, 0], [0, 1, 0], [0, 0, 3]])
+        self.rows += [1.0, -2.0, 100.0]
+
+    def check(self, stats):
+        self.assertEqual(stats.n, len(self.rows))
+        np.testing.assert_allclose(stats.mean, self.rows.mean(axis=0))
+        np.testing.assert_allclose(stats.covariance(), np.cov(self.rows.T))
+        np.testing.assert_allclose(stats.correlation(), np.corrcoef(self.rows.T))
+        np.testing.assert_array_equal(stats.min, self.rows.min(axis=0))
+        np.testing.assert_array_equal(stats.max, self.rows.max(axis=0))
+
+    def test_single_pass(self):
+        stats = StreamingStats('abc')
+        stats.update(self.rows)
+        self.check(stats)
+
+    def test_chunks_and_merges(self):
+        parts = []
+        for chunk in np.array_split(self.rows, 7):
+            stats = StreamingStats('abc', reservoir_size=500, seed=1)
+            stats.update(chunk)
+            parts.append(stats)
+        total = StreamingStats('abc', reservoir_size=500, seed=1)
+        for stats in reversed(parts):
+            total.merge(stats)
+        self.check(total)
+        self.assertEqual(total.reservoir.shape, (500, 3))
+        np.testing.assert_allclose(total.quantiles(0.5), np.median(self.rows, axis=0),
+                                   atol=0.3)
+
+    def test_non_finite_rows_skipped(self):
+        stats = StreamingStats('abc')
+        rows = np.vstack([self.rows, [[np.nan, 0.0, 0.0], [0.0, np.inf, 0.0]]])
+        stats.update(rows)
+        self.assertEqual(stats.rejected, 2)
+        self.check(stats)
+
+    def test_summary(self):
+        stats = StreamingStats('abc')
+        stats.update(self.rows)
+        summary = stats.summary()
+        self.assertAlmostEqual(summary['c']['mean'], self.rows[:, 2].mean())
+        self.assertEqual(sorted(summary['a']['quantiles']), [0.05, 0.5, 0.95])
+
+
+class MonteCarloTest(unittest.TestCase):
+    def test_linear_model(self):
+        # x = 100 + (a-1) + 1.3*(b-10) - (c-20)
+        mc = MonteCarlo(get_test_xrates(), {'a': Normal(1.0, 2.0), 'b': Uniform(9.0, 11.0)},
+                        nominal={'c': 20.0})
+        stats = mc.run(100000, chunk_size=30000)
+        summary = stats.summary()
+        self.assertEqual(stats.n, 100000)
+        self.assertAlmostEqual(summary['x']['mean'], 100.0, places=1)
+        expected = (4.0 + 1.3**2 * 4.0 / 12)**0.5
+        self.assertAlmostEqual(summary['x']['std'] / expected, 1.0, places=2)
+
+    def test_chunking_and_workers_agree(self):
+        mc = MonteCarlo(get_test_xrates(), {'a': Triangular(0.0, 1.0, 3.0)},
+                        nominal={'b': 10.0, 'c': 20.0})
+        one = mc.run(4000, chunk_size=1000)
+        two = mc.run(4000, chunk_size=1000, workers=2)
+        np.testing.assert_allclose(one.mean, two.mean)
+        np.testing.assert_allclose(one.comoment, two.comoment)
+
+    def test_engine_left_as_it_was(self):
+        engine = TurboJet()
+        before = engine.calculate({'FLOW': 20.0})
+        mc = MonteCarlo(engine, {'RIT': Normal(1500.0, 20.0), ('HPC', 'PR'): Normal(15.0, 0.5)},
+                        nominal={'FLOW': 25.0}, outputs=['THRUST', 'SFC'])
+        stats = mc.run(2000, chunk_size=500)
+        self.assertEqual(stats.names, ['RIT', 'HPC.PR', 'THRUST', 'SFC'])
+        self.assertEqual(stats.n, 2000)
+        self.assertEqual(engine['HPC']['PR'], 40.0)
+        self.assertEqual(engine.get_input_alias('FLOW'), 20.0)
+        self.assertEqual(engine.calculate({}), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
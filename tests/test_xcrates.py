@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from xcrates import get_test_xrates
+
+
+class SolveInverseTest(unittest.TestCase):
+    def setUp(self):
+        self.xr = get_test_xrates()
+        self.inputs = {'a': 1.5, 'b': 12.0, 'c': 19.0}
+        self.outputs = self.xr.calculate(self.inputs)
+
+    def test_square(self):
+        found = self.xr.solve_inverse(self.outputs)
+        for name in self.inputs:
+            self.assertAlmostEqual(found[name], self.inputs[name])
+
+    def test_fixed(self):
+        found = self.xr.solve_inverse({'x': self.outputs['x'], 'y': self.outputs['y']},
+                                      {'c': 19.0})
+        self.assertEqual(sorted(found), ['a', 'b'])
+        self.assertAlmostEqual(found['a'], 1.5)
+        self.assertAlmostEqual(found['b'], 12.0)
+
+    def test_arrays(self):
+        found = self.xr.solve_inverse({'x': np.array([self.outputs['x'], 100.0]),
+                                       'y': np.array([self.outputs['y'], 200.0])}, {'c': 20.0})
+        self.assertEqual(found['a'].shape, (2,))
+        self.assertAlmostEqual(found['a'][1], 1.0)
+        self.assertAlmostEqual(found['b'][1], 10.0)
+
+    def test_fewer_targets_moves_least(self):
+        found = self.xr.solve_inverse({'x': 101.0})
+        deltas = np.array([found[n] - self.xr.inputs_orig[n] for n in self.xr.xheader])
+        rates = np.array(self.xr.xrates['x'])
+        self.assertAlmostEqual(np.dot(rates, deltas), 1.0)
+        np.testing.assert_allclose(deltas, rates / np.dot(rates, rates))
+
+
+if __name__ == '__main__':
+    unittest.main()